@@ -0,0 +1,110 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+
+
+class EventSampler(logging.Filter):
+    # Drops access log records by event: below the event's minimum level, or
+    # outside its sample rate. Runs in the caller, before anything is formatted.
+    def __init__(self, sampleRates=None, levels=None):
+        super().__init__()
+        self.sampleRates = sampleRates or {}
+        self.levels = levels or {}
+        self.sampledOut = 0
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is None:
+            return True
+        if record.levelno < self.levels.get(event, logging.NOTSET):
+            self.sampledOut += 1
+            return False
+        sampleRate = self.sampleRates.get(event, 1.0)
+        if sampleRate < 1.0 and random.random() >= sampleRate:
+            self.sampledOut += 1
+            return False
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the caller: a full queue drops the record and counts it
+    def __init__(self, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        if getattr(record, 'payload', None) is not None:
+            record.payload = str(record.payload)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonLinesWriter(threading.Thread):
+    # Background thread writing queued records as JSON lines, a batch per write,
+    # through a TimedRotatingFileHandler that also rolls over in this thread
+    C_FIELDS = ['gameId', 'userIdHash', 'sessionId', 'event']
+
+    def __init__(self, recordsQueue, filename, when='M', interval=10, batchSize=256):
+        super().__init__(name='access-log-writer', daemon=True)
+        self.queue = recordsQueue
+        self.fileHandler = logging.handlers.TimedRotatingFileHandler(filename, when=when, interval=interval)
+        self.batchSize = batchSize
+        self.written = 0
+        self._encoder = json.JSONEncoder()
+
+    def toLine(self, record):
+        line = {'time': record.created,
+                'level': record.levelname,
+                'message': record.message}
+        for field in self.C_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                line[field] = value
+        line = self._encoder.encode(line)
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            # payload is JSON already, splice it in instead of encoding it again
+            line = line[:-1] + ', "payload": ' + payload + '}'
+        return line + '\n'
+
+    def run(self):
+        running = True
+        while running:
+            batch = []
+            record = self.queue.get()
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batchSize:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            running = record is not None
+            if batch:
+                self.write(batch)
+
+    def write(self, batch):
+        handler = self.fileHandler
+        if handler.shouldRollover(batch[0]):
+            handler.doRollover()
+        handler.stream.write(''.join(self.toLine(record) for record in batch))
+        handler.flush()
+        self.written += len(batch)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+        self.fileHandler.close()
@@ -0,0 +1,38 @@
+import json
+import logging
+
+import accesslog
+
+
+class Payload:
+    def __str__(self):
+        return '{"word": "кот"}'
+
+
+def test_json_lines_sampling_and_drops(tmp_path):
+    logger = logging.getLogger('accesslog_test')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    sampler = accesslog.EventSampler({'nextWord': 0.0}, {'gameUpdated': logging.WARNING})
+    logger.addFilter(sampler)
+    handler = accesslog.DroppingQueueHandler(3)
+    logger.addHandler(handler)
+
+    extra = {'gameId': 'g', 'userIdHash': 'u', 'sessionId': 's'}
+    logger.info('sending event:%s', 'nextWord', extra=dict(extra, event='nextWord', payload=Payload()))
+    logger.info('sending event:%s', 'gameUpdated', extra=dict(extra, event='gameUpdated'))
+    assert sampler.sampledOut == 2
+    for i in range(5):
+        logger.info('sending event:%s', 'playersUpdated', extra=dict(extra, event='playersUpdated', payload=Payload()))
+    logger.info('client connected', extra=extra)
+    assert handler.dropped == 3
+
+    writer = accesslog.JsonLinesWriter(handler.queue, str(tmp_path / 'access.log'), batchSize=2)
+    writer.start()
+    writer.stop()
+    lines = [json.loads(line) for line in (tmp_path / 'access.log').read_text(encoding='utf-8').splitlines()]
+    assert len(lines) == writer.written == 3
+    assert lines[0]['event'] == 'playersUpdated'
+    assert lines[0]['payload'] == {'word': 'кот'}
+    assert lines[0]['gameId'] == 'g'
+    assert lines[0]['message'] == 'sending event:playersUpdated'
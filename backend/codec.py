@@ -0,0 +1,121 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Wire codecs, negotiated through the WebSocket subprotocol header. A client that asks for
+# no subprotocol (or only unknown ones) speaks JSON text, as before. Every codec encodes the
+# event and data of a frame once into a body, the per-connection seq is added when it is sent.
+#   onlinehat.json    - JSON text, with orjson when it is installed
+#   onlinehat.msgpack - MessagePack binary frames (needs msgpack) with map keys from C_SHORT_KEYS
+#                       replaced by their index; other keys are sent as they are
+
+# Append only: the frontend decodes keys by their position in this list
+C_SHORT_KEYS = [
+    'seq', 'event', 'data', 'gameId', 'game', 'players', 'player', 'playersOrder', 'observersOrder',
+    'name', 'userIdHash', 'owner', 'observer', 'putWordsInHat',
+    'guessedByEpoch', 'explainedByEpoch', 'guessedByCircle', 'explainedByCircle',
+    'guessedTotal', 'explainedTotal',
+    'wordsPerPlayer', 'wordsMode', 'ownerUserIdHash',
+    'gameStateTypingWords', 'gameStatePlaying', 'gameStateEnded',
+    'explainPlayerId', 'guessPlayerId', 'explainPlayerConfirmed', 'guessPlayerConfirmed',
+    'secondsPerRound', 'roundStateConfirmation', 'roundStatePlaying',
+    'roundNumber', 'circleNumber', 'epochNumber', 'initialWordsInHat', 'currentWordsInHat',
+    'gameMode', 'playersPairs', 'pairIndex', 'word', 'words',
+    'version', 'fromVersion', 'removedPlayers', 'roundDeadline', 'events',
+]
+
+
+class JsonCodec:
+    name = 'onlinehat.json'
+    binary = False
+
+    def __init__(self):
+        # event names are few, frames are wrapped for every send
+        self._eventJson = {}
+
+    if orjson is not None:
+        def encode(self, value):
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+        def decode(self, message):
+            return orjson.loads(message)
+    else:
+        def encode(self, value):
+            return json.dumps(value)
+
+        def decode(self, message):
+            return json.loads(message)
+
+    def body(self, event, data, dataJson=None):
+        if dataJson is None:
+            dataJson = self.encode(data)
+        eventJson = self._eventJson.get(event)
+        if eventJson is None:
+            eventJson = self._eventJson[event] = self.encode(event)
+        return '"event": %s, "data": %s}' % (eventJson, dataJson)
+
+    def message(self, seq, body):
+        return '{"seq": %d, %s' % (seq, body)
+
+
+class MsgpackCodec:
+    name = 'onlinehat.msgpack'
+    binary = True
+
+    def __init__(self, shortKeys=C_SHORT_KEYS):
+        self._codes = {key: code for code, key in enumerate(shortKeys)}
+        self._keys = dict(enumerate(shortKeys))
+        self._packer = msgpack.Packer()
+        # 3-entry map header, the seq key and value come right after it
+        self._header = b'\x83' + self._packer.pack(self._codes.get('seq', 'seq'))
+
+    def _shorten(self, value):
+        # lists are homogeneous in every payload: lists of scalars are passed as they are
+        codes = self._codes
+        if type(value) is dict:
+            return {codes.get(key, key): self._shorten(item) if type(item) in (dict, list) else item
+                    for key, item in value.items()}
+        if value and type(value[0]) in (dict, list):
+            return [self._shorten(item) for item in value]
+        return value
+
+    def _restore(self, pairs):
+        keys = self._keys
+        return {keys.get(key, key): item for key, item in pairs}
+
+    def encode(self, value):
+        return self._packer.pack(self._shorten(value) if type(value) in (dict, list) else value)
+
+    def decode(self, message):
+        return msgpack.unpackb(message, strict_map_key=False, object_pairs_hook=self._restore)
+
+    def body(self, event, data, dataJson=None):
+        codes = self._codes
+        pack = self._packer.pack
+        return (pack(codes.get('event', 'event')) + pack(event) +
+                pack(codes.get('data', 'data')) + self.encode(data))
+
+    def message(self, seq, body):
+        return self._header + self._packer.pack(seq) + body
+
+
+JSON = JsonCodec()
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    MSGPACK = MsgpackCodec()
+    CODECS[MSGPACK.name] = MSGPACK
+
+# offered to clients in order of preference
+SUBPROTOCOLS = [name for name in (MsgpackCodec.name, JsonCodec.name) if name in CODECS]
+
+
+def negotiated(subprotocol):
+    return CODECS.get(subprotocol, JSON)
@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import json
+import time
+
+import codec
+from main import Game, Player, DetachedConnection
+
+
+def realPayloads(numPlayers, wordsPerPlayer=10):
+    # gameUpdated and playersUpdated of a game in its first round
+    game = Game('bench', wordsPerPlayer)
+    for playerIndex in range(numPlayers):
+        userIdHash = '%040x' % playerIndex
+        player = Player(DetachedConnection(userIdHash), 'player_%d' % playerIndex)
+        asyncio.get_event_loop().run_until_complete(game.addPlayer(player))
+        game._playerWords[userIdHash] = ['word_%d_%d' % (playerIndex, i) for i in range(wordsPerPlayer)]
+    game.seed(1)
+    game._prepareGame()
+    game.roundNumber = game.circleNumber = game.epochNumber = 0
+    game.explainPlayerIndex, game.guessPlayerIndex = 0, 1
+    return [('gameUpdated', {'game': game.toDict()}),
+            ('playersUpdated', {'players': game.allPlayersDictsList(), 'playersOrder': game.playersOrder})]
+
+
+class StdlibJson(codec.JsonCodec):
+    # what Connection.send did before codecs
+    name = 'stdlib json'
+
+    def encode(self, value):
+        return json.dumps(value)
+
+    def decode(self, message):
+        return json.loads(message)
+
+
+def measure(wireCodec, event, data, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        message = wireCodec.message(i, wireCodec.body(event, data))
+    encodeCost = (time.perf_counter() - start) / repeat * 1e6
+    start = time.perf_counter()
+    for i in range(repeat):
+        wireCodec.decode(message)
+    decodeCost = (time.perf_counter() - start) / repeat * 1e6
+    size = len(message.encode() if isinstance(message, str) else message)
+    return encodeCost, decodeCost, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Encode/decode cost and size of real state payloads per codec')
+    parser.add_argument('--players', type=int, nargs='+', default=[4, 12, 30])
+    parser.add_argument('--repeat', type=int, default=5000)
+    args = parser.parse_args()
+    codecs = [StdlibJson()] + list(codec.CODECS.values())
+    if codec.orjson is None:
+        print('orjson is not installed, %s uses the stdlib json' % codec.JsonCodec.name)
+    if codec.msgpack is None:
+        print('msgpack is not installed, %s is not available' % codec.MsgpackCodec.name)
+    print('%8s %15s %18s %12s %12s %8s' % ('players', 'event', 'codec', 'encode us', 'decode us', 'bytes'))
+    for numPlayers in args.players:
+        for event, data in realPayloads(numPlayers):
+            for wireCodec in codecs:
+                encodeCost, decodeCost, size = measure(wireCodec, event, data, args.repeat)
+                print('%8d %15s %18s %12.1f %12.1f %8d' % (numPlayers, event, wireCodec.name,
+                                                          encodeCost, decodeCost, size))
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import codec
+
+
+def test_json_message():
+    body = codec.JSON.body('playersUpdated', {'players': [{'name': 'игрок', 'owner': True}]})
+    message = codec.JSON.message(3, body)
+    assert isinstance(message, str)
+    assert json.loads(message) == {'seq': 3, 'event': 'playersUpdated',
+                                   'data': {'players': [{'name': 'игрок', 'owner': True}]}}
+    assert codec.JSON.decode(message)['seq'] == 3
+
+
+def test_negotiated_falls_back_to_json():
+    assert codec.negotiated(None) is codec.JSON
+    assert codec.negotiated('unknown') is codec.JSON
+    assert codec.negotiated(codec.JsonCodec.name) is codec.JSON
+
+
+def test_msgpack_short_keys():
+    msgpack = pytest.importorskip('msgpack')
+    wireCodec = codec.negotiated(codec.MsgpackCodec.name)
+    data = {'game': {'roundNumber': 2, 'playersOrder': ['a', 'b']},
+            'players': [{'name': 'игрок', 'guessedTotal': 1, 'unknownField': None}]}
+    message = wireCodec.message(12345, wireCodec.body('gameUpdated', data))
+    assert isinstance(message, bytes)
+    raw = msgpack.unpackb(message, strict_map_key=False)
+    keys = codec.C_SHORT_KEYS
+    assert raw[keys.index('seq')] == 12345
+    assert raw[keys.index('event')] == 'gameUpdated'
+    player = raw[keys.index('data')][keys.index('players')][0]
+    assert player[keys.index('guessedTotal')] == 1
+    assert player['unknownField'] is None
+    assert wireCodec.decode(message) == {'seq': 12345, 'event': 'gameUpdated', 'data': data}
+    assert len(message) < len(codec.JSON.message(12345, codec.JSON.body('gameUpdated', data)).encode())
@@ -0,0 +1,78 @@
+import mmap
+import os
+import struct
+import tempfile
+
+# Compiled dictionary: header (magic, word count), count + 1 little-endian uint64
+# offsets into the blob, then the UTF-8 blob of all words back to back.
+C_MAGIC = b'OHD1'
+C_HEADER = struct.Struct('<4sQ')
+C_OFFSET = struct.Struct('<Q')
+C_OFFSETS_PAIR = struct.Struct('<QQ')
+
+
+def compileDict(textPath, dictPath):
+    offsets = [0]
+    blob = bytearray()
+    with open(textPath, encoding='utf-8') as infile:
+        for line in infile:
+            line = line.strip()
+            if line != '':
+                blob += line.encode('utf-8')
+                offsets.append(len(blob))
+    # workers forked together may compile the same dictionary at once: each one writes
+    # its own temporary file, the last rename wins with identical contents
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(dictPath) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(C_HEADER.pack(C_MAGIC, len(offsets) - 1))
+            outfile.write(struct.pack('<%dQ' % len(offsets), *offsets))
+            outfile.write(blob)
+        # mkstemp makes the file private to its owner
+        os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, dictPath)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+class MappedDict:
+    # Read-only word list backed by a memory-mapped compiled dictionary.
+    # The pages are shared between all processes mapping the same file.
+    def __init__(self, dictPath):
+        with open(dictPath, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = C_HEADER.unpack_from(self._mmap, 0)
+        if magic != C_MAGIC:
+            raise ValueError('Not a compiled dictionary: ' + dictPath)
+        self._blobStart = C_HEADER.size + C_OFFSET.size * (self._count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('dictionary index out of range')
+        start, end = C_OFFSETS_PAIR.unpack_from(self._mmap, C_HEADER.size + C_OFFSET.size * index)
+        return self._mmap[self._blobStart + start:self._blobStart + end].decode('utf-8')
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def close(self):
+        self._mmap.close()
+
+
+def loadDicts(dictsDir, names):
+    # compiles <name>.txt into <name>.dict when the compiled file is missing or stale
+    dicts = {}
+    for name in names:
+        textPath = os.path.join(dictsDir, name + '.txt')
+        dictPath = os.path.join(dictsDir, name + '.dict')
+        if not os.path.exists(dictPath) or os.path.getmtime(dictPath) < os.path.getmtime(textPath):
+            compileDict(textPath, dictPath)
+        dicts[name] = MappedDict(dictPath)
+    return dicts
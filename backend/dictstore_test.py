@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+
+from dictstore import compileDict, loadDicts, MappedDict
+
+
+def test_compiled_dict(tmp_path):
+    words = ['кот', 'hat', 'слово с пробелом']
+    (tmp_path / 'test.txt').write_text('\n'.join(words[:2]) + '\n\n  ' + words[2] + '  \n', encoding='utf-8')
+    dicts = loadDicts(str(tmp_path), ['test'])
+    mapped = dicts['test']
+    assert len(mapped) == 3
+    assert list(mapped) == words
+    assert mapped[-1] == words[2]
+    mapped.close()
+
+    compileDict(str(tmp_path / 'test.txt'), str(tmp_path / 'other.dict'))
+    assert list(MappedDict(str(tmp_path / 'other.dict'))) == words
+
+
+def test_compile_in_forked_workers(tmp_path):
+    words = ['word_%d' % i for i in range(100000)]
+    (tmp_path / 'test.txt').write_text('\n'.join(words), encoding='utf-8')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=loadDicts, args=(str(tmp_path), ['test'])) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    assert sorted(os.listdir(str(tmp_path))) == ['test.dict', 'test.txt']
+    assert list(MappedDict(str(tmp_path / 'test.dict'))) == words
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+import main
+from main import Game, Player, DetachedConnection, Frame
+from spectators import SpectatorHub
+
+# In-process benchmarks of the Game engine hot paths, with players on no-op connections.
+# Results are checked against a baseline saved on the same machine: a case more than
+# --tolerance slower than its baseline fails the check (exit status 1).
+
+C_BASELINE_PATH = 'game_bench_baseline.json'
+C_TOLERANCE = 1.0
+C_WORDS_PER_ROUND = 10
+C_MIN_TIME = 0.2
+C_MAX_RUNS = 100
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def newGame(numPlayers, wordsPerPlayer, started=False):
+    game = Game('bench', wordsPerPlayer)
+    for playerIndex in range(numPlayers):
+        userIdHash = '%040x' % playerIndex
+        run(game.addPlayer(Player(DetachedConnection(userIdHash), 'player_%d' % playerIndex)))
+        game.addWords(userIdHash, ['word_%d_%d' % (playerIndex, i) for i in range(wordsPerPlayer)])
+    game.seed(1)
+    if started:
+        game._prepareGame()
+        run(game.startRound())
+    return game
+
+
+def playRounds(game, rounds):
+    for roundIndex in range(rounds):
+        for i in range(C_WORDS_PER_ROUND):
+            if len(game._wordsInHat) > 1:
+                game.wordGuessed()
+        run(game.startRound())
+
+
+# every benchmark gets its parameters and returns (operations, timed function)
+
+def joinStorm(players):
+    game = Game('bench', 10)
+    joining = [Player(DetachedConnection('%040x' % i), 'player_%d' % i) for i in range(players)]
+
+    async def join():
+        for player in joining:
+            await game.addPlayer(player)
+    return players, lambda: run(join())
+
+
+def prepareGame(players, words):
+    game = newGame(players, words)
+    return players * words, game._prepareGame
+
+
+def rounds(players, rounds):
+    game = newGame(players, 10, started=True)
+
+    async def forwardAndBack():
+        for i in range(rounds):
+            await game.startRound()
+        for i in range(rounds):
+            await game.replayPreviousRound()
+    return 2 * rounds, lambda: run(forwardAndBack())
+
+
+def wordGuessed(players, words):
+    game = newGame(players, words, started=True)
+    guesses = players * words
+
+    async def guessAll():
+        for i in range(guesses):
+            game.wordGuessed()
+            await game.giveNextWord()
+            if i % C_WORDS_PER_ROUND == C_WORDS_PER_ROUND - 1:
+                await game.startRound()
+    return guesses, lambda: run(guessAll())
+
+
+def toDict(players, calls=1000):
+    game = newGame(players, 10, started=True)
+    playRounds(game, 2 * players)
+    return calls, lambda: [game.toDict() for i in range(calls)]
+
+
+def allPlayersDictsList(players, calls=100):
+    game = newGame(players, 10, started=True)
+    playRounds(game, 2 * players)
+    return calls * players, lambda: [game.allPlayersDictsList() for i in range(calls)]
+
+
+class Watcher(DetachedConnection):
+    closed = False
+
+
+def broadcast(players, spectators, events=1000):
+    # per event cost of a watched game, the spectators' snapshot goes out once per interval
+    game = newGame(players, 10, started=True)
+    main.SPECTATORS = SpectatorHub(lambda gameId: Frame('spectatorSnapshot', {'game': game.toDict(),
+                                                                              'players': game.allPlayersDictsList()}))
+    for i in range(spectators):
+        main.SPECTATORS.add(game.gameId, Watcher('spectator_%d' % i))
+
+    async def notify():
+        for i in range(events):
+            await game.notifyAllPlayers('gameUpdated', {'game': game.toDict()})
+        main.SPECTATORS.flush()
+    return events, lambda: run(notify())
+
+
+C_CASES = [
+    (joinStorm, [{'players': 10}, {'players': 50}, {'players': 200}]),
+    (prepareGame, [{'players': 10, 'words': 10}, {'players': 10, 'words': 1000},
+                   {'players': 200, 'words': 10}, {'players': 200, 'words': 1000}]),
+    (rounds, [{'players': 10, 'rounds': 100}, {'players': 10, 'rounds': 10000},
+              {'players': 200, 'rounds': 1000}]),
+    (wordGuessed, [{'players': 10, 'words': 10}, {'players': 10, 'words': 1000},
+                   {'players': 200, 'words': 10}]),
+    (toDict, [{'players': 10}, {'players': 200}]),
+    (allPlayersDictsList, [{'players': 10}, {'players': 200}]),
+    (broadcast, [{'players': 10, 'spectators': 0}, {'players': 10, 'spectators': 5000}]),
+]
+
+
+def caseName(benchmark, params):
+    return '%s[%s]' % (benchmark.__name__, ','.join('%s=%s' % item for item in sorted(params.items())))
+
+
+def measure(benchmark, params, repeat):
+    # best of at least repeat runs, each on a fresh setup; short cases run until C_MIN_TIME is spent
+    best = None
+    spent = 0
+    runs = 0
+    while runs < repeat or (spent < C_MIN_TIME and runs < C_MAX_RUNS):
+        operations, timed = benchmark(**params)
+        start = time.perf_counter()
+        timed()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        spent += elapsed
+        runs += 1
+    return operations, best
+
+
+def environment():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Game engine and check it against a baseline')
+    parser.add_argument('--baseline', default=C_BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=C_TOLERANCE,
+                        help='allowed slowdown against the baseline, 1.0 is twice as slow')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--filter', default='', help='only cases whose name contains this')
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = None
+    if baseline is not None and baseline['environment'] != environment():
+        print('baseline was recorded in another environment: %s' % baseline['environment'])
+
+    results = {}
+    regressions = []
+    print('%-40s %10s %12s %12s %8s' % ('case', 'ops', 'total ms', 'us/op', 'vs base'))
+    for benchmark, paramsList in C_CASES:
+        for params in paramsList:
+            name = caseName(benchmark, params)
+            if args.filter not in name:
+                continue
+            operations, elapsed = measure(benchmark, params, args.repeat)
+            results[name] = elapsed
+            base = baseline['results'].get(name) if baseline is not None else None
+            ratio = '-' if base is None else '%.2f' % (elapsed / base)
+            if base is not None and elapsed > base * (1 + args.tolerance):
+                regressions.append(name)
+                ratio += ' !'
+            print('%-40s %10d %12.2f %12.3f %8s' % (name, operations, elapsed * 1e3,
+                                                    elapsed / operations * 1e6, ratio))
+
+    if args.save:
+        if baseline is not None and baseline['environment'] == environment():
+            results = dict(baseline['results'], **results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1, sort_keys=True)
+        print('baseline saved to %s' % args.baseline)
+    elif regressions:
+        print('slower than the baseline by more than %d%%: %s' % (args.tolerance * 100, ', '.join(regressions)))
+        sys.exit(1)
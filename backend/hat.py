@@ -0,0 +1,45 @@
+import random
+
+
+class Hat:
+    # Words left in the hat. The current word is drawn lazily with one step of
+    # Fisher-Yates shuffle and kept at the end of the list, so drawing, removing
+    # a guessed word and putting a word back are all O(1).
+    def __init__(self, words=None, rng=random):
+        self._words = list(words) if words is not None else []
+        self._drawn = False
+        self._rng = rng
+
+    def __len__(self):
+        return len(self._words)
+
+    def current(self):
+        if not self._words:
+            return None
+        if not self._drawn:
+            last = len(self._words) - 1
+            i = self._rng.randint(0, last)
+            self._words[i], self._words[last] = self._words[last], self._words[i]
+            self._drawn = True
+        return self._words[-1]
+
+    def remove(self):
+        if not self._words:
+            return None
+        word = self.current()
+        self._words.pop()
+        self._drawn = False
+        return word
+
+    def putBack(self):
+        # the current word goes back among the others, the next one is drawn anew
+        self._drawn = False
+
+    def toSnapshot(self):
+        return {'words': list(self._words), 'drawn': self._drawn}
+
+    @classmethod
+    def fromSnapshot(cls, state, rng=random):
+        hat = cls(state['words'], rng)
+        hat._drawn = state['drawn']
+        return hat
@@ -0,0 +1,49 @@
+import argparse
+import random
+import time
+
+from hat import Hat
+
+
+def playListHat(words, wordsPerRound):
+    # what Game did before Hat: reshuffle every round, slice off every guessed word
+    wordsInHat = list(words)
+    while wordsInHat:
+        random.shuffle(wordsInHat)
+        for i in range(wordsPerRound):
+            if not wordsInHat:
+                break
+            word = wordsInHat[0]
+            wordsInHat = wordsInHat[1:]
+
+
+def playHat(words, wordsPerRound):
+    hat = Hat(words)
+    while len(hat):
+        hat.putBack()
+        for i in range(wordsPerRound):
+            if not len(hat):
+                break
+            word = hat.current()
+            hat.remove()
+
+
+def measure(play, hatSize, wordsPerRound):
+    words = [str(i) for i in range(hatSize)]
+    start = time.perf_counter()
+    play(words, wordsPerRound)
+    return (time.perf_counter() - start) / hatSize * 1e9
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-word cost of drawing the whole hat')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000, 16000, 64000])
+    parser.add_argument('--words-per-round', type=int, default=10)
+    parser.add_argument('--max-list-size', type=int, default=16000,
+                        help='skip the quadratic list hat above this size')
+    args = parser.parse_args()
+    print('%10s %16s %16s' % ('hat size', 'list ns/word', 'Hat ns/word'))
+    for hatSize in args.sizes:
+        listCost = measure(playListHat, hatSize, args.words_per_round) if hatSize <= args.max_list_size else None
+        hatCost = measure(playHat, hatSize, args.words_per_round)
+        print('%10d %16s %16.0f' % (hatSize, '-' if listCost is None else '%.0f' % listCost, hatCost))
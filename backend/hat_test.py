@@ -0,0 +1,32 @@
+import collections
+import random
+
+from hat import Hat
+
+
+def test_draw_remove_put_back():
+    random.seed(1)
+    hat = Hat(['a', 'b', 'c'])
+    word = hat.current()
+    assert hat.current() == word
+    hat.putBack()
+    assert len(hat) == 3
+    guessed = []
+    while len(hat):
+        word = hat.current()
+        assert hat.current() == word
+        guessed.append(hat.remove())
+    assert sorted(guessed) == ['a', 'b', 'c']
+    assert hat.current() is None
+    assert hat.remove() is None
+
+
+def test_draw_is_uniform():
+    random.seed(2)
+    counts = collections.Counter()
+    hat = Hat(range(10))
+    for i in range(20000):
+        counts[hat.current()] += 1
+        hat.putBack()
+    assert sorted(counts) == list(range(10))
+    assert min(counts.values()) > 1700
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import random
+import time
+import traceback
+
+import websockets
+
+import codec
+
+# Load generator: plays many simulated games against a running server through the whole
+# game flow and reports event throughput and event-to-broadcast latency percentiles.
+# Latency of an event is the time from sending it until the broadcast it causes arrives:
+#   playerJoined   -> playersUpdated to the joining player
+#   putWordsInHat  -> playersUpdated to the player
+#   gameStarted    -> gameUpdated of the first round to the owner
+#   roundConfirmed -> nextWord to the guessing player, once both players confirmed
+#   wordGuessed    -> nextWord to the explaining player (or gameUpdated when the hat is empty)
+#   roundComplete  -> gameUpdated of the next round to the guessing player
+
+
+def randomId():
+    return '%016x' % random.getrandbits(64)
+
+
+class Timeout(Exception):
+    pass
+
+
+class Client:
+    def __init__(self, websocket, stats, timeout):
+        self.websocket = websocket
+        self.wireCodec = codec.negotiated(websocket.subprotocol)
+        self.stats = stats
+        self.timeout = timeout
+        self.userIdHash = None
+        self._waiters = []
+        self._reader = asyncio.ensure_future(self._readLoop())
+
+    @classmethod
+    async def connect(cls, uri, stats, args, gameId=None):
+        cookie = 'userId=load_%s; sessionId=load_%s;' % (randomId(), randomId())
+        if gameId is not None:
+            cookie = 'gameId=%s; ' % gameId + cookie
+        subprotocols = [args.subprotocol] if args.subprotocol else None
+        websocket = await websockets.connect(uri, extra_headers={'Cookie': cookie}, subprotocols=subprotocols)
+        return cls(websocket, stats, args.timeout)
+
+    async def _readLoop(self):
+        try:
+            async for message in self.websocket:
+                self.stats.received += 1
+                message = self.wireCodec.decode(message)
+                for waiter in list(self._waiters):
+                    predicate, future = waiter
+                    if predicate(message) and not future.done():
+                        future.set_result(message)
+                        self._waiters.remove(waiter)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        for predicate, future in self._waiters:
+            if not future.done():
+                future.set_exception(ConnectionError('connection closed'))
+
+    def expect(self, *events, condition=None):
+        # registered before the event causing it is sent, so it can not be missed
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((lambda message: message['event'] in events and
+                              (condition is None or condition(message['data'])), future))
+        return future
+
+    async def send(self, event, data):
+        self.stats.sent += 1
+        await self.websocket.send(self.wireCodec.encode({'event': event, 'data': data}))
+
+    async def request(self, event, data, expected):
+        # sends the event and waits for the broadcast it causes (expected by any client)
+        start = time.perf_counter()
+        await self.send(event, data)
+        try:
+            message = await asyncio.wait_for(expected, self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise Timeout(event)
+        self.stats.latencies.setdefault(event, []).append(time.perf_counter() - start)
+        return message
+
+    async def close(self):
+        await self.websocket.close()
+        await self._reader
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.games = 0
+        self.latencies = {}
+
+    def merge(self, other):
+        self.sent += other.sent
+        self.received += other.received
+        self.timeouts += other.timeouts
+        self.errors += other.errors
+        self.games += other.games
+        for event, latencies in other.latencies.items():
+            self.latencies.setdefault(event, []).extend(latencies)
+
+
+def roundStarted(roundNumber):
+    return lambda data: data['game']['gameStateEnded'] or (data['game']['roundNumber'] == roundNumber and
+                                                           data['game']['roundStateConfirmation'])
+
+
+async def playGame(uri, args, stats):
+    owner = await Client.connect(uri, stats, args)
+    created = owner.expect('gameCreated')
+    await owner.send('gameCreated', {'game': {'wordsPerPlayer': args.words}, 'player': {'name': 'owner'}})
+    gameId = (await asyncio.wait_for(created, args.timeout))['data']['gameId']
+    clients = [owner]
+    try:
+        for index in range(args.players - 1):
+            clients.append(await Client.connect(uri, stats, args, gameId))
+        for index, client in enumerate(clients):
+            userIdHash = client.expect('userIdHash')
+            await client.request('playerJoined', {'gameId': gameId, 'player': {'name': 'player_%d' % index}},
+                                 client.expect('playersUpdated'))
+            client.userIdHash = (await userIdHash)['data']['userIdHash']
+        for client in clients:
+            await client.request('putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                   'words': [randomId() for i in range(args.words)]},
+                                 client.expect('playersUpdated'))
+        byUserIdHash = {client.userIdHash: client for client in clients}
+        game = (await owner.request('gameStarted', {'gameId': gameId, 'secondsPerRound': 60, 'gameMode': 'CIRCLE'},
+                                    owner.expect('gameUpdated', condition=roundStarted(0))))['data']['game']
+        while not game['gameStateEnded']:
+            explainer = byUserIdHash[game['explainPlayerId']]
+            guesser = byUserIdHash[game['guessPlayerId']]
+            confirm = {'gameId': gameId, 'roundNumber': game['roundNumber']}
+            word = explainer.expect('nextWord')
+            await explainer.send('roundConfirmed', confirm)
+            await guesser.request('roundConfirmed', confirm, guesser.expect('nextWord'))
+            await asyncio.wait_for(word, args.timeout)
+            for i in range(args.round_words):
+                if args.guess_rate:
+                    await asyncio.sleep(random.expovariate(args.guess_rate))
+                message = await explainer.request('wordGuessed', {'gameId': gameId}, explainer.expect(
+                    'nextWord', 'gameUpdated', condition=lambda data: 'word' in data or data['game']['gameStateEnded']))
+                if message['event'] == 'gameUpdated':
+                    game = message['data']['game']
+                    break
+            else:
+                game = (await explainer.request('roundComplete', {'gameId': gameId, 'lastWordResult': 'NOT_GUESSED'},
+                                                guesser.expect('gameUpdated',
+                                                               condition=roundStarted(game['roundNumber'] + 1))
+                                                ))['data']['game']
+        stats.games += 1
+    finally:
+        for client in clients:
+            await client.close()
+
+
+async def runGames(uri, args, numGames, stats):
+    async def play(index):
+        # games start spread over the ramp-up, a failed game is only counted
+        await asyncio.sleep(args.ramp * index / max(numGames, 1))
+        try:
+            await playGame(uri, args, stats)
+        except (Timeout, ConnectionError, OSError, websockets.exceptions.WebSocketException, asyncio.TimeoutError):
+            stats.errors += 1
+
+    await asyncio.gather(*[play(index) for index in range(numGames)])
+    return stats
+
+
+def runProcess(uri, args, numGames, results):
+    # the parent waits for the stats of every process, whatever happens here
+    stats = Stats()
+    try:
+        asyncio.new_event_loop().run_until_complete(runGames(uri, args, numGames, stats))
+    except BaseException:
+        traceback.print_exc()
+        stats.errors = numGames - stats.games
+    finally:
+        results.put(stats)
+
+
+def percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+def report(stats, elapsed):
+    print('games played %d, failed %d, timeouts %d, %.1f s' % (stats.games, stats.errors, stats.timeouts, elapsed))
+    print('events sent %d (%.0f/s), messages received %d (%.0f/s)' %
+          (stats.sent, stats.sent / elapsed, stats.received, stats.received / elapsed))
+    print('%15s %8s %10s %10s %10s %10s' % ('event', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for event, latencies in sorted(stats.latencies.items()) + [('all', sum(stats.latencies.values(), []))]:
+        if not latencies:
+            continue
+        latencies = sorted(latencies)
+        print('%15s %8d %10.2f %10.2f %10.2f %10.2f' % (
+            event, len(latencies), percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.95) * 1e3,
+            percentile(latencies, 0.99) * 1e3, latencies[-1] * 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play simulated games against a local server')
+    parser.add_argument('--uri', default='ws://localhost:8080/wsapiv1')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--players', type=int, default=6, help='players per game')
+    parser.add_argument('--words', type=int, default=10, help='words per player')
+    parser.add_argument('--round-words', type=int, default=5, help='words guessed per round')
+    parser.add_argument('--guess-rate', type=float, default=4,
+                        help='guesses per second of an explaining player, 0 for as fast as possible; '
+                             'the server drops wordGuessed over C_EVENT_RATE_LIMITS')
+    parser.add_argument('--ramp', type=float, default=1, help='seconds over which games are started')
+    parser.add_argument('--processes', type=int, default=1, help='load generating processes')
+    parser.add_argument('--subprotocol', default=None, choices=sorted(codec.CODECS))
+    parser.add_argument('--timeout', type=float, default=10)
+    args = parser.parse_args()
+    if not args.uri.startswith(('ws://localhost', 'ws://127.0.0.1', 'ws://[::1]')):
+        parser.error('refusing to load a server that is not local: %s' % args.uri)
+    start = time.perf_counter()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=runProcess,
+                                         args=(args.uri, args, len(range(index, args.games, args.processes)), results))
+                 for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    stats = Stats()
+    pending = len(processes)
+    while pending:
+        # stats put by processes that exited before the get are in the queue by then
+        exited = all(process.exitcode is not None for process in processes)
+        try:
+            stats.merge(results.get(timeout=1))
+            pending -= 1
+        except queue.Empty:
+            # a process killed before it put its stats
+            if exited:
+                print('%d load processes exited without stats, exit codes %s' %
+                      (pending, [process.exitcode for process in processes]))
+                break
+    for process in processes:
+        process.join()
+    report(stats, time.perf_counter() - start)
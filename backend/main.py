@@ -1,4 +1,7 @@
 import asyncio
+import atexit
+import bisect
+import collections
 import pathlib
 import ssl
 import websockets
@@ -8,25 +11,47 @@ import json
 import time
 import uuid
 import hashlib
+import http
+import os
+import urllib.parse
 import logging
 import logging.handlers
 import types
 import sys
 import traceback
 
+import accesslog
+import codec
+import metrics
+import profiling
+import ratelimit
+import recording
+import schemas
+from hat import Hat
+from schedule import RoundSchedule
+from timerwheel import TimerWheel
+from spectators import SpectatorHub
+from dictstore import loadDicts
+from persistence import GameJournal
+from workers import workerOf
+
+
+# Access log records go through a bounded queue to a background thread writing JSON lines,
+# handlers never wait for the disk. Event records can be sampled or raised to a minimum level:
+# C_ACCESS_LOG_SAMPLE_RATES = {'nextWord': 0.01} keeps 1% of nextWord records.
+C_ACCESS_LOG_QUEUE_SIZE = 100000
+C_ACCESS_LOG_SAMPLE_RATES = {}
+C_ACCESS_LOG_LEVELS = {}
 
-# create logger with 'spam_application'
 access_logger = logging.getLogger('access_log')
 access_logger.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-#fh = logging.StreamHandler()
-fh = logging.handlers.TimedRotatingFileHandler('server_access.log', interval=10, when='M')
-fh.setLevel(logging.DEBUG)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - GameId:%(gameId)s - UserIdHash:%(userIdHash)s - sessionId:%(sessionId)s - %(message)s')
-fh.setFormatter(formatter)
-# add the handlers to the logger
-access_logger.addHandler(fh)
+access_sampler = accesslog.EventSampler(C_ACCESS_LOG_SAMPLE_RATES, C_ACCESS_LOG_LEVELS)
+access_logger.addFilter(access_sampler)
+access_queue_handler = accesslog.DroppingQueueHandler(C_ACCESS_LOG_QUEUE_SIZE)
+access_logger.addHandler(access_queue_handler)
+access_writer = accesslog.JsonLinesWriter(access_queue_handler.queue, 'server_access.log', interval=10, when='M')
+access_writer.start()
+atexit.register(access_writer.stop)
 
 # create logger with 'spam_application'
 error_logger = logging.getLogger('error_log')
@@ -34,7 +59,7 @@ error_logger.setLevel(logging.DEBUG)
 # create file handler which logs even debug messages
 error_sh = logging.StreamHandler()
 error_fh = logging.handlers.TimedRotatingFileHandler('server_error.log', interval=10, when='M')
-fh.setLevel(logging.DEBUG)
+error_fh.setLevel(logging.DEBUG)
 # create formatter and add it to the handlers
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - GameId:%(gameId)s - UserIdHash:%(userIdHash)s - sessionId:%(sessionId)s - %(message)s')
 error_fh.setFormatter(formatter)
@@ -43,8 +68,78 @@ error_sh.setFormatter(formatter)
 error_logger.addHandler(error_sh)
 error_logger.addHandler(error_fh)
 
+# served as text on C_METRICS_PATH of the WebSocket port
+C_METRICS_PATH = '/metrics'
+# Profiler control, only when ONLINEHAT_PROFILE_TOKEN is set:
+#   /profile?token=T[&gameId=G][&event=E][&seconds=S][&threshold=0.05] starts profiling
+#   /profile?token=T&stop=1 stops it and writes collapsed stacks to C_PROFILE_DIR
+C_PROFILE_PATH = '/profile'
+C_PROFILE_DIR = 'profiles'
+C_PROFILE_TOKEN = os.environ.get('ONLINEHAT_PROFILE_TOKEN')
+PROFILER = profiling.Profiler(C_PROFILE_DIR)
+# Recording of dispatched events for replay.py, only when ONLINEHAT_RECORDING names its file
+C_RECORDING_PATH = os.environ.get('ONLINEHAT_RECORDING')
+RECORDER = recording.EventRecorder(C_RECORDING_PATH) if C_RECORDING_PATH else None
+if RECORDER is not None:
+    atexit.register(RECORDER.stop)
+METRICS = metrics.Metrics()
+broadcastLatency = METRICS.histogram('onlinehat_broadcast_seconds',
+                                     'Time to queue one broadcast frame for every player of a game')
+loopLag = METRICS.histogram('onlinehat_event_loop_lag_seconds', 'How late the event loop wakes up a sleeping task')
+
+
+class ScoreTimeline:
+    # Fenwick tree of points indexed by round (circle, epoch) number + _offset:
+    # O(log n) point update and O(log n) sum over any range of numbers.
+    # Rounds replayed back before round 0 have negative numbers, they shift the tree
+    __slots__ = ('_tree', '_offset')
+
+    def __init__(self):
+        self._tree = [0, 0]
+        self._offset = 0
+
+    def add(self, number, points):
+        if number + self._offset < 0:
+            self._shift(max(-number - self._offset, len(self._tree) - 1))
+        while number + self._offset + 1 >= len(self._tree):
+            self._grow()
+        i = number + self._offset + 1
+        while i < len(self._tree):
+            self._tree[i] += points
+            i += i & -i
+
+    def _grow(self):
+        size = len(self._tree) - 1
+        total = self.prefix(size - self._offset)
+        self._tree.extend([0] * size)
+        self._tree[2 * size] = total
+
+    def _shift(self, by):
+        numbers = range(-self._offset, len(self._tree) - 1 - self._offset)
+        points = [(number, self.range(number, number + 1)) for number in numbers]
+        self._tree = [0, 0]
+        self._offset += by
+        for number, value in points:
+            if value:
+                self.add(number, value)
+
+    def prefix(self, stop):
+        # points for numbers below stop
+        i = max(0, min(stop + self._offset, len(self._tree) - 1))
+        points = 0
+        while i > 0:
+            points += self._tree[i]
+            i -= i & -i
+        return points
+
+    def range(self, start, stop):
+        return self.prefix(stop) - self.prefix(start)
+
 
 class Player:
+    __slots__ = ('connection', 'userIdHash', 'name', 'owner', 'putWordsInHat', 'observer',
+                 'guessedTotal', 'explainedTotal', '_timelines', '_countersKey', '_counters')
+
     def __init__(self, connection, name, owner=False, userIdHash=None, putWordsInHat=False, observer=False):
         self.connection = connection
         self.userIdHash = connection.userIdHash
@@ -52,45 +147,82 @@ class Player:
         self.owner = owner
         self.putWordsInHat = putWordsInHat
         self.observer = observer
-        self._results = {}
+
+        self.guessedTotal = 0
+        self.explainedTotal = 0
+        # [guessed, explained] by round, by circle, by epoch; created with the first point
+        self._timelines = None
+        # points of finished epochs and circles [guessed, explained, guessed, explained],
+        # valid for _countersKey == (epochNumber, circleNumber)
+        self._countersKey = None
+        self._counters = [0, 0, 0, 0]
 
     def update(self, observer = None):
         if observer is not None:
             self.observer = observer
 
     def givePoint(self, pairUserIdHash, epochNumber, circleNumber, roundNumber, isExplain = False):
-        if (epochNumber, circleNumber, roundNumber, isExplain) not in self._results:
-            self._results[(epochNumber, circleNumber, roundNumber, isExplain)] = 0
-        self._results[(epochNumber, circleNumber, roundNumber, isExplain)] += 1
-
-    def toDict(self, gameEpochNumber, gameCircleNumber, gameRoundNumber):
-        guessedByEpoch = 0
-        explainedByEpoch = 0
-
-        guessedByCircle = 0
-        explainedByCircle = 0
-
-        guessedTotal = 0
-        explainedTotal = 0
-
-        for key, value in self._results.items():
-            epochNumber, circleNumber, roundNumber, isExplain = key
-            if epochNumber < gameEpochNumber:
-                if isExplain:
-                    explainedByEpoch += value
-                else:
-                    guessedByEpoch += value
-            if circleNumber < gameCircleNumber:
-                if isExplain:
-                    explainedByCircle += value
-                else:
-                    guessedByCircle += value
+        kind = 1 if isExplain else 0
+        if self._timelines is None:
+            self._timelines = [ScoreTimeline() for i in range(6)]
+        self._timelines[kind].add(roundNumber, 1)
+        self._timelines[2 + kind].add(circleNumber, 1)
+        self._timelines[4 + kind].add(epochNumber, 1)
+        if isExplain:
+            self.explainedTotal += 1
+        else:
+            self.guessedTotal += 1
+        if self._countersKey is not None:
+            gameEpochNumber, gameCircleNumber = self._countersKey
+            if gameEpochNumber is not None and epochNumber < gameEpochNumber:
+                self._counters[kind] += 1
+            if gameCircleNumber is not None and circleNumber < gameCircleNumber:
+                self._counters[2 + kind] += 1
+
+    def _prefix(self, timeline, stop):
+        if self._timelines is None or stop is None:
+            return 0
+        return self._timelines[timeline].prefix(stop)
+
+    def _rollCounters(self, gameEpochNumber, gameCircleNumber):
+        # called when the game moved to another circle or epoch, both forward and back
+        self._countersKey = (gameEpochNumber, gameCircleNumber)
+        for kind in (0, 1):
+            self._counters[kind] = self._prefix(4 + kind, gameEpochNumber)
+            self._counters[2 + kind] = self._prefix(2 + kind, gameCircleNumber)
+
+    def toSnapshot(self):
+        return {'name': self.name,
+                'userIdHash': self.userIdHash,
+                'owner': self.owner,
+                'putWordsInHat': self.putWordsInHat,
+                'observer': self.observer,
+                'guessedTotal': self.guessedTotal,
+                'explainedTotal': self.explainedTotal,
+                'timelines': [[timeline._offset, timeline._tree]
+                              for timeline in self._timelines or [ScoreTimeline()] * 6]}
+
+    @classmethod
+    def fromSnapshot(cls, connection, state):
+        player = cls(connection, state['name'], owner=state['owner'],
+                     putWordsInHat=state['putWordsInHat'], observer=state['observer'])
+        player.userIdHash = sys.intern(state['userIdHash'])
+        player.guessedTotal = state['guessedTotal']
+        player.explainedTotal = state['explainedTotal']
+        if player.guessedTotal or player.explainedTotal:
+            player._timelines = [ScoreTimeline() for i in range(6)]
+            for timeline, (offset, tree) in zip(player._timelines, state['timelines']):
+                timeline._offset = offset
+                timeline._tree = tree
+        return player
 
-            if isExplain:
-                explainedTotal += value
-            else:
-                guessedTotal += value
+    def scoreInRounds(self, startRound, stopRound):
+        return {'guessed': self._prefix(0, stopRound) - self._prefix(0, startRound),
+                'explained': self._prefix(1, stopRound) - self._prefix(1, startRound)}
 
+    def toDict(self, gameEpochNumber, gameCircleNumber, gameRoundNumber):
+        if self._countersKey != (gameEpochNumber, gameCircleNumber):
+            self._rollCounters(gameEpochNumber, gameCircleNumber)
 
         return {
             'name': self.name,
@@ -99,17 +231,48 @@ class Player:
             'observer': self.observer,
             'putWordsInHat': self.putWordsInHat,
 
-            'guessedByEpoch': guessedByEpoch,
-            'explainedByEpoch': explainedByEpoch,
-            'guessedByCircle': guessedByCircle,
-            'explainedByCircle': explainedByCircle,
-            'guessedTotal': guessedTotal,
-            'explainedTotal': explainedTotal
+            'guessedByEpoch': self._counters[0],
+            'explainedByEpoch': self._counters[1],
+            'guessedByCircle': self._counters[2],
+            'explainedByCircle': self._counters[3],
+            'guessedTotal': self.guessedTotal,
+            'explainedTotal': self.explainedTotal
         }
 
+# Full state events. Clients that join with 'deltaUpdates' get 'stateDelta' messages instead:
+# {'fromVersion', 'version', 'game': changed fields, 'players': changed players, 'removedPlayers'}.
+# A client that sees fromVersion different from its own version sends 'stateSnapshotRequested'
+# and gets a full 'stateSnapshot' {'version', 'game', 'players'}.
+C_STATE_EVENTS = {'gameUpdated', 'playersUpdated'}
+
+C_MAX_COMMAND_BATCH = 64
+# Seconds the actor keeps collecting commands after a batch before its state broadcasts go out,
+# 0 coalesces only the commands queued in the same event loop tick. Clients that join with
+# 'batchUpdates' get the state events of one flush as one 'batch' message {'events': [{'event', 'data'}]}.
+C_COALESCE_WINDOW = 0
+
+# Game attributes saved in persistence snapshots, besides players, words and the RNG state
+C_GAME_SNAPSHOT_FIELDS = [
+    'gameId', 'gameMode', 'wordsMode', 'wordsPerPlayer', 'ownerUserIdHash', 'secondsPerRound',
+    'playersPairs', 'gameStateTypingWords', 'gameStatePlaying', 'gameStateEnded',
+    'roundNumber', 'circleNumber', 'epochNumber', 'playersOrder', 'observersOrder',
+    'explainPlayerIndex', 'guessPlayerIndex', '_pairs', '_explainInPairPlayerIndex', 'pairIndex',
+    'roundStateConfirmation', 'roundStatePlaying', 'explainPlayerConfirmed', 'guessPlayerConfirmed',
+    'initialWordsInHat', 'stateVersion', '_scheduleBase']
+
 # Word = collections.namedtuple('Word', '')
 
 class Game:
+    __slots__ = (
+        'gameMode', 'wordsMode', 'gameId', 'players', 'wordsPerPlayer', 'ownerUserIdHash', '_playerWords',
+        'secondsPerRound', 'playersPairs', 'gameStateTypingWords', 'gameStatePlaying', 'gameStateEnded',
+        'roundNumber', 'circleNumber', 'epochNumber', 'playersOrder', 'observersOrder',
+        'explainPlayerIndex', 'guessPlayerIndex', '_pairsOrder', '_pairs', '_explainInPairPlayerIndex',
+        'pairIndex', '_schedule', '_scheduleBase', 'roundDeadline', 'roundStateConfirmation', 'roundStatePlaying',
+        'explainPlayerConfirmed', 'guessPlayerConfirmed', '_wordsInHat', '_random', 'initialWordsInHat',
+        'stateVersion', '_publishedGame', '_publishedPlayers', '_commands', '_actor', '_batching',
+        '_pendingStateEvents')
+
     def __init__(self, gameId, wordsPerPlayer, ownerUserIdHash=None, gameMode=None, wordsMode=None):
         if gameMode is None:
             gameMode = 'CIRCLE'
@@ -121,6 +284,7 @@ class Game:
         self.ownerUserIdHash = ownerUserIdHash
         self._playerWords = {}
         self.secondsPerRound = None
+        self.playersPairs = None
 
         self.gameStateTypingWords = False
         self.gameStatePlaying = False
@@ -137,18 +301,37 @@ class Game:
         self.guessPlayerIndex = None
 
         self._pairsOrder = []
+        self._pairs = None
         self._explainInPairPlayerIndex = 0
         self.pairIndex = None
+        self._schedule = None
+        # the round the schedule goes on from after players left mid-game, see RoundSchedule
+        self._scheduleBase = None
+        # wall clock time the playing round ends, the server completes it C_ROUND_GRACE later
+        self.roundDeadline = None
 
         self.roundStateConfirmation = False
         self.roundStatePlaying = False
 
         self.explainPlayerConfirmed = None
         self.guessPlayerConfirmed = None
-        self._wordsInHat = []
+        self._wordsInHat = Hat()
+        self._random = random.Random()
 
         self.initialWordsInHat = None
 
+        # last state published to delta protocol clients
+        self.stateVersion = 0
+        self._publishedGame = {}
+        self._publishedPlayers = {}
+
+        # actor: commands for this game are applied one by one, by one task at a time;
+        # the queue only exists while there are commands
+        self._commands = None
+        self._actor = None
+        self._batching = False
+        self._pendingStateEvents = {}
+
     def setSettings(self, secondsPerRound, gameMode, playersPairs=None, gameId=None, ownerIsObserver=None):
         self.secondsPerRound = secondsPerRound
         self.gameMode = gameMode
@@ -156,6 +339,41 @@ class Game:
         if ownerIsObserver:
             self.players[self.ownerUserIdHash].observer = True
 
+    def seed(self, seed):
+        self._random.seed(seed)
+
+    def toSnapshot(self):
+        state = {field: getattr(self, field, None) for field in C_GAME_SNAPSHOT_FIELDS}
+        state['players'] = [player.toSnapshot() for player in self.players.values()]
+        state['playerWords'] = {}
+        for userIdHash, wordset in self._playerWords.items():
+            if isinstance(wordset, list):
+                state['playerWords'][userIdHash] = wordset
+            else:
+                # shared dictionary, stored by name
+                state['playerWords'][userIdHash] = [name for name, words in DICTS.items() if words is wordset][0]
+        state['hat'] = self._wordsInHat.toSnapshot()
+        state['random'] = self._random.getstate()
+        return state
+
+    @classmethod
+    def fromSnapshot(cls, state):
+        game = cls(state['gameId'], state['wordsPerPlayer'])
+        for field in C_GAME_SNAPSHOT_FIELDS:
+            # fields added later are missing from older snapshots
+            setattr(game, field, state.get(field))
+        if game._pairs is not None:
+            game._pairs = [tuple(pair) for pair in game._pairs]
+        for playerState in state['players']:
+            player = Player.fromSnapshot(DetachedConnection(playerState['userIdHash']), playerState)
+            game.players[player.userIdHash] = player
+        for userIdHash, wordset in state['playerWords'].items():
+            game._playerWords[userIdHash] = wordset if isinstance(wordset, list) else DICTS[wordset]
+        version, internalState, gauss = state['random']
+        game._random.setstate((version, tuple(internalState), gauss))
+        game._wordsInHat = Hat.fromSnapshot(state['hat'], game._random)
+        return game
+
     def getPlayerByConnection(self, connection):
         player =  self.players.get(connection.userIdHash)
         if not player:
@@ -189,6 +407,7 @@ class Game:
 
             'initialWordsInHat': self.initialWordsInHat,
             'currentWordsInHat': len(self._wordsInHat),
+            'roundDeadline': self.roundDeadline,
         }
 
     def allPlayersDictsList(self):
@@ -202,12 +421,14 @@ class Game:
                    player.putWordsInHat = True
         if player.userIdHash not in self.players:
             if self.gameStatePlaying or self.gameStateEnded:
-                raise ValueError('You can not join to game')
+                raise ClientError('You can not join to game')
             self.playersOrder.append(player.userIdHash)
         self.players[player.userIdHash] = player
+        # a joining delta client gets a stateSnapshot with its join instead, see playerJoined
         await self.notifyAllPlayers('playersUpdated',
                                     {'players': self.allPlayersDictsList(),
-                                     'playersOrder': self.playersOrder})
+                                     'playersOrder': self.playersOrder},
+                                    deltaExcluded=player.connection)
 
     async def updatePlayer(self, player):
         self.players[player.userIdHash] = player
@@ -216,26 +437,164 @@ class Game:
                                      'playersOrder': self.playersOrder})
 
     async def updateAllPlayers(self, player):
-        await player.connection.send(
-            'playersUpdated',
-            {'players':
-                 self.allPlayersDictsList(),
-             'playersOrder': self.playersOrder},
-            self.gameId)
+        await self.sendState(player.connection,
+                             'playersUpdated',
+                             {'players':
+                                  self.allPlayersDictsList(),
+                              'playersOrder': self.playersOrder})
+
+
+    def submit(self, handler, connection, data, event=None):
+        # queue a command for the game's actor, the returned future resolves once it is applied;
+        # a journaled event is appended to the journal as it is applied, in the order of applying
+        future = asyncio.get_event_loop().create_future()
+        if self._commands is None:
+            self._commands = collections.deque()
+        self._commands.append((handler, connection, data, event, future))
+        if self._actor is None:
+            self._actor = asyncio.ensure_future(self._processCommands())
+        return future
+
+
+    async def _processCommands(self):
+        try:
+            while self._commands:
+                # state broadcasts of the whole batch go out once, with the state after it
+                self._batching = True
+                try:
+                    await self._applyCommands()
+                    if C_COALESCE_WINDOW > 0:
+                        await asyncio.sleep(C_COALESCE_WINDOW)
+                        await self._applyCommands()
+                finally:
+                    self._batching = False
+                    await self._flushStateEvents()
+        finally:
+            self._actor = None
+            if not self._commands:
+                self._commands = None
+
+
+    async def _applyCommands(self):
+        batch = []
+        while self._commands and len(batch) < C_MAX_COMMAND_BATCH:
+            batch.append(self._commands.popleft())
+        for handler, connection, data, event, future in batch:
+            try:
+                await handler(connection, data)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                # before anything else runs: a snapshot taken later has the event and its seq
+                journalEvent(self.gameId, event, data, connection.userIdHash)
+                if not future.done():
+                    future.set_result(None)
 
 
-    async def notifyAllPlayers(self, method, data):
+    async def _flushStateEvents(self):
+        pending, self._pendingStateEvents = self._pendingStateEvents, {}
+        if not pending:
+            return
+        try:
+            start = time.perf_counter()
+            frames = []
+            for method in pending:
+                if method == 'gameUpdated':
+                    frames.append(Frame('gameUpdated', {'game': self.toDict()}))
+                else:
+                    frames.append(Frame('playersUpdated', {'players': self.allPlayersDictsList(),
+                                                           'playersOrder': self.playersOrder}))
+            batch = BatchFrame(frames) if len(frames) > 1 else frames[0]
+            for player in self.players.values():
+                connection = player.connection
+                if connection.deltaUpdates:
+                    continue
+                if connection.batchUpdates:
+                    connection.sendFrame(batch, self.gameId)
+                else:
+                    for frame in frames:
+                        connection.sendFrame(frame, self.gameId)
+            self._publishState()
+            SPECTATORS.touch(self.gameId)
+            broadcastLatency.observe(time.perf_counter() - start)
+        except Exception:
+            error_logger.exception('state broadcast failed',
+                                   extra={'gameId': self.gameId, 'userIdHash': None, 'sessionId': None})
+
+
+    async def notifyAllPlayers(self, method, data, deltaExcluded=None):
+        isState = method in C_STATE_EVENTS
+        if isState and self._batching:
+            self._pendingStateEvents[method] = True
+            return
+        start = time.perf_counter()
+        frame = Frame(method, data)
         for player in self.players.values():
-            await player.connection.send(method,
-                                         data,
-                                         self.gameId)
+            if isState and player.connection.deltaUpdates:
+                continue
+            player.connection.sendFrame(frame, self.gameId)
+        if isState:
+            self._publishState(excluded=deltaExcluded)
+            SPECTATORS.touch(self.gameId)
+        broadcastLatency.observe(time.perf_counter() - start)
+
+
+    async def sendState(self, connection, method, data):
+        # full state message for old frontends, versioned delta for the ones that asked for it
+        if connection.deltaUpdates:
+            self._publishState()
+        else:
+            await connection.send(method, data, self.gameId)
+
+
+    def _publishState(self, force=False, excluded=None):
+        deltaPlayers = [p for p in self.players.values()
+                        if p.connection.deltaUpdates and p.connection is not excluded]
+        if not deltaPlayers and not force:
+            return
+        gameDict = {key: list(value) if isinstance(value, list) else value
+                    for key, value in self.toDict().items()}
+        playersDicts = {p.userIdHash: p.toDict(self.epochNumber, self.circleNumber, self.roundNumber)
+                        for p in self.players.values()}
+        changedGame = {key: value for key, value in gameDict.items()
+                       if key not in self._publishedGame or self._publishedGame[key] != value}
+        changedPlayers = [playerDict for userIdHash, playerDict in playersDicts.items()
+                          if self._publishedPlayers.get(userIdHash) != playerDict]
+        removedPlayers = [userIdHash for userIdHash in self._publishedPlayers if userIdHash not in playersDicts]
+        self._publishedGame = gameDict
+        self._publishedPlayers = playersDicts
+        if not changedGame and not changedPlayers and not removedPlayers:
+            return
+        self.stateVersion += 1
+        frame = Frame('stateDelta', {'fromVersion': self.stateVersion - 1,
+                                     'version': self.stateVersion,
+                                     'game': changedGame,
+                                     'players': changedPlayers,
+                                     'removedPlayers': removedPlayers})
+        for player in deltaPlayers:
+            player.connection.sendFrame(frame, self.gameId)
+
+
+    def snapshot(self, connection=None):
+        # the connection the snapshot is for gets no delta up to it
+        self._publishState(force=True, excluded=connection)
+        return {'version': self.stateVersion,
+                'game': self._publishedGame,
+                'players': list(self._publishedPlayers.values())}
 
 
     async def removePlayer(self, playerIdHash):
         player = self.players[playerIdHash]
+        inRound = (self.gameStatePlaying and self.roundNumber is not None and bool(self.playersOrder) and
+                   playerIdHash in (self.playersOrder[self.explainPlayerIndex % len(self.playersOrder)],
+                                    self.playersOrder[self.guessPlayerIndex % len(self.playersOrder)]))
         self.players.pop(playerIdHash)
         if playerIdHash in self.playersOrder:
+            if self.roundNumber is not None:
+                self._scheduleBase = list(self.roundSchedule()[self.roundNumber])
             self.playersOrder.remove(playerIdHash)
+            self._schedule = None
         if playerIdHash in self.observersOrder:
             self.observersOrder.remove(playerIdHash)
         if playerIdHash in self._playerWords:
@@ -244,6 +603,10 @@ class Game:
         await self.notifyAllPlayers('playersUpdated',
                                     {'players': self.allPlayersDictsList(),
                                      'playersOrder': self.playersOrder})
+        if inRound and self.playersOrder:
+            # the round starts over with the players now in its place, its timer with their confirmation
+            self._wordsInHat.putBack()
+            await self.goToRound(self.roundNumber)
         await player.connection.send('playerRemoved', {}, self.gameId)
 
 
@@ -256,11 +619,11 @@ class Game:
         if self.gameMode == 'CIRCLE':
             self.playersOrder = [p.userIdHash for p in self.players.values() if not p.observer]
             self.observersOrder = [p.userIdHash for p in self.players.values() if p.observer]
-            random.shuffle(self.playersOrder)
+            self._random.shuffle(self.playersOrder)
         elif self.gameMode == 'RANDOM_PAIRS':
             self.playersOrder = [p.userIdHash for p in self.players.values() if not p.observer]
             self.observersOrder = [p.userIdHash for p in self.players.values() if p.observer]
-            random.shuffle(self.playersOrder)
+            self._random.shuffle(self.playersOrder)
             self._pairs = [(i, i+1) for i in range(0, len(self.playersOrder), 2)]
         elif self.gameMode == 'ASSIGNED_PAIRS':
             self.playersOrder = []
@@ -270,69 +633,39 @@ class Game:
             self._pairs = [(i, i+1) for i in range(0, len(self.playersOrder), 2)]
         else:
             raise ValueError('Unknown mode: ', self.gameMode)
-        allWords = []
-        for wordset in self._playerWords.values():
-            allWords.extend(wordset)
+        self._schedule = RoundSchedule(self.gameMode, len(self.playersOrder), self._pairs)
+        self._scheduleBase = None
         hatSize = (len(self.playersOrder) * self.wordsPerPlayer)
-        while len(self._wordsInHat) < hatSize and len(allWords) > 0:
-            random.shuffle(allWords)
-            self._wordsInHat += allWords
-        self._wordsInHat = self._wordsInHat[:hatSize]
+        self._wordsInHat = Hat(self._drawWords(hatSize), self._random)
         self.initialWordsInHat = len(self._wordsInHat)
         self.gameStateTypingWords = False
         self.gameStatePlaying = True
 
 
-    async def startRound(self):
-        random.shuffle(self._wordsInHat)
-        if self.gameMode == 'CIRCLE':
-            if self.explainPlayerIndex is None:
-                self.explainPlayerIndex = -1
-
-            if self.guessPlayerIndex is None:
-                self.guessPlayerIndex = -1
-
-            if self.roundNumber is None:
-                self.roundNumber = -1
-                self.circleNumber = -1
-                self.epochNumber = 0
-            self.roundNumber += 1
-            self.explainPlayerIndex = (self.explainPlayerIndex + 1) % len(self.playersOrder)
-            if self.explainPlayerIndex == 0:
-                self.circleNumber += 1
-                self.guessPlayerIndex = (self.guessPlayerIndex + 2) % len(self.playersOrder)
-                if self.guessPlayerIndex == 0:
-                    self.guessPlayerIndex += 1
-                    self.epochNumber += 1
-            else:
-                self.guessPlayerIndex = (self.guessPlayerIndex + 1) % len(self.playersOrder)
-
-        elif self.gameMode == 'RANDOM_PAIRS' or self.gameMode == 'ASSIGNED_PAIRS':
-            if self.roundNumber is None:
-                self.roundNumber = -1
-                self.circleNumber = 0
-                self.epochNumber = 0
-            if self.pairIndex is None:
-                self.pairIndex = -1
-
-            self.roundNumber += 1
-            self.pairIndex += 1
-            if self.pairIndex >= len(self._pairs):
-                self.pairIndex = 0
-                if self.circleNumber % 2 == 1:
-                    self.epochNumber += 1
-                self.circleNumber += 1
-                self._explainInPairPlayerIndex = 1 - self._explainInPairPlayerIndex
-            pair = self._pairs[self.pairIndex]
-            self.explainPlayerIndex = pair[self._explainInPairPlayerIndex]
-            self.guessPlayerIndex = pair[1 - self._explainInPairPlayerIndex]
+    def _drawWords(self, hatSize):
+        # hatSize random words from all players' word sets as if they were concatenated,
+        # drawn by index so that shared dictionaries are never copied
+        wordsets = [wordset for wordset in self._playerWords.values() if len(wordset) > 0]
+        ends = []
+        total = 0
+        for wordset in wordsets:
+            total += len(wordset)
+            ends.append(total)
+        if total == 0:
+            return []
+        copies, rest = divmod(hatSize, total)
+        indices = list(range(total)) * copies + self._random.sample(range(total), rest)
+        words = []
+        for index in indices:
+            wordsetIndex = bisect.bisect_right(ends, index)
+            start = ends[wordsetIndex - 1] if wordsetIndex > 0 else 0
+            words.append(wordsets[wordsetIndex][index - start])
+        return words
 
-        self.roundStateConfirmation = True
-        self.roundStatePlaying = False
 
-        self.explainPlayerConfirmed = False
-        self.guessPlayerConfirmed = False
-        await self.notifyAllPlayers('gameUpdated', {'game':self.toDict()})
+    async def startRound(self):
+        self._wordsInHat.putBack()
+        await self.goToRound(0 if self.roundNumber is None else self.roundNumber + 1)
 
 
     async def confirmRound(self, player, data):
@@ -346,52 +679,34 @@ class Game:
             if self.guessPlayerConfirmed and self.explainPlayerConfirmed:
                 self.roundStateConfirmation = False
                 self.roundStatePlaying = True
+                self.startRoundTimer()
                 await self.giveNextWord()
             else:
-                await player.connection.send('gameUpdated',
-                                             {'game': self.toDict()},
-                                             self.gameId)
+                await self.sendState(player.connection,
+                                     'gameUpdated',
+                                     {'game': self.toDict()})
         else:
-            await player.connection.send('gameUpdated',
-                                         {'game': self.toDict()},
-                                         self.gameId)
+            await self.sendState(player.connection,
+                                 'gameUpdated',
+                                 {'game': self.toDict()})
 
 
     async def replayPreviousRound(self):
-        if self.gameMode == 'CIRCLE':
-            if self.explainPlayerIndex is None:
-                self.explainPlayerIndex = -1
-
-            if self.guessPlayerIndex is None:
-                self.guessPlayerIndex = -1
-
-            if self.roundNumber is None:
-                self.roundNumber = -1
-                self.circleNumber = -1
-                self.epochNumber = 0
-            self.roundNumber -= 1
-            self.explainPlayerIndex = (self.explainPlayerIndex - 1) % len(self.playersOrder)
-            if self.explainPlayerIndex == len(self.playersOrder) - 1:
-                self.circleNumber -= 1
-                self.guessPlayerIndex = (self.guessPlayerIndex - 2) % len(self.playersOrder)
-                if self.guessPlayerIndex == len(self.playersOrder)-1:
-                    self.guessPlayerIndex -= 1
-                    self.epochNumber -= 1
-            else:
-                self.guessPlayerIndex = (self.guessPlayerIndex - 1) % len(self.playersOrder)
-
-        elif self.gameMode == 'RANDOM_PAIRS' or self.gameMode == 'ASSIGNED_PAIRS':
-            self.roundNumber -= 1
-            self.pairIndex -= 1
-            if self.pairIndex < 0:
-                self.pairIndex = len(self._pairs) - 1
-                self.circleNumber -= 1
-                if self.circleNumber % 2 == 1:
-                    self.epochNumber -= 1
-                self._explainInPairPlayerIndex = 1 - self._explainInPairPlayerIndex
-            pair = self._pairs[self.pairIndex]
-            self.explainPlayerIndex = pair[self._explainInPairPlayerIndex]
-            self.guessPlayerIndex = pair[1 - self._explainInPairPlayerIndex]
+        await self.goToRound((-1 if self.roundNumber is None else self.roundNumber) - 1)
+
+
+    async def goToRound(self, roundNumber):
+        # any round, back or forward, without stepping through the ones in between
+        scheduled = self.roundSchedule()[roundNumber]
+        self.stopRoundTimer()
+        self.roundNumber = scheduled.roundNumber
+        self.explainPlayerIndex = scheduled.explainPlayerIndex
+        self.guessPlayerIndex = scheduled.guessPlayerIndex
+        self.circleNumber = scheduled.circleNumber
+        self.epochNumber = scheduled.epochNumber
+        if scheduled.pairIndex is not None:
+            self.pairIndex = scheduled.pairIndex
+            self._explainInPairPlayerIndex = scheduled.explainInPairPlayerIndex
 
         self.roundStateConfirmation = True
         self.roundStatePlaying = False
@@ -401,6 +716,33 @@ class Game:
         await self.notifyAllPlayers('gameUpdated', {'game':self.toDict()})
 
 
+    def startRoundTimer(self):
+        if not self.secondsPerRound or self.secondsPerRound <= 0:
+            return
+        self.roundDeadline = time.time() + self.secondsPerRound
+        gameId, roundNumber = self.gameId, self.roundNumber
+        ROUND_TIMERS.schedule(gameId, self.secondsPerRound + C_ROUND_GRACE,
+                              lambda: asyncio.ensure_future(expireRound(gameId, roundNumber)))
+
+
+    def stopRoundTimer(self):
+        ROUND_TIMERS.cancel(self.gameId)
+        self.roundDeadline = None
+
+
+    def roundSchedule(self):
+        if self._schedule is None:
+            self._schedule = RoundSchedule(self.gameMode, len(self.playersOrder), self._pairs, self._scheduleBase)
+        return self._schedule
+
+
+    def upcomingRounds(self, count):
+        # (explaining, guessing) userIdHash of the next count rounds
+        current = -1 if self.roundNumber is None else self.roundNumber
+        return [(self.playersOrder[scheduled.explainPlayerIndex], self.playersOrder[scheduled.guessPlayerIndex])
+                for scheduled in self.roundSchedule().upcoming(current, count)]
+
+
     async def giveNextWord(self):
         if len(self._wordsInHat) == 0:
             self.gameStatePlaying = False
@@ -408,16 +750,18 @@ class Game:
 
             self.roundStateConfirmation = False
             self.roundStatePlaying = False
+            self.stopRoundTimer()
 
             await self.notifyAllPlayers('gameUpdated', {'game':self.toDict()})
             await self.notifyAllPlayers('playersUpdated', {'players': self.allPlayersDictsList() })
         else:
             explainPlayer = self.players[self.playersOrder[self.explainPlayerIndex]]
             guessPlayer = self.players[self.playersOrder[self.guessPlayerIndex]]
-            await explainPlayer.connection.send('nextWord', {'word': self._wordsInHat[0]}, self.gameId)
+            await explainPlayer.connection.send('nextWord', {'word': self._wordsInHat.current()}, self.gameId)
+            frame = Frame('nextWord', {'word': None})
             for player in self.players.values():
                 if player.userIdHash != explainPlayer.userIdHash:
-                    await player.connection.send('nextWord', {'word': None}, self.gameId)
+                    player.connection.sendFrame(frame, self.gameId)
 
 
     def addWords(self, userIdHash, words, dictionary=None):
@@ -428,7 +772,7 @@ class Game:
 
 
     def wordGuessed(self, doCount = True):
-        self._wordsInHat = self._wordsInHat[1:]
+        self._wordsInHat.remove()
         if doCount:
             self.players[self.playersOrder[self.explainPlayerIndex]].givePoint(None,
                                                                                self.epochNumber,
@@ -443,34 +787,268 @@ class Game:
 
 
 DICTS = {}
+C_DICTS_DIR = 'dicts'
+C_DICT_NAMES = ['simple', 'medium', 'hard']
+
+C_GAME_ENDED_TTL = 10 * 60
+C_GAME_IDLE_TTL = 6 * 60 * 60
+C_MAX_GAMES = 100000
+C_MAX_GAMES_BYTES = None
+C_EVICTION_INTERVAL = 60
+
+# rough sizes for GameStorage memory accounting
+C_GAME_BYTES = 8192
+C_PLAYER_BYTES = 4096
+C_WORD_BYTES = 100
+
+
+def approximateGameSize(game):
+    # shared dictionaries are not counted, only words the game holds itself
+    ownWords = sum(len(wordset) for wordset in game._playerWords.values() if isinstance(wordset, list))
+    return (C_GAME_BYTES
+            + C_PLAYER_BYTES * len(game.players)
+            + C_WORD_BYTES * (ownWords + len(game._wordsInHat)))
+
 
 class GameStorage:
-    pass
+    # Games by id, least recently active first. evict() drops ended games after endedTtl,
+    # any game after idleTtl without events, then the least recently active games
+    # while there are more than maxGames or they take more than maxBytes.
+    def __init__(self, endedTtl=C_GAME_ENDED_TTL, idleTtl=C_GAME_IDLE_TTL,
+                 maxGames=C_MAX_GAMES, maxBytes=C_MAX_GAMES_BYTES, clock=time.monotonic):
+        self.endedTtl = endedTtl
+        self.idleTtl = idleTtl
+        self.maxGames = maxGames
+        self.maxBytes = maxBytes
+        self._clock = clock
+        self._games = collections.OrderedDict()
+        self._lastActivity = {}
+        self.evicted = collections.Counter()
+        self.journal = None
+
+    def __contains__(self, gameId):
+        return gameId in self._games
+
+    def __len__(self):
+        return len(self._games)
+
+    def __setitem__(self, gameId, game):
+        self._games[gameId] = game
+        self.touch(gameId)
+
+    def __getitem__(self, gameId):
+        game = self._games[gameId]
+        self.touch(gameId)
+        return game
+
+    def get(self, gameId, default=None):
+        if gameId not in self._games:
+            return default
+        return self[gameId]
+
+    def pop(self, gameId, *default):
+        self._lastActivity.pop(gameId, None)
+        return self._games.pop(gameId, *default)
+
+    def values(self):
+        return self._games.values()
+
+    def touch(self, gameId):
+        self._games.move_to_end(gameId)
+        self._lastActivity[gameId] = self._clock()
+
+    def _evict(self, gameId, reason):
+        self.pop(gameId)
+        ROUND_TIMERS.cancel(gameId)
+        # spectators get no snapshot of a missing game and are dropped on the next flush
+        SPECTATORS.touch(gameId)
+        if self.journal is not None:
+            self.journal.forget(gameId)
+        self.evicted[reason] += 1
+        METRICS.increment('onlinehat_games_evicted_total', 'Games dropped from memory', reason=reason)
+        access_logger.info('game evicted:%s', reason, extra={'gameId': gameId, 'userIdHash': None, 'sessionId': None})
+
+    def evict(self):
+        now = self._clock()
+        minTtl = min(self.endedTtl, self.idleTtl)
+        for gameId, game in list(self._games.items()):
+            idle = now - self._lastActivity[gameId]
+            if idle <= minTtl:
+                break
+            if game.gameStateEnded and idle > self.endedTtl:
+                self._evict(gameId, 'ended')
+            elif idle > self.idleTtl:
+                self._evict(gameId, 'idle')
+        while self.maxGames is not None and len(self._games) > self.maxGames:
+            self._evict(next(iter(self._games)), 'overCapacity')
+        if self.maxBytes is not None:
+            totalBytes = self.approximateSize()
+            while self._games and totalBytes > self.maxBytes:
+                gameId, game = next(iter(self._games.items()))
+                totalBytes -= approximateGameSize(game)
+                self._evict(gameId, 'overCapacity')
+
+    def approximateSize(self):
+        return sum(approximateGameSize(game) for game in self._games.values())
+
+    def stats(self):
+        return {'games': len(self._games),
+                'approximateBytes': self.approximateSize(),
+                'evictedEnded': self.evicted['ended'],
+                'evictedIdle': self.evicted['idle'],
+                'evictedOverCapacity': self.evicted['overCapacity']}
+
+    async def runEviction(self, interval=C_EVICTION_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
+
+
+GAME_STORAGE = GameStorage()
+
+
+# Rounds end on the server: C_ROUND_GRACE after the deadline the explainer's client missed
+# to send roundComplete, the round is completed with the last word not guessed.
+C_ROUND_GRACE = 3
+C_TIMER_TICK = 0.5
+ROUND_TIMERS = TimerWheel(C_TIMER_TICK)
+
+
+async def expireRound(gameId, roundNumber):
+    game = GAME_STORAGE._games.get(gameId)
+    if game is None:
+        return
+    try:
+        explainer = game.playersOrder[game.explainPlayerIndex]
+    except (IndexError, TypeError):
+        # the explainer is gone, the round is ended by the server alone
+        explainer = None
+    await applyServerEvent(game, DetachedConnection(explainer), 'roundTimedOut',
+                           {'gameId': gameId, 'roundNumber': roundNumber})
 
 
-GAME_STORAGE = {}
+def journalEvent(gameId, event, data, userIdHash):
+    if GAME_STORAGE.journal is not None and event in C_JOURNALED_EVENTS and gameId in GAME_STORAGE:
+        GAME_STORAGE.journal.append(gameId, event, data, userIdHash)
 
-async def gameCreated(connection, data):
-    gameId = str(uuid.uuid4())
+
+async def applyServerEvent(game, connection, event, data):
+    # an event the server raises itself goes through the game's actor and the journal like a client's
+    try:
+        await game.submit(C_EVENT_HANDLERS[event], connection, data, event)
+    except Exception:
+        error_logger.exception('server event failed:%s', event,
+                               extra={'gameId': game.gameId, 'userIdHash': connection.userIdHash, 'sessionId': None})
+    finally:
+        if RECORDER is not None:
+            RECORDER.record(game.gameId, connection.userIdHash, event, data)
+
+
+def spectatorSnapshot(gameId):
+    game = GAME_STORAGE._games.get(gameId)
+    if game is None:
+        return None
+    return Frame('spectatorSnapshot', {'game': game.toDict(), 'players': game.allPlayersDictsList()})
+
+
+SPECTATORS = SpectatorHub(spectatorSnapshot)
+
+C_JOURNAL_PATH = 'games.sqlite3'
+C_SNAPSHOT_INTERVAL = 30
+
+
+async def snapshotGames(journal, interval=C_SNAPSHOT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        for gameId in list(journal.dirty):
+            game = GAME_STORAGE._games.get(gameId)
+            if game is not None:
+                journal.snapshot(gameId, game.toSnapshot())
+
+
+async def recoverGames(journal):
+    for gameId, (state, events) in journal.load().items():
+        if state is not None:
+            GAME_STORAGE[gameId] = Game.fromSnapshot(state)
+        for userIdHash, event, data in events:
+            if event not in C_JOURNALED_EVENTS:
+                # journaled by older versions
+                continue
+            connection = DetachedConnection(userIdHash)
+            try:
+                if event == 'gameCreated':
+                    createGame(connection, data)
+                else:
+                    await C_EVENT_HANDLERS[event](connection, data)
+            except Exception:
+                error_logger.exception('journal replay failed event:%s', event,
+                                       extra={'gameId': gameId, 'userIdHash': userIdHash, 'sessionId': None})
+        game = GAME_STORAGE._games.get(gameId)
+        if game is not None and game.roundStatePlaying and gameId not in ROUND_TIMERS:
+            # the deadline did not survive the restart, the round gets its full time again
+            game.startRoundTimer()
+
+
+def journalWriteFailed(error):
+    # in the journal's writer thread: the batch is lost, the games in memory go on
+    error_logger.error('journal write failed', exc_info=(type(error), error, error.__traceback__),
+                       extra={'gameId': None, 'userIdHash': None, 'sessionId': None})
+
+
+def createGame(connection, data):
+    gameId = data['gameId']
     player = Player(connection, **data['player'], owner=True)
     game = Game(gameId, **data['game'],
                 ownerUserIdHash = player.userIdHash)
+    game.seed(data['seed'])
     game.gameStateTypingWords = True
     GAME_STORAGE[gameId] = game
+    return game
+
+
+# Set by workers.py when several worker processes share the port; the front process
+# routes every connection with a gameId to workerOf(gameId).
+C_WORKERS = 1
+C_WORKER_INDEX = 0
+
+
+def newGameId():
+    while True:
+        gameId = str(uuid.uuid4())
+        if C_WORKERS == 1 or workerOf(gameId, C_WORKERS) == C_WORKER_INDEX:
+            return gameId
+
+
+async def gameCreated(connection, data):
+    gameId = newGameId()
+    # kept in the event data, so that the journal replays the very same game
+    data['gameId'] = gameId
+    data['seed'] = random.getrandbits(64)
+    createGame(connection, data)
     await connection.send('gameCreated',
                           {'gameId':gameId},
                           gameId)
     #await game.addPlayer(player)
 
 
-class NoSuchGame(ValueError):
+class ClientError(ValueError):
+    # a client's mistake or a stale message: a reply and a counter, no traceback
+    pass
+
+
+class NoSuchGame(ClientError):
     pass
 
 async def playerJoined(connection, data):
     gameId = data['gameId']
     if gameId not in GAME_STORAGE:
+        if C_WORKERS > 1 and workerOf(gameId, C_WORKERS) != C_WORKER_INDEX:
+            # connected with another game's cookie, the client reconnects with the new one
+            await connection.websocket.close(4000, 'game is served by another worker')
         raise NoSuchGame(gameId)
     game = GAME_STORAGE.get(gameId)
+    connection.deltaUpdates = bool(data.get('deltaUpdates'))
+    connection.batchUpdates = bool(data.get('batchUpdates'))
     player = game.getPlayerByConnection(connection)
     if not player:
         player = Player(connection, **data['player'])
@@ -479,7 +1057,10 @@ async def playerJoined(connection, data):
                                'gameId': gameId},
                           gameId)
     await game.addPlayer(player)
-    await connection.send('gameUpdated', {'game': game.toDict()}, gameId)
+    if connection.deltaUpdates:
+        await connection.send('stateSnapshot', game.snapshot(connection), gameId)
+    else:
+        await connection.send('gameUpdated', {'game': game.toDict()}, gameId)
     if game.roundStatePlaying and game.playersOrder[game.explainPlayerIndex] == player.userIdHash:
         await game.giveNextWord()
     # FIXME: if player explains the word now?
@@ -492,7 +1073,42 @@ async def playerUpdated(connection, data):
     game = GAME_STORAGE.get(gameId)
     player = game.getPlayerByConnection(connection)
     player.update(**data['player'])
-    await connection.send('playersUpdated', {'players': game.allPlayersDictsList() }, gameId)
+    await game.sendState(connection, 'playersUpdated', {'players': game.allPlayersDictsList() })
+
+
+async def sessionResumed(connection, data):
+    # reconnect of a known session: only the events it missed after data['seq'], no broadcast
+    gameId = data['gameId']
+    if gameId not in GAME_STORAGE:
+        raise NoSuchGame(gameId)
+    game = GAME_STORAGE.get(gameId)
+    missed = None
+    if game.players.get(connection.userIdHash) is not None:
+        missed = connection.session.since(data['seq'])
+    if missed is None:
+        await connection.send('sessionResumeFailed', {'gameId': gameId}, gameId)
+        return
+    game.getPlayerByConnection(connection)
+    connection.resend(missed, gameId)
+
+
+async def spectatorJoined(connection, data):
+    # watching a game: throttled 'spectatorSnapshot' {'game', 'players'} messages, no game events
+    gameId = data['gameId']
+    if gameId not in GAME_STORAGE:
+        raise NoSuchGame(gameId)
+    if connection.spectating is not None:
+        SPECTATORS.remove(connection.spectating, connection)
+    connection.spectating = gameId
+    SPECTATORS.add(gameId, connection)
+
+
+async def stateSnapshotRequested(connection, data):
+    gameId = data['gameId']
+    if gameId not in GAME_STORAGE:
+        raise NoSuchGame(gameId)
+    game = GAME_STORAGE.get(gameId)
+    await connection.send('stateSnapshot', game.snapshot(connection), gameId)
 
 
 async def putWordsInHat(connection, data):
@@ -542,6 +1158,15 @@ async def roundComplete(connection, data):
     await game.startRound()
 
 
+async def roundTimedOut(connection, data):
+    # raised by the round timer, a no-op when the round ended meanwhile
+    gameId = data['gameId']
+    game = GAME_STORAGE.get(gameId)
+    if game.roundNumber != data['roundNumber'] or not game.roundStatePlaying:
+        return
+    await roundComplete(connection, dict(data, lastWordResult='NOT_GUESSED'))
+
+
 async def removePlayer(connection, data):
     gameId = data['gameId']
     game = GAME_STORAGE.get(gameId)
@@ -552,42 +1177,149 @@ async def replayPreviousRound(connection, data):
     gameId = data['gameId']
     game = GAME_STORAGE.get(gameId)
     if game.roundNumber != data['roundNumber']:
-        raise ValueError('Attempt to replay round: ' + str(data['roundNumber']) + 'actual round:' + str(game.roundNumber))
+        raise ClientError('Attempt to replay round: ' + str(data['roundNumber']) + 'actual round:' + str(game.roundNumber))
     await game.replayPreviousRound()
 
 
+C_PLAYER_SCHEMA = {'name': str, 'owner?': bool, 'observer?': (bool, None), 'putWordsInHat?': bool,
+                   'userIdHash?': (str, None)}
+C_GAME_ID = {'gameId': str, ...: object}
+
+# Data of client events, see schemas.py. Objects passed on as keyword arguments are closed.
+C_EVENT_SCHEMAS = {
+    'gameCreated': {'game': {'wordsPerPlayer': int, 'gameMode?': (str, None), 'wordsMode?': (str, None)},
+                    'player': {'name': str, 'observer?': (bool, None), 'putWordsInHat?': bool},
+                    ...: object},
+    'gameStarted': {'gameId': str, 'secondsPerRound': (float, None),
+                    'gameMode': {'CIRCLE', 'RANDOM_PAIRS', 'ASSIGNED_PAIRS'},
+                    'playersPairs?': ([[str]], None), 'ownerIsObserver?': (bool, None)},
+    'playerUpdated': {'gameId': str, 'player': {'observer?': (bool, None)}, ...: object},
+    'playerJoined': {'gameId': str, 'player': C_PLAYER_SCHEMA, 'deltaUpdates?': bool, 'batchUpdates?': bool,
+                     ...: object},
+    'stateSnapshotRequested': C_GAME_ID,
+    'sessionResumed': {'gameId': str, 'seq': int, ...: object},
+    'spectatorJoined': C_GAME_ID,
+    'putWordsInHat': {'gameId': str, 'words': ([str], None), 'dictionary': (str, None), ...: object},
+    'roundConfirmed': {'gameId': str, 'roundNumber': int, ...: object},
+    'wordGuessed': C_GAME_ID,
+    'roundComplete': {'gameId': str, 'lastWordResult': {'GUESSED', 'ERROR', 'NOT_GUESSED'}, ...: object},
+    'removePlayer': {'gameId': str, 'playerToRemoveId': str, ...: object},
+    'replayPreviousRound': {'gameId': str, 'roundNumber': int, ...: object},
+}
+# server events (roundTimedOut) have no schema, clients can not send them
+EVENT_VALIDATORS = schemas.compileSchemas(C_EVENT_SCHEMAS)
+checkMessage = schemas.compileSpec({'event': str, 'data': {...: object}, ...: object}, 'message')
+# events dispatched without a game in memory, the others are refused when there is none
+C_GAMELESS_EVENTS = {'gameCreated', 'playerJoined'}
+
 C_EVENT_HANDLERS = {
     'gameCreated': gameCreated,
     'gameStarted': gameStarted,
 
     'playerUpdated': playerUpdated,
     'playerJoined': playerJoined,
+    'stateSnapshotRequested': stateSnapshotRequested,
+    'spectatorJoined': spectatorJoined,
+    'sessionResumed': sessionResumed,
     'putWordsInHat': putWordsInHat,
 
     'roundConfirmed': roundConfirmed,
     'wordGuessed': wordGuessed,
     'roundComplete': roundComplete,
+    'roundTimedOut': roundTimedOut,
     'removePlayer': removePlayer,
     'replayPreviousRound': replayPreviousRound
 }
+# events that change games, the journal keeps these; the others only concern the connection
+C_JOURNALED_EVENTS = set(C_EVENT_HANDLERS) - {'stateSnapshotRequested', 'spectatorJoined', 'sessionResumed'}
+
+handlerLatency = {event: METRICS.histogram('onlinehat_event_handler_seconds',
+                                           'Time from receiving an event until its handler finished', event=event)
+                  for event in C_EVENT_HANDLERS}
+
+
+def rejectMessage(connection, event, reason, error, extra):
+    METRICS.increment('onlinehat_rejected_messages_total', 'Inbound messages refused',
+                      reason=reason, event=event if event in C_EVENT_HANDLERS else 'unknown')
+    access_logger.info('rejected event:%s reason:%s %s', event, reason, error, extra=dict(extra, event=event))
+    connection.sendFrame(Frame('eventRejected', {'event': event, 'reason': reason, 'error': error}), extra['gameId'])
 
 
 async def consumer(connection, message):
+    event = None
+    dispatch = None
+    dispatched = False
+    extra = {
+        'userIdHash': connection.userIdHash,
+        'sessionId': connection.sessionId,
+        'gameId': None
+    }
     try:
-        message = json.loads(message)
+        start = time.perf_counter()
+        try:
+            message = connection.wireCodec.decode(message)
+            checkMessage(message)
+        except (ValueError, TypeError) as e:
+            rejectMessage(connection, None, 'malformed', str(e), extra)
+            return
         event = message['event']
         data = message['data']
-        extra = {
-            'userIdHash': connection.userIdHash,
-            'sessionId': connection.sessionId,
-            'gameId': data.get('gameId')
-        }
-        access_logger.info('recieved event:%s data:%s', event, json.dumps(data), extra=extra)
-        await C_EVENT_HANDLERS[event](connection, data)
+        if connection.limited:
+            scope = RATE_LIMITER.admit(connection.rateBucket, connection.userIdHash, event)
+            if scope is not None:
+                connection.throttledMessages += 1
+                METRICS.increment('onlinehat_throttled_messages_total', 'Inbound messages dropped by rate limits',
+                                  scope=scope, event=event if event in C_EVENT_HANDLERS else 'unknown')
+                if event in C_JOURNALED_EVENTS:
+                    # the client waits for the game to move on, it is told why it does not
+                    rejectMessage(connection, event, 'throttled', scope + ' rate limit', extra)
+                return
+        validate = EVENT_VALIDATORS.get(event)
+        if validate is None:
+            rejectMessage(connection, event, 'unknownEvent', 'unknown event', extra)
+            return
+        try:
+            validate(data)
+        except schemas.SchemaError as e:
+            rejectMessage(connection, event, 'invalid', str(e), extra)
+            return
+        gameId = extra['gameId'] = data.get('gameId')
+        # logged as the JSON of its data, like sent frames: the log splices in payloads as they are,
+        # so they must be encoded by the server and not be the client's text
+        access_logger.info('recieved event:%s', event,
+                           extra=dict(extra, event=event, payload=Frame(event, data)))
+        handler = C_EVENT_HANDLERS[event]
+        game = GAME_STORAGE.get(gameId)
+        if game is None and event not in C_GAMELESS_EVENTS:
+            rejectMessage(connection, event, 'noSuchGame', 'no such game', extra)
+            return
+        if PROFILER.active:
+            dispatch = PROFILER.begin(gameId, event)
+        dispatched = True
+        if game is not None:
+            await game.submit(handler, connection, data, event)
+        else:
+            await handler(connection, data)
+            journalEvent(data.get('gameId'), event, data, connection.userIdHash)
+        handlerLatency[event].observe(time.perf_counter() - start)
+        if dispatch is not None:
+            PROFILER.end(dispatch)
+    except ClientError as e:
+        if dispatch is not None:
+            PROFILER.end(dispatch)
+        rejectMessage(connection, event, 'refused', str(e), extra)
     except Exception as e:
         extype, ex, tb = sys.exc_info()
         formatted = traceback.format_exception_only(extype, ex)[-1].strip()
+        METRICS.increment('onlinehat_event_errors_total', 'Events that failed',
+                          event=event if event in C_EVENT_HANDLERS else 'unknown')
+        if dispatch is not None:
+            PROFILER.end(dispatch)
         error_logger.exception('exception:%s data:%s', formatted, message, extra=extra)
+    finally:
+        # failed events too, replaying them reproduces the failure
+        if dispatched and RECORDER is not None:
+            RECORDER.record(data.get('gameId'), connection.userIdHash, event, data)
 
 
 async def consumer_handler(connection):
@@ -600,13 +1332,261 @@ async def consumer_handler(connection):
         print('consumer_handler connection closed ok')
 
 
+class Frame:
+    # Outbound event encoded at most once per codec and shared by every recipient and by the access log.
+    # Only the data JSON is kept for JSON, its body is a cheap wrapper
+    __slots__ = ('event', 'data', '_dataJson', '_bodies', '_stored')
+
+    def __init__(self, event, data):
+        self.event = event
+        self.data = data
+        self._dataJson = None
+        self._bodies = None
+        self._stored = None
+
+    @property
+    def dataJson(self):
+        if self._dataJson is None:
+            self._dataJson = codec.JSON.encode(self.data)
+        return self._dataJson
+
+    def body(self, wireCodec):
+        if wireCodec is codec.JSON:
+            return wireCodec.body(self.event, self.data, self.dataJson)
+        if self._bodies is None:
+            self._bodies = {}
+        body = self._bodies.get(wireCodec.name)
+        if body is None:
+            body = self._bodies[wireCodec.name] = wireCodec.body(self.event, self.data)
+        return body
+
+    def stored(self):
+        # what session buffers keep of the frame, one for all of them
+        if self._stored is None:
+            self._stored = StoredFrame(self.event, self.dataJson)
+        return self._stored
+
+    def __str__(self):
+        return self.dataJson
+
+
+class StoredFrame(Frame):
+    # A sent frame kept for resending: the JSON of its data and nothing else, other codecs
+    # decode the data again. Resending is rare, the buffers of all sessions are always there.
+    __slots__ = ()
+
+    def __init__(self, event, dataJson):
+        self.event = event
+        self._dataJson = dataJson
+
+    @property
+    def data(self):
+        return codec.JSON.decode(self._dataJson)
+
+    def body(self, wireCodec):
+        if wireCodec is codec.JSON:
+            return wireCodec.body(self.event, None, self._dataJson)
+        return wireCodec.body(self.event, self.data)
+
+    def stored(self):
+        return self
+
+
+class BatchFrame(Frame):
+    # 'batch' of frames that are also sent on their own: the JSON encoding reuses theirs
+    __slots__ = ('frames',)
+
+    def __init__(self, frames):
+        Frame.__init__(self, 'batch', {'events': [{'event': frame.event, 'data': frame.data} for frame in frames]})
+        self.frames = frames
+
+    @property
+    def dataJson(self):
+        if self._dataJson is None:
+            self._dataJson = '{"events": [%s]}' % ', '.join(
+                '{"event": %s, "data": %s}' % (codec.JSON.encode(frame.event), frame.dataJson)
+                for frame in self.frames)
+        return self._dataJson
+
+
+C_SESSION_BUFFER_SIZE = 32
+# Bytes of data JSON a session keeps at most, the newest event is kept whatever its size
+C_SESSION_BUFFER_BYTES = 8 * 1024
+C_SESSION_TTL = 10 * 60
+C_MAX_SESSIONS = 200000
+
+
+class Session:
+    # Outbound events of one player session (userIdHash + sessionId) across its connections:
+    # every event gets the next seq, the last C_SESSION_BUFFER_SIZE that fit in
+    # C_SESSION_BUFFER_BYTES are kept for resumption, oldest first
+    __slots__ = ('userIdHash', 'sessionId', 'seq', 'connections', '_buffer', '_bufferBytes')
+
+    def __init__(self, userIdHash, sessionId):
+        self.userIdHash = userIdHash
+        self.sessionId = sessionId
+        self.seq = 0
+        self.connections = 0
+        self._buffer = None
+        self._bufferBytes = 0
+
+    def record(self, frame):
+        stored = frame.stored()
+        if self._buffer is None:
+            self._buffer = []
+        self._buffer.append(stored)
+        self._bufferBytes += len(stored.dataJson)
+        while len(self._buffer) > C_SESSION_BUFFER_SIZE or \
+                (self._bufferBytes > C_SESSION_BUFFER_BYTES and len(self._buffer) > 1):
+            self._bufferBytes -= len(self._buffer.pop(0).dataJson)
+        self.seq += 1
+        return self.seq
+
+    def since(self, seq):
+        # events after seq, None when some of them are not buffered any more or seq is from
+        # another life of the session (evicted meanwhile, a server restart)
+        if seq == self.seq:
+            return []
+        buffered = len(self._buffer) if self._buffer is not None else 0
+        if seq > self.seq or seq < 0 or self.seq - seq > buffered:
+            return None
+        return list(zip(range(seq + 1, self.seq + 1), self._buffer[buffered - (self.seq - seq):]))
+
+
+class SessionStore:
+    # Sessions without connections are dropped after C_SESSION_TTL
+    def __init__(self, ttl=C_SESSION_TTL, maxSessions=C_MAX_SESSIONS, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxSessions = maxSessions
+        self._clock = clock
+        self._sessions = collections.OrderedDict()
+        self._lastActivity = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def attach(self, userIdHash, sessionId):
+        key = (userIdHash, sessionId)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = Session(userIdHash, sessionId)
+        session.connections += 1
+        self._touch(key)
+        return session
+
+    def detach(self, session):
+        session.connections -= 1
+        key = (session.userIdHash, session.sessionId)
+        if self._sessions.get(key) is session:
+            self._touch(key)
+
+    def _touch(self, key):
+        self._sessions.move_to_end(key)
+        self._lastActivity[key] = self._clock()
+
+    def evict(self):
+        now = self._clock()
+        for key, session in list(self._sessions.items()):
+            overCapacity = len(self._sessions) > self.maxSessions
+            if not overCapacity and now - self._lastActivity[key] <= self.ttl:
+                break
+            if session.connections <= 0 or overCapacity:
+                self._sessions.pop(key)
+                self._lastActivity.pop(key)
+
+    async def runEviction(self, interval=C_EVICTION_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
+
+
+SESSIONS = SessionStore()
+
+
+C_OUTBOX_SIZE = 64
+# What to do when a connection's outbox is full:
+#   'DROP_OLDEST'  - drop the oldest queued message
+#   'LATEST_STATE' - replace a queued message of the same collapsible event, else drop the oldest
+#   'DISCONNECT'   - close the slow connection
+C_SLOW_CONSUMER_POLICY = 'LATEST_STATE'
+C_COLLAPSIBLE_EVENTS = {'gameUpdated', 'nextWord', 'stateSnapshot', 'spectatorSnapshot'}
+
+# Admission control. Handshakes are refused over C_MAX_CONNECTIONS open connections and over
+# C_HANDSHAKE_RATE_LIMIT per userId cookie. Inbound messages over a limit are dropped before
+# they are logged or dispatched: per connection, per userIdHash over all of its connections
+# and per userIdHash and event. Limits are (messages per second, burst), None for no limit.
+C_MAX_CONNECTIONS = 20000
+C_RETRY_AFTER = 5
+C_HANDSHAKE_RATE_LIMIT = (1, 10)
+C_CONNECTION_RATE_LIMIT = (20, 40)
+C_USER_RATE_LIMIT = (30, 60)
+C_EVENT_RATE_LIMITS = {
+    'gameCreated': (0.2, 5),
+    'wordGuessed': (4, 8),
+    'stateSnapshotRequested': (1, 5),
+    'sessionResumed': (1, 5),
+}
+C_RATE_LIMIT_PRUNE_INTERVAL = 60
+RATE_LIMITER = ratelimit.RateLimiter(C_CONNECTION_RATE_LIMIT, C_USER_RATE_LIMIT, C_EVENT_RATE_LIMITS,
+                                     C_HANDSHAKE_RATE_LIMIT)
+
+
+async def pruneRateLimits(interval=C_RATE_LIMIT_PRUNE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        RATE_LIMITER.prune()
+
+
+class DetachedConnection:
+    # Stands for a player's connection while there is no socket: games recovered
+    # from the journal, events replayed from it
+    deltaUpdates = False
+    batchUpdates = False
+    spectating = None
+    # events of detached connections come from the server and the journal, not from clients
+    limited = False
+    closed = True
+    wireCodec = codec.JSON
+
+    def __init__(self, userIdHash, sessionId=None):
+        self.userIdHash = userIdHash
+        self.sessionId = sessionId
+
+    async def send(self, event, data, gameId):
+        pass
+
+    def sendFrame(self, frame, gameId, log=True):
+        pass
+
+
+CONNECTIONS = set()
+
+
 class Connection:
+    # Connections of idle players are many and long lived: slots, a plain list outbox and
+    # a writer task only while there is something to send
+    __slots__ = ('websocket', 'wireCodec', 'userIdHash', 'sessionId', 'closed', 'droppedMessages',
+                 'deltaUpdates', 'batchUpdates', 'spectating', 'limited', 'rateBucket',
+                 'throttledMessages', 'session', '_outbox', '_writer')
+
     def __init__(self, websocket, userId, sessionId, path):
         self.websocket = websocket
-        self.userId = userId
-        self.userIdHash = hashlib.sha1(self.userId.encode()).hexdigest()
+        self.wireCodec = codec.negotiated(getattr(websocket, 'subprotocol', None))
+        # the same userIdHash string for all connections, players and sessions of a user
+        self.userIdHash = sys.intern(hashlib.sha1(userId.encode()).hexdigest())
         self.sessionId = sessionId
-        self.path = path
+        self.closed = False
+        self.droppedMessages = 0
+        self.deltaUpdates = False
+        self.batchUpdates = False
+        self.spectating = None
+        self.limited = True
+        self.rateBucket = RATE_LIMITER.connectionBucket()
+        self.throttledMessages = 0
+        self.session = SESSIONS.attach(self.userIdHash, self.sessionId)
+        CONNECTIONS.add(self)
+        self._outbox = []
+        self._writer = None
         extra = {
             'userIdHash': self.userIdHash,
             'sessionId': self.sessionId,
@@ -615,20 +1595,95 @@ class Connection:
         access_logger.info('client connected', extra=extra)
 
     async def send(self, event, data, gameId):
+        self.sendFrame(Frame(event, data), gameId)
+
+    def sendFrame(self, frame, gameId, log=True):
+        # log=False for frames fanned out to many connections, like spectator snapshots
         extra = {
             'userIdHash': self.userIdHash,
             'sessionId': self.sessionId,
             'gameId': gameId
         }
-        access_logger.info('sending event:%s data:%s', event, json.dumps(data), extra=extra)
-        try:
-            await self.websocket.send(
-                json.dumps({'event': event,
-                            'data': data}))
-        except websockets.exceptions.ConnectionClosedError:
-            access_logger.info('send connection closed error', extra=extra)
-        except websockets.exceptions.ConnectionClosedOK:
-            access_logger.info('send connection closed ok', extra=extra)
+        self._enqueue(frame, extra)
+        if log:
+            access_logger.info('sending event:%s', frame.event,
+                               extra=dict(extra, event=frame.event, payload=frame))
+
+    def resend(self, missed, gameId):
+        extra = {
+            'userIdHash': self.userIdHash,
+            'sessionId': self.sessionId,
+            'gameId': gameId
+        }
+        for seq, frame in missed:
+            self._enqueue(frame, extra, seq)
+
+    def _enqueue(self, frame, extra, seq=None):
+        if seq is None:
+            # recorded even when closed: the session may resume on another connection
+            seq = self.session.record(frame)
+        if self.closed:
+            return
+        if len(self._outbox) >= C_OUTBOX_SIZE:
+            if C_SLOW_CONSUMER_POLICY == 'DISCONNECT':
+                access_logger.info('slow consumer disconnected', extra=extra)
+                self.close()
+                asyncio.ensure_future(self.websocket.close())
+                return
+            self.droppedMessages += 1
+            METRICS.increment('onlinehat_dropped_messages_total', 'Messages dropped for slow consumers')
+            superseded = None
+            if C_SLOW_CONSUMER_POLICY == 'LATEST_STATE':
+                superseded = self._oldestSuperseded(frame.event)
+            if superseded is None:
+                self._outbox.pop(0)
+            else:
+                self._outbox.remove(superseded)
+            access_logger.info('slow consumer dropped message', extra=extra)
+        self._outbox.append((frame.event, seq, frame))
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._writeLoop(extra))
+
+    def _oldestSuperseded(self, event):
+        # oldest queued state message that a newer queued (or incoming) one of the same event replaces
+        newer = {event}
+        superseded = None
+        for queued in reversed(self._outbox):
+            if queued[0] in C_COLLAPSIBLE_EVENTS:
+                if queued[0] in newer:
+                    superseded = queued
+                else:
+                    newer.add(queued[0])
+        return superseded
+
+    async def _writeLoop(self, extra):
+        # ends when the outbox is empty, _enqueue starts a new one
+        while self._outbox and not self.closed:
+            event, seq, frame = self._outbox.pop(0)
+            try:
+                await self.websocket.send(self.wireCodec.message(seq, frame.body(self.wireCodec)))
+            except websockets.exceptions.ConnectionClosedError:
+                access_logger.info('send connection closed error', extra=extra)
+                self.close()
+            except websockets.exceptions.ConnectionClosedOK:
+                access_logger.info('send connection closed ok', extra=extra)
+                self.close()
+        self._writer = None
+
+    async def drain(self):
+        while self._outbox and not self.closed:
+            await asyncio.sleep(0)
+
+    def close(self):
+        if not self.closed:
+            SESSIONS.detach(self.session)
+            CONNECTIONS.discard(self)
+            if self.spectating is not None:
+                SPECTATORS.remove(self.spectating, self)
+        self.closed = True
+        self._outbox.clear()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
 
 
 def random_id(length):
@@ -641,6 +1696,88 @@ def random_id(length):
     return id
 
 
+METRICS.gauge('onlinehat_active_games', 'Games in memory', lambda: len(GAME_STORAGE))
+METRICS.gauge('onlinehat_games_resident_bytes', 'Approximate memory taken by the games in memory',
+              lambda: GAME_STORAGE.approximateSize())
+METRICS.gauge('onlinehat_active_connections', 'Open WebSocket connections', lambda: len(CONNECTIONS))
+METRICS.gauge('onlinehat_spectators', 'Connections watching games as spectators', lambda: len(SPECTATORS))
+METRICS.gauge('onlinehat_rate_limit_buckets', 'Token buckets kept for users and events', lambda: len(RATE_LIMITER))
+METRICS.gauge('onlinehat_recording_dropped', 'Recorded events dropped on a full queue',
+              lambda: RECORDER.dropped if RECORDER is not None else 0)
+METRICS.gauge('onlinehat_journal_failed_writes', 'Journal batches lost to failed writes',
+              lambda: GAME_STORAGE.journal.failedWrites if GAME_STORAGE.journal is not None else 0)
+METRICS.gauge('onlinehat_sessions', 'Player sessions kept for resumption', lambda: len(SESSIONS))
+METRICS.gauge('onlinehat_outbox_messages', 'Messages queued for sending, over all connections',
+              lambda: sum(len(connection._outbox) for connection in CONNECTIONS))
+METRICS.gauge('onlinehat_outbox_max_messages', 'Longest outbound queue of a connection',
+              lambda: max((len(connection._outbox) for connection in CONNECTIONS), default=0))
+METRICS.gauge('onlinehat_access_log_dropped', 'Access log records dropped on a full queue',
+              lambda: access_queue_handler.dropped)
+METRICS.gauge('onlinehat_access_log_sampled_out', 'Access log records left out by level or sample rate',
+              lambda: access_sampler.sampledOut)
+METRICS.gauge('onlinehat_access_log_written', 'Access log records written to the file',
+              lambda: access_writer.written)
+
+
+async def controlProfiler(query):
+    if C_PROFILE_TOKEN is None or query.get('token') != C_PROFILE_TOKEN:
+        return http.HTTPStatus.FORBIDDEN, 'forbidden\n'
+    if query.get('stop'):
+        written = await PROFILER.stopInExecutor(asyncio.get_event_loop())
+        if written is None:
+            return http.HTTPStatus.OK, 'not running\n'
+        return http.HTTPStatus.OK, 'slow dispatches: %d\n%s\n' % (PROFILER.slowDispatches, '\n'.join(written))
+    try:
+        seconds = float(query['seconds']) if 'seconds' in query else None
+        threshold = float(query.get('threshold', profiling.C_SLOW_THRESHOLD))
+    except ValueError:
+        seconds = threshold = float('nan')
+    # comparisons with nan are false
+    if not (seconds is None or 0 < seconds < float('inf')) or not 0 <= threshold < float('inf'):
+        return http.HTTPStatus.BAD_REQUEST, 'seconds and threshold are positive numbers\n'
+    PROFILER.start(query.get('gameId'), query.get('event'), seconds, threshold, asyncio.get_event_loop())
+    return http.HTTPStatus.OK, 'profiling gameId:%s event:%s seconds:%s\n' % (
+        PROFILER.gameId, PROFILER.event, seconds)
+
+
+def cookieValue(cookies, name):
+    for cookie in cookies.split(';'):
+        key, _, value = cookie.strip().partition('=')
+        if key == name:
+            return value
+    return None
+
+
+def rejectHandshake(status, reason):
+    METRICS.increment('onlinehat_rejected_handshakes_total', 'WebSocket handshakes refused', reason=reason)
+    return status, [('Content-Type', 'text/plain'), ('Retry-After', str(C_RETRY_AFTER))], (reason + '\n').encode()
+
+
+async def processRequest(path, requestHeaders, remoteAddress=None):
+    # plain HTTP next to the WebSocket handshake: None lets the handshake go on
+    route, _, query = path.partition('?')
+    if route == C_METRICS_PATH:
+        return http.HTTPStatus.OK, [('Content-Type', 'text/plain; version=0.0.4')], METRICS.render().encode()
+    if route == C_PROFILE_PATH:
+        status, body = await controlProfiler(dict(urllib.parse.parse_qsl(query)))
+        return status, [('Content-Type', 'text/plain')], body.encode()
+    if len(CONNECTIONS) >= C_MAX_CONNECTIONS:
+        return rejectHandshake(http.HTTPStatus.SERVICE_UNAVAILABLE, 'capacity')
+    # by userId cookie, clients reconnecting without one by their address
+    key = cookieValue(requestHeaders.get('cookie', ''), 'userId')
+    if key is None and remoteAddress:
+        key = 'address:' + str(remoteAddress[0])
+    if key is not None and not RATE_LIMITER.admitHandshake(key):
+        return rejectHandshake(http.HTTPStatus.TOO_MANY_REQUESTS, 'rate')
+    return None
+
+
+class ServerProtocol(websockets.WebSocketServerProtocol):
+    # hands the peer address to processRequest, which process_request= callables do not get
+    async def process_request(self, path, requestHeaders):
+        return await processRequest(path, requestHeaders, self.remote_address)
+
+
 async def server(websocket, path):
     try:
         cookies = websocket.request_headers["cookie"].split()
@@ -666,20 +1803,28 @@ async def server(websocket, path):
     )
     for task in pending:
         task.cancel()
+    connection.close()
+
+
+def prepareServer(journalPath=C_JOURNAL_PATH):
+    DICTS.update(loadDicts(C_DICTS_DIR, C_DICT_NAMES))
+    GAME_STORAGE.journal = GameJournal(journalPath, onWriteError=journalWriteFailed)
+    asyncio.get_event_loop().run_until_complete(recoverGames(GAME_STORAGE.journal))
+    atexit.register(GAME_STORAGE.journal.close)
+    asyncio.ensure_future(GAME_STORAGE.runEviction())
+    asyncio.ensure_future(SESSIONS.runEviction())
+    asyncio.ensure_future(snapshotGames(GAME_STORAGE.journal))
+    asyncio.ensure_future(metrics.measureLoopLag(loopLag))
+    asyncio.ensure_future(ROUND_TIMERS.run())
+    asyncio.ensure_future(SPECTATORS.run())
+    asyncio.ensure_future(pruneRateLimits())
 
 
 if __name__ == '__main__':
-    for dict_name in ['simple', 'medium', 'hard']:
-        words = []
-        with open('dicts/%s.txt' % dict_name) as infile:
-            for line in infile:
-                line = line.strip()
-                if line != '':
-                    words.append(line)
-        DICTS[dict_name] = words
+    prepareServer()
 
     start_server = websockets.serve(
-        server, "localhost", 8080#, ssl=ssl_context
+        server, "localhost", 8080, subprotocols=codec.SUBPROTOCOLS, create_protocol=ServerProtocol#, ssl=ssl_context
     )
 
     asyncio.get_event_loop().run_until_complete(start_server)
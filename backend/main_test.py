@@ -3,12 +3,18 @@ import pytest
 
 
 class MockConnection:
+    deltaUpdates = False
+    batchUpdates = False
+
     def __init__(self, userIdHash):
         self.userIdHash = userIdHash
 
     async def send(*args, **kwargs):
         pass
 
+    def sendFrame(*args, **kwargs):
+        pass
+
 
 def relevantPartOfGameDict(gameDict):
     return {x:gameDict[x] for x in [
@@ -52,3 +58,937 @@ async def test_replay_round(C_NUM_PLAYERS, C_GAME_MODE):
         await game.replayPreviousRound()
 
     assert rounds == afterRounds[::-1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("C_GAME_MODE", ['CIRCLE', 'RANDOM_PAIRS'])
+async def test_go_to_round(C_GAME_MODE):
+    games = []
+    for i in range(2):
+        game = Game('test', 6, gameMode=C_GAME_MODE)
+        for playerIndex in range(6):
+            await game.addPlayer(Player(MockConnection(str(playerIndex)), 'player_%d' % playerIndex))
+            game.addWords(str(playerIndex), [str(i) for i in range(6)])
+        game.seed(1)
+        await game.startGame()
+        games.append(game)
+    stepped, jumped = games
+    await stepped.startRound()
+    upcoming = stepped.upcomingRounds(40)
+    for roundNumber in range(40):
+        await stepped.startRound()
+        assert upcoming[roundNumber] == (stepped.toDict()['explainPlayerId'], stepped.toDict()['guessPlayerId'])
+    await jumped.goToRound(40)
+    assert relevantPartOfGameDict(jumped.toDict()) == relevantPartOfGameDict(stepped.toDict())
+    await jumped.goToRound(3)
+    for roundNumber in range(37):
+        await stepped.replayPreviousRound()
+    assert relevantPartOfGameDict(jumped.toDict()) == relevantPartOfGameDict(stepped.toDict())
+
+    recovered = Game.fromSnapshot(stepped.toSnapshot())
+    await recovered.startRound()
+    await stepped.startRound()
+    assert relevantPartOfGameDict(recovered.toDict()) == relevantPartOfGameDict(stepped.toDict())
+
+
+@pytest.mark.asyncio
+async def test_remove_player_mid_game():
+    game = Game('test', 5)
+    for playerIndex in range(5):
+        await game.addPlayer(Player(MockConnection(str(playerIndex)), 'player_%d' % playerIndex))
+        game.addWords(str(playerIndex), [str(i) for i in range(5)])
+    await game.startGame()
+    for roundNumber in range(13):
+        await game.startRound()
+    assert (game.roundNumber, game.circleNumber, game.epochNumber,
+            game.explainPlayerIndex, game.guessPlayerIndex) == (12, 2, 0, 2, 0)
+    await game.removePlayer(game.playersOrder[4])
+    # the rotation goes on from where it was, with one player less
+    await game.startRound()
+    assert (game.roundNumber, game.circleNumber, game.epochNumber,
+            game.explainPlayerIndex, game.guessPlayerIndex) == (13, 2, 0, 3, 1)
+    await game.startRound()
+    assert (game.circleNumber, game.epochNumber, game.explainPlayerIndex, game.guessPlayerIndex) == (3, 0, 0, 3)
+
+    recovered = Game.fromSnapshot(game.toSnapshot())
+    await recovered.startRound()
+    await game.startRound()
+    assert relevantPartOfGameDict(recovered.toDict()) == relevantPartOfGameDict(game.toDict())
+
+
+class StuckWebsocket:
+    def __init__(self):
+        self.sent = []
+        self.unblock = asyncio.Event()
+
+    async def send(self, message):
+        await self.unblock.wait()
+        self.sent.append(json.loads(message))
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("C_POLICY", ['DROP_OLDEST', 'LATEST_STATE', 'DISCONNECT'])
+async def test_slow_consumer_policy(C_POLICY, monkeypatch):
+    monkeypatch.setattr(sys.modules['main'], 'C_SLOW_CONSUMER_POLICY', C_POLICY)
+    websocket = StuckWebsocket()
+    connection = Connection(websocket, 'user', 'session', '/')
+    await connection.send('gameUpdated', {'version': -1}, 'test')
+    await asyncio.sleep(0)
+    for i in range(C_OUTBOX_SIZE + 10):
+        await connection.send('playersUpdated' if i % 2 else 'gameUpdated', {'version': i}, 'test')
+    if C_POLICY == 'DISCONNECT':
+        assert connection.closed
+        return
+    assert len(connection._outbox) == C_OUTBOX_SIZE
+    assert connection.droppedMessages == 10
+    websocket.unblock.set()
+    await connection.drain()
+    versions = [m['data']['version'] for m in websocket.sent]
+    assert versions[-1] == C_OUTBOX_SIZE + 9
+    if C_POLICY == 'LATEST_STATE':
+        # superseded game states go first, every players update survives
+        assert [v for v in versions[1:] if v % 2] == list(range(1, C_OUTBOX_SIZE + 10, 2))
+    connection.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_does_not_block_broadcast():
+    game = Game('test', 1)
+    stuck = StuckWebsocket()
+    fast = StuckWebsocket()
+    fast.unblock.set()
+    stuckConnection = Connection(stuck, 'stuck', 'session', '/')
+    fastConnection = Connection(fast, 'fast', 'session', '/')
+    await game.addPlayer(Player(stuckConnection, 'stuck'))
+    await game.addPlayer(Player(fastConnection, 'fast'))
+    await fastConnection.drain()
+    assert len(fast.sent) == 1
+    assert stuck.sent == []
+    stuckConnection.close()
+    fastConnection.close()
+
+
+def test_frame_matches_json():
+    data = {'players': [{'name': 'игрок', 'owner': True, 'score': None}], 'playersOrder': ['a', 'b']}
+    frame = Frame('playersUpdated', data)
+    message = codec.JSON.message(7, frame.body(codec.JSON))
+    assert json.loads(message) == {'seq': 7, 'event': 'playersUpdated', 'data': data}
+    assert json.loads(str(frame)) == data
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_once(monkeypatch):
+    game = Game('test', 1)
+    connections = []
+    for playerIndex in range(5):
+        websocket = StuckWebsocket()
+        websocket.unblock.set()
+        connection = Connection(websocket, str(playerIndex), 'session', '/')
+        connections.append(connection)
+        await game.addPlayer(Player(connection, 'player_%d' % playerIndex))
+    for connection in connections:
+        await connection.drain()
+    encoded = []
+    encode = codec.JSON.encode
+    monkeypatch.setattr(codec.JSON, 'encode', lambda value: encoded.append(value) or encode(value))
+    await game.notifyAllPlayers('playersUpdated', {'players': game.allPlayersDictsList()})
+    for connection in connections:
+        await connection.drain()
+    # the payload once, shared by all 5 recipients and the log; event names are encoded once per process
+    assert [value for value in encoded if value != 'playersUpdated'] == [{'players': game.allPlayersDictsList()}]
+    assert encoded.count('playersUpdated') <= 1
+    for connection in connections:
+        connection.close()
+
+
+class BinaryWebsocket:
+    subprotocol = 'onlinehat.msgpack'
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(codec.CODECS[self.subprotocol].decode(message))
+
+
+@pytest.mark.asyncio
+async def test_codecs_share_broadcast():
+    pytest.importorskip('msgpack')
+    game = Game('codecs', 1)
+    GAME_STORAGE['codecs'] = game
+    textWebsocket = StuckWebsocket()
+    textWebsocket.unblock.set()
+    binaryWebsocket = BinaryWebsocket()
+    text = Connection(textWebsocket, 'text', 'session', '/')
+    binary = Connection(binaryWebsocket, 'binary', 'session', '/')
+    assert binary.wireCodec is codec.CODECS['onlinehat.msgpack']
+    await game.addPlayer(Player(text, 'text'))
+    message = binary.wireCodec.encode({'event': 'playerJoined',
+                                       'data': {'gameId': 'codecs', 'player': {'name': 'binary'}}})
+    await consumer(binary, message)
+    for connection in (text, binary):
+        await connection.drain()
+    assert textWebsocket.sent[-1]['event'] == binaryWebsocket.sent[-1]['event'] == 'playersUpdated'
+    assert textWebsocket.sent[-1]['data'] == binaryWebsocket.sent[-1]['data']
+    assert [p['name'] for p in binaryWebsocket.sent[-1]['data']['players']] == ['text', 'binary']
+    GAME_STORAGE.pop('codecs')
+    text.close()
+    binary.close()
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    connection = RecordingConnection('metrics')
+    await sendEvent(connection, 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connection.received[-1][1]['gameId']
+    await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'owner'}})
+    assert await processRequest('/wsapiv1', {}) is None
+    status, headers, body = await processRequest(C_METRICS_PATH, {})
+    assert status == 200
+    text = body.decode()
+    count = handlerLatency['playerJoined'].count
+    assert count >= 1
+    assert 'onlinehat_event_handler_seconds_count{event="playerJoined"} %d\n' % count in text
+    assert 'onlinehat_broadcast_seconds_count' in text
+    assert 'onlinehat_active_games %d\n' % len(GAME_STORAGE) in text
+    assert 'onlinehat_access_log_sampled_out %d\n' % access_sampler.sampledOut in text
+    # the writer thread counts on while the test reads
+    assert 'onlinehat_access_log_written ' in text
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_rate_limits(monkeypatch):
+    clock = FakeClock()
+    limiter = ratelimit.RateLimiter((100, 100), (100, 100), {'stateSnapshotRequested': (1, 3)}, (1, 2), clock=clock)
+    monkeypatch.setattr(sys.modules['main'], 'RATE_LIMITER', limiter)
+    owner = RecordingConnection('owner')
+    await sendEvent(owner, 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = owner.received[-1][1]['gameId']
+    # a client spamming an event gets its burst, the rest is dropped before dispatch
+    connection = RecordingConnection('spammer')
+    connection.limited = True
+    connection.rateBucket = limiter.connectionBucket()
+    connection.throttledMessages = 0
+    for i in range(10):
+        await sendEvent(connection, 'stateSnapshotRequested', {'gameId': gameId})
+    assert [event for event, data in connection.received] == ['stateSnapshot'] * 3
+    assert connection.throttledMessages == 7
+    clock.now += 1
+    await sendEvent(connection, 'stateSnapshotRequested', {'gameId': gameId})
+    assert len(connection.received) == 4
+    # events from the server and the journal are never limited
+    for i in range(10):
+        await sendEvent(owner, 'stateSnapshotRequested', {'gameId': gameId})
+    assert len(owner.received) == 11
+    text = METRICS.render()
+    assert 'onlinehat_throttled_messages_total{event="stateSnapshotRequested",scope="event"}' in text
+    # a throttled event that changes the game gets an answer, the client would wait for one
+    frames = []
+    connection.sendFrame = lambda frame, gameId: frames.append(frame)
+    monkeypatch.setitem(limiter._events, 'wordGuessed', ratelimit.BucketMap((1, 1)))
+    for i in range(2):
+        await sendEvent(connection, 'wordGuessed', {'gameId': gameId})
+    assert [(frame.event, frame.data['reason']) for frame in frames][-1] == ('eventRejected', 'throttled')
+    assert frames[-1].data['event'] == 'wordGuessed'
+    assert 'onlinehat_rejected_messages_total{event="wordGuessed",reason="throttled"}' in METRICS.render()
+
+    headers = {'cookie': 'userId=reconnecting; sessionId=s;'}
+    assert [await processRequest('/wsapiv1', headers) for i in range(2)] == [None, None]
+    status, _, body = await processRequest('/wsapiv1', headers)
+    assert status == 429
+    # without a cookie, by address
+    address = ('192.0.2.1', 50000)
+    assert [await processRequest('/wsapiv1', {}, address) for i in range(2)] == [None, None]
+    assert (await processRequest('/wsapiv1', {}, address))[0] == 429
+    assert await processRequest('/wsapiv1', {}, ('192.0.2.2', 50000)) is None
+    monkeypatch.setattr(sys.modules['main'], 'C_MAX_CONNECTIONS', len(CONNECTIONS))
+    status, _, body = await processRequest('/wsapiv1', {})
+    assert status == 503
+    assert (await processRequest(C_METRICS_PATH, {}))[0] == 200
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_rejected_messages(monkeypatch):
+    owner = RecordingConnection('owner')
+    await sendEvent(owner, 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = owner.received[-1][1]['gameId']
+    connection = RecordingConnection('client')
+    frames = []
+    connection.sendFrame = lambda frame, gameId: frames.append(frame.data)
+    tracebacks = []
+    monkeypatch.setattr(error_logger, 'exception', lambda *args, **kwargs: tracebacks.append(args))
+
+    # bad input gets a reply and a counter, no traceback and no handler call
+    await consumer(connection, '{"event": "wordGuessed", "data": ')
+    await consumer(connection, '[1, 2]')
+    await sendEvent(connection, 'roundTimedOut', {'gameId': gameId, 'roundNumber': 0})
+    await sendEvent(connection, 'roundComplete', {'gameId': gameId, 'lastWordResult': 'MAYBE'})
+    await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'x', 'admin': True}})
+    await sendEvent(connection, 'wordGuessed', {'gameId': 'missing'})
+    await sendEvent(connection, 'replayPreviousRound', {'gameId': gameId, 'roundNumber': 7})
+    assert [(data['event'], data['reason']) for data in frames] == [
+        (None, 'malformed'), (None, 'malformed'), ('roundTimedOut', 'unknownEvent'), ('roundComplete', 'invalid'),
+        ('playerJoined', 'invalid'), ('wordGuessed', 'noSuchGame'), ('replayPreviousRound', 'refused')]
+    assert frames[3]['error'] == "data.lastWordResult: expected one of ['ERROR', 'GUESSED', 'NOT_GUESSED'], got 'MAYBE'"
+    assert tracebacks == []
+    assert 'onlinehat_rejected_messages_total{event="roundComplete",reason="invalid"}' in METRICS.render()
+
+    # a server bug still gets its traceback
+    monkeypatch.setitem(C_EVENT_HANDLERS, 'wordGuessed', lambda connection, data: 1 / 0)
+    await sendEvent(connection, 'wordGuessed', {'gameId': gameId})
+    assert len(tracebacks) == 1 and len(frames) == 7
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_received_messages_logged_as_encoded(caplog, tmp_path):
+    owner = RecordingConnection('owner')
+    await sendEvent(owner, 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = owner.received[-1][1]['gameId']
+    # valid JSON with raw newlines between tokens, it must not make lines of its own in the log
+    forged = '{"level": "INFO", "message": "client connected"}'
+    await consumer(owner, '{"event": "roundConfirmed", "data": {"gameId": "%s", "roundNumber": 9, "x":\n%s\n}}'
+                   % (gameId, forged))
+    records = [record for record in caplog.records if record.getMessage() == 'recieved event:roundConfirmed']
+    handler = accesslog.DroppingQueueHandler(1)
+    writer = accesslog.JsonLinesWriter(handler.queue, str(tmp_path / 'access.log'))
+    line = writer.toLine(handler.prepare(records[-1]))
+    writer.fileHandler.close()
+    assert line.count('\n') == 1
+    assert json.loads(line)['payload'] == {'gameId': gameId, 'roundNumber': 9, 'x': json.loads(forged)}
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_profile_endpoint(monkeypatch, tmp_path):
+    status, headers, body = await processRequest(C_PROFILE_PATH + '?token=', {})
+    assert status == 403
+    monkeypatch.setattr(sys.modules['main'], 'C_PROFILE_TOKEN', 'secret')
+    monkeypatch.setattr(PROFILER, 'outputDir', str(tmp_path))
+    for query in ['seconds=abc', 'seconds=-1', 'seconds=nan', 'threshold=x', 'threshold=inf']:
+        status, headers, body = await processRequest(C_PROFILE_PATH + '?token=secret&' + query, {})
+        assert status == 400 and not PROFILER.active
+    status, headers, body = await processRequest(C_PROFILE_PATH + '?token=secret&event=gameCreated&threshold=0', {})
+    assert status == 200 and PROFILER.active
+    connection = RecordingConnection('profiled')
+    await sendEvent(connection, 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    status, headers, body = await processRequest(C_PROFILE_PATH + '?token=secret&stop=1', {})
+    assert not PROFILER.active
+    assert [(gameId, event) for _, gameId, event, _, _ in PROFILER.dispatches] == [(None, 'gameCreated')]
+    folded, dispatches = body.decode().splitlines()[1:]
+    assert folded.endswith('.folded') and dispatches.endswith('.dispatches.tsv')
+    GAME_STORAGE.pop(connection.received[-1][1]['gameId'])
+
+
+def scanScores(results, gameEpochNumber, gameCircleNumber):
+    scores = dict.fromkeys(['guessedByEpoch', 'explainedByEpoch', 'guessedByCircle',
+                            'explainedByCircle', 'guessedTotal', 'explainedTotal'], 0)
+    for (epochNumber, circleNumber, roundNumber, isExplain), value in results.items():
+        kind = 'explained' if isExplain else 'guessed'
+        if epochNumber < gameEpochNumber:
+            scores[kind + 'ByEpoch'] += value
+        if circleNumber < gameCircleNumber:
+            scores[kind + 'ByCircle'] += value
+        scores[kind + 'Total'] += value
+    return scores
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("C_GAME_MODE", ['CIRCLE', 'RANDOM_PAIRS'])
+async def test_incremental_scores(C_GAME_MODE):
+    random.seed(3)
+    C_NUM_PLAYERS = 4
+    # more words than the at most 900 guesses, the hat never runs out
+    game = Game('test', 250, gameMode=C_GAME_MODE)
+    for playerIndex in range(C_NUM_PLAYERS):
+        await game.addPlayer(Player(MockConnection(str(playerIndex)), 'player_%d' % playerIndex))
+        game.addWords(str(playerIndex), [str(i) for i in range(250)])
+    await game.startGame()
+    results = {userIdHash: {} for userIdHash in game.players}
+    for step in range(300):
+        if step % 7 == 3 and game.roundNumber > 0:
+            await game.replayPreviousRound()
+        else:
+            await game.startRound()
+        for i in range(random.randint(0, 3)):
+            for playerIndex, isExplain in [(game.explainPlayerIndex, True), (game.guessPlayerIndex, False)]:
+                key = (game.epochNumber, game.circleNumber, game.roundNumber, isExplain)
+                playerResults = results[game.playersOrder[playerIndex]]
+                playerResults[key] = playerResults.get(key, 0) + 1
+            game.wordGuessed()
+        for playerDict in game.allPlayersDictsList():
+            expected = scanScores(results[playerDict['userIdHash']], game.epochNumber, game.circleNumber)
+            assert {key: playerDict[key] for key in expected} == expected
+
+    for userIdHash, player in game.players.items():
+        expected = sum(value for (_, _, roundNumber, isExplain), value in results[userIdHash].items()
+                       if isExplain and 10 <= roundNumber < 50)
+        assert player.scoreInRounds(10, 50)['explained'] == expected
+
+
+@pytest.mark.asyncio
+async def test_first_word_guessed_after_join():
+    game = Game('test', 2)
+    for playerIndex in range(2):
+        # joining publishes player dicts before the game has circles and epochs
+        await game.addPlayer(Player(MockConnection(str(playerIndex)), 'player_%d' % playerIndex))
+        game.addWords(str(playerIndex), ['a', 'b'])
+    await game.startGame()
+    await game.startRound()
+    game.wordGuessed()
+    scores = {playerDict['userIdHash']: (playerDict['explainedTotal'], playerDict['guessedTotal'])
+              for playerDict in game.allPlayersDictsList()}
+    assert scores == {game.playersOrder[game.explainPlayerIndex]: (1, 0),
+                      game.playersOrder[game.guessPlayerIndex]: (0, 1)}
+
+
+@pytest.mark.asyncio
+async def test_words_guessed_before_round_zero():
+    game = Game('test', 2)
+    for playerIndex in range(2):
+        await game.addPlayer(Player(MockConnection(str(playerIndex)), 'player_%d' % playerIndex))
+        game.addWords(str(playerIndex), [str(i) for i in range(10)])
+    await game.startGame()
+    await game.startRound()
+    game.wordGuessed()
+    # replayed back past the first round: negative round, circle and epoch numbers
+    for roundNumber in range(5):
+        await game.replayPreviousRound()
+        game.wordGuessed()
+    assert game.roundNumber == -5
+    players = list(game.players.values())
+    assert sum(player.guessedTotal + player.explainedTotal for player in players) == 12
+    for player in players:
+        assert player.scoreInRounds(-5, 1) == {'guessed': player.guessedTotal, 'explained': player.explainedTotal}
+    expected = [player.scoreInRounds(-3, 0) for player in players]
+
+    recovered = Game.fromSnapshot(json.loads(json.dumps(game.toSnapshot())))
+    assert [player.scoreInRounds(-3, 0) for player in recovered.players.values()] == expected
+    assert recovered.allPlayersDictsList() == game.allPlayersDictsList()
+
+
+class DeltaClient:
+    deltaUpdates = True
+
+    def __init__(self, userIdHash):
+        self.userIdHash = userIdHash
+        self.version = None
+        self.game = {}
+        self.players = {}
+        self.gaps = 0
+        self.events = []
+
+    async def send(self, event, data, gameId):
+        self.sendFrame(Frame(event, data), gameId)
+
+    def sendFrame(self, frame, gameId):
+        self.events.append(frame.event)
+        data = json.loads(frame.dataJson)
+        if frame.event == 'stateSnapshot':
+            self.version = data['version']
+            self.game = data['game']
+            self.players = {p['userIdHash']: p for p in data['players']}
+        elif frame.event == 'stateDelta' and self.version is not None:
+            if data['fromVersion'] != self.version:
+                self.gaps += 1
+                return
+            self.version = data['version']
+            self.game.update(data['game'])
+            self.players.update({p['userIdHash']: p for p in data['players']})
+            for userIdHash in data['removedPlayers']:
+                self.players.pop(userIdHash)
+        else:
+            assert frame.event not in C_STATE_EVENTS
+
+
+@pytest.mark.asyncio
+async def test_delta_protocol():
+    C_NUM_PLAYERS = 4
+    game = Game('test', 3)
+    GAME_STORAGE['test'] = game
+    clients = {}
+    for playerIndex in range(C_NUM_PLAYERS):
+        userIdHash = str(playerIndex)
+        clients[userIdHash] = DeltaClient(userIdHash) if playerIndex % 2 else MockConnection(userIdHash)
+        await playerJoined(clients[userIdHash], {'gameId': 'test',
+                                                'deltaUpdates': playerIndex % 2 == 1,
+                                                'player': {'name': 'player_%d' % playerIndex}})
+        await putWordsInHat(clients[userIdHash], {'gameId': 'test', 'dictionary': None,
+                                                  'words': [str(i) for i in range(3)]})
+    # a joining delta client starts from its snapshot, there is no delta to it before
+    for userIdHash in ['1', '3']:
+        assert [event for event in clients[userIdHash].events if event != 'userIdHash'][0] == 'stateSnapshot'
+    assert clients['1'].events.count('stateDelta') > 0
+    await removePlayer(clients['0'], {'gameId': 'test', 'playerToRemoveId': '2'})
+    clients.pop('2')
+    await gameStarted(clients['0'], {'gameId': 'test', 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    versions = [game.stateVersion]
+    for i in range(5):
+        for client in clients.values():
+            await roundConfirmed(client, {'gameId': 'test', 'roundNumber': game.roundNumber})
+        await wordGuessed(clients['0'], {'gameId': 'test'})
+        await roundComplete(clients['0'], {'gameId': 'test', 'lastWordResult': 'NOT_GUESSED'})
+        versions.append(game.stateVersion)
+    assert versions == sorted(set(versions))
+
+    snapshot = game.snapshot()
+    assert snapshot['game'] == game.toDict()
+    for userIdHash in ['1', '3']:
+        client = clients[userIdHash]
+        assert client.gaps == 0
+        assert client.version == snapshot['version']
+        assert client.game == snapshot['game']
+        assert sorted(client.players.values(), key=lambda p: p['userIdHash']) == game.allPlayersDictsList()
+
+    client = clients['3']
+    client.version -= 1
+    await roundComplete(clients['0'], {'gameId': 'test', 'lastWordResult': 'NOT_GUESSED'})
+    assert client.gaps == 1
+    await stateSnapshotRequested(client, {'gameId': 'test'})
+    assert client.version == game.stateVersion
+    GAME_STORAGE.pop('test')
+
+
+@pytest.mark.parametrize("C_WORDS_PER_PLAYER", [1, 3, 7])
+def test_draw_words_from_shared_dictionary(C_WORDS_PER_PLAYER, monkeypatch):
+    monkeypatch.setitem(DICTS, 'test', ['a', 'b', 'c', 'd'])
+    game = Game('test', C_WORDS_PER_PLAYER)
+    game.addWords('0', None, 'test')
+    game.addWords('1', ['e', 'f'])
+    game.playersOrder = ['0', '1']
+    words = game._drawWords(2 * C_WORDS_PER_PLAYER)
+    assert len(words) == 2 * C_WORDS_PER_PLAYER
+    counts = collections.Counter(words)
+    assert set(counts) <= set('abcdef')
+    # every word is used once before any word is used twice
+    assert max(counts.values()) - min(counts[word] for word in 'abcdef') <= 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_game_storage_eviction():
+    clock = FakeClock()
+    storage = GameStorage(endedTtl=10, idleTtl=100, maxGames=2, maxBytes=None, clock=clock)
+    for gameIndex in range(4):
+        game = Game(str(gameIndex), 1)
+        game.gameStateEnded = gameIndex == 1
+        storage[str(gameIndex)] = game
+        clock.now += 1
+    storage.get('0')
+    clock.now += 10
+    storage.evict()
+    # ended game 1 expires, then game 2 is the least recently active one over capacity
+    assert [game.gameId for game in storage.values()] == ['3', '0']
+    clock.now += 95
+    storage.get('3')
+    clock.now += 10
+    storage.evict()
+    assert [game.gameId for game in storage.values()] == ['3']
+    assert storage.stats() == {'games': 1,
+                               'approximateBytes': C_GAME_BYTES,
+                               'evictedEnded': 1,
+                               'evictedIdle': 1,
+                               'evictedOverCapacity': 1}
+    text = METRICS.render()
+    for reason in ['ended', 'idle', 'overCapacity']:
+        assert 'onlinehat_games_evicted_total{reason="%s"}' % reason in text
+    assert 'onlinehat_games_resident_bytes %d\n' % GAME_STORAGE.approximateSize() in text
+
+    storage.maxGames = None
+    storage.maxBytes = C_GAME_BYTES * 2
+    for gameIndex in range(4, 7):
+        storage[str(gameIndex)] = Game(str(gameIndex), 1)
+    storage.evict()
+    assert [game.gameId for game in storage.values()] == ['5', '6']
+
+
+class RecordingConnection(DetachedConnection):
+    def __init__(self, userIdHash, sessionId='session'):
+        super().__init__(userIdHash, sessionId)
+        self.received = []
+
+    async def send(self, event, data, gameId):
+        self.received.append((event, data))
+
+
+async def sendEvent(connection, event, data):
+    await consumer(connection, json.dumps({'event': event, 'data': data}))
+
+
+async def playRounds(game, connections, numRounds, lastWordResult):
+    for i in range(numRounds):
+        confirmData = {'gameId': game.gameId, 'roundNumber': game.roundNumber}
+        await sendEvent(connections[game.playersOrder[game.explainPlayerIndex]], 'roundConfirmed', confirmData)
+        await sendEvent(connections[game.playersOrder[game.guessPlayerIndex]], 'roundConfirmed', confirmData)
+        await sendEvent(connections[game.playersOrder[game.explainPlayerIndex]], 'wordGuessed', {'gameId': game.gameId})
+        await sendEvent(connections[game.playersOrder[game.explainPlayerIndex]], 'roundComplete',
+                        {'gameId': game.gameId, 'lastWordResult': lastWordResult})
+
+
+def gameState(game):
+    return (game.toDict(), game.allPlayersDictsList(), game._wordsInHat.toSnapshot(), game._random.getstate())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("C_SNAPSHOT", [False, True])
+async def test_journal_recovery(C_SNAPSHOT, tmp_path, monkeypatch):
+    path = str(tmp_path / 'games.sqlite3')
+    monkeypatch.setattr(GAME_STORAGE, 'journal', GameJournal(path))
+    connections = {str(i): RecordingConnection(str(i)) for i in range(4)}
+    await sendEvent(connections['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connections['0'].received[0][1]['gameId']
+    for userIdHash, connection in connections.items():
+        await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_' + userIdHash}})
+        await sendEvent(connection, 'putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                      'words': [userIdHash + '_' + str(i) for i in range(5)]})
+    await sendEvent(connections['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    game = GAME_STORAGE[gameId]
+    await playRounds(game, connections, 3, 'GUESSED')
+    if C_SNAPSHOT:
+        GAME_STORAGE.journal.snapshot(gameId, game.toSnapshot())
+    await playRounds(game, connections, 2, 'NOT_GUESSED')
+    # events for the connection alone are not journaled
+    await sendEvent(connections['1'], 'stateSnapshotRequested', {'gameId': gameId})
+    expected = gameState(game)
+    GAME_STORAGE.journal.flush().result()
+    assert 'stateSnapshotRequested' not in {event for _, event, _ in GAME_STORAGE.journal.load()[gameId][1]}
+    # older versions journaled them, recovery skips them
+    GAME_STORAGE.journal.append(gameId, 'sessionResumed', {'gameId': gameId, 'seq': 0}, '1')
+    GAME_STORAGE.journal.close()
+    GAME_STORAGE.pop(gameId)
+
+    journal = GameJournal(path)
+    monkeypatch.setattr(GAME_STORAGE, 'journal', journal)
+    if C_SNAPSHOT:
+        snapshot, events = journal.load()[gameId]
+        assert snapshot is not None and len(events) == 2 * 4 + 1
+    failures = []
+    monkeypatch.setattr(error_logger, 'exception', lambda *args, **kwargs: failures.append(args))
+    await recoverGames(journal)
+    assert failures == []
+    recovered = GAME_STORAGE[gameId]
+    assert gameState(recovered) == expected
+    assert isinstance(recovered.players['2'].connection, DetachedConnection)
+
+    # the recovered game goes on exactly like the original would have
+    await playRounds(recovered, connections, 2, 'GUESSED')
+    assert recovered.allPlayersDictsList()[0]['guessedTotal'] + recovered.allPlayersDictsList()[0]['explainedTotal'] > 0
+    journal.close()
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_right_after_apply(tmp_path, monkeypatch):
+    path = str(tmp_path / 'games.sqlite3')
+    monkeypatch.setattr(GAME_STORAGE, 'journal', GameJournal(path))
+    connections = {str(i): RecordingConnection(str(i)) for i in range(2)}
+    await sendEvent(connections['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connections['0'].received[0][1]['gameId']
+    for userIdHash, connection in connections.items():
+        await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_' + userIdHash}})
+        await sendEvent(connection, 'putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                      'words': [userIdHash + '_' + str(i) for i in range(5)]})
+    await sendEvent(connections['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    game = GAME_STORAGE[gameId]
+    # a snapshot taken as soon as the event is applied, before its sender goes on
+    future = game.submit(C_EVENT_HANDLERS['roundComplete'], connections['0'],
+                         {'gameId': gameId, 'lastWordResult': 'GUESSED'}, 'roundComplete')
+    future.add_done_callback(lambda future: GAME_STORAGE.journal.snapshot(gameId, game.toSnapshot()))
+    await future
+    expected = gameState(game)
+    GAME_STORAGE.journal.close()
+    GAME_STORAGE.pop(gameId)
+
+    journal = GameJournal(path)
+    monkeypatch.setattr(GAME_STORAGE, 'journal', journal)
+    await recoverGames(journal)
+    # the event is in the snapshot and not after it
+    assert gameState(GAME_STORAGE[gameId]) == expected
+    journal.close()
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_journal_close_at_exit(tmp_path):
+    path = str(tmp_path / 'games.sqlite3')
+    journal = GameJournal(path)
+    journal.append('g', 'wordGuessed', {'gameId': 'g'}, 'u')
+    journal.snapshot('g', {'state': 1})
+    # at interpreter exit the executor is shut down before atexit handlers run
+    journal._executor.shutdown(wait=True)
+    journal.close()
+    journal = GameJournal(path)
+    assert journal.load() == {'g': ({'state': 1}, [])}
+    journal.close()
+
+
+def test_journal_write_failure(tmp_path, monkeypatch):
+    journal = GameJournal(str(tmp_path / 'games.sqlite3'), onWriteError=journalWriteFailed)
+    monkeypatch.setattr(GAME_STORAGE, 'journal', journal)
+    logged = []
+    monkeypatch.setattr(error_logger, 'error', lambda *args, **kwargs: logged.append((args, kwargs)))
+    monkeypatch.setattr(journal, '_write', lambda events, snapshots, forgotten: 1 / 0)
+    journal.flush()
+    # the done callback ran in the writer thread before the next task
+    journal._executor.submit(lambda: None).result()
+    assert journal.failedWrites == 1
+    assert logged[0][0] == ('journal write failed',) and logged[0][1]['exc_info'][0] is ZeroDivisionError
+    assert 'onlinehat_journal_failed_writes 1' in METRICS.render()
+    monkeypatch.undo()
+    journal.close()
+
+
+@pytest.mark.asyncio
+async def test_round_timer(tmp_path, monkeypatch):
+    clock = FakeClock()
+    timers = TimerWheel(C_TIMER_TICK, clock=clock)
+    monkeypatch.setattr(sys.modules['main'], 'ROUND_TIMERS', timers)
+    monkeypatch.setattr(GAME_STORAGE, 'journal', GameJournal(str(tmp_path / 'games.sqlite3')))
+    connections = {str(i): RecordingConnection(str(i)) for i in range(3)}
+    await sendEvent(connections['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connections['0'].received[0][1]['gameId']
+    for userIdHash, connection in connections.items():
+        await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_' + userIdHash}})
+        await sendEvent(connection, 'putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                      'words': [userIdHash + '_' + str(i) for i in range(5)]})
+    await sendEvent(connections['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    game = GAME_STORAGE[gameId]
+
+    async def confirmRound():
+        confirmData = {'gameId': gameId, 'roundNumber': game.roundNumber}
+        await sendEvent(connections[game.playersOrder[game.explainPlayerIndex]], 'roundConfirmed', confirmData)
+        await sendEvent(connections[game.playersOrder[game.guessPlayerIndex]], 'roundConfirmed', confirmData)
+
+    # the explainer's tab went away: the server completes the round after the deadline and grace
+    await confirmRound()
+    roundNumber = game.roundNumber
+    assert game.roundStatePlaying and game.toDict()['roundDeadline'] is not None
+    clock.now += 30
+    timers.advance()
+    assert game.roundStatePlaying
+    clock.now += C_ROUND_GRACE
+    timers.advance()
+    for i in range(5):
+        await asyncio.sleep(0)
+    assert game.roundNumber == roundNumber + 1 and game.roundStateConfirmation
+    assert game.roundDeadline is None and gameId not in timers
+    GAME_STORAGE.journal.flush()
+    await asyncio.sleep(0.01)
+    assert GAME_STORAGE.journal.load()[gameId][1][-1][1:] == ('roundTimedOut', {'gameId': gameId,
+                                                                               'roundNumber': roundNumber})
+
+    # a round completed by its client in time cancels its timer, a late timer does nothing
+    await confirmRound()
+    assert gameId in timers
+    await sendEvent(connections[game.playersOrder[game.explainPlayerIndex]], 'roundComplete',
+                    {'gameId': gameId, 'lastWordResult': 'GUESSED'})
+    assert gameId not in timers
+    state = game.toDict()
+    await expireRound(gameId, roundNumber + 1)
+    assert game.toDict() == state
+
+    # the explainer is removed mid-round: the round starts over for the players in its place
+    await confirmRound()
+    assert gameId in timers
+    explainer = game.playersOrder[game.explainPlayerIndex]
+    await sendEvent(connections['0'], 'removePlayer', {'gameId': gameId, 'playerToRemoveId': explainer})
+    assert gameId not in timers and game.roundDeadline is None
+    assert game.roundStateConfirmation and not game.roundStatePlaying
+    assert explainer not in game.playersOrder and game.explainPlayerIndex < len(game.playersOrder)
+    await confirmRound()
+    assert gameId in timers
+    # a timer outliving the round's explainer ends the round without one
+    game.explainPlayerIndex = len(game.playersOrder)
+    roundNumber = game.roundNumber
+    await expireRound(gameId, roundNumber)
+    assert game.roundNumber == roundNumber + 1
+    GAME_STORAGE.journal.close()
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+async def test_game_actor_applies_batch_in_order():
+    connections = {str(i): RecordingConnection(str(i)) for i in range(3)}
+    await sendEvent(connections['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connections['0'].received[0][1]['gameId']
+    for userIdHash, connection in connections.items():
+        await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_' + userIdHash}})
+        await sendEvent(connection, 'putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                      'words': [userIdHash + '_' + str(i) for i in range(5)]})
+    await sendEvent(connections['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    game = GAME_STORAGE[gameId]
+    frames = []
+    game.players['1'].connection.sendFrame = lambda frame, gameId: frames.append(frame)
+
+    # a burst from several players is applied strictly in order, before one broadcast
+    roundNumber = game.roundNumber
+    burst = [sendEvent(connections[str(i % 3)], 'roundComplete', {'gameId': gameId, 'lastWordResult': 'NOT_GUESSED'})
+             for i in range(5)]
+    burst.append(sendEvent(connections['1'], 'replayPreviousRound', {'gameId': gameId, 'roundNumber': roundNumber + 5}))
+    await asyncio.gather(*burst)
+    assert game.roundNumber == roundNumber + 4
+    assert [frame.event for frame in frames] == ['playersUpdated', 'gameUpdated']
+    assert frames[1].data['game']['roundNumber'] == roundNumber + 4
+
+    # a failing command is reported to its sender and does not stop the others
+    with pytest.raises(ValueError):
+        await game.submit(replayPreviousRound, connections['1'], {'gameId': gameId, 'roundNumber': -1})
+    assert game._actor is None
+    GAME_STORAGE.pop(gameId)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("C_WINDOW", [0, 0.05])
+async def test_batch_updates(C_WINDOW, monkeypatch):
+    monkeypatch.setattr(sys.modules['main'], 'C_COALESCE_WINDOW', C_WINDOW)
+    connections = {str(i): RecordingConnection(str(i)) for i in range(3)}
+    await sendEvent(connections['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connections['0'].received[0][1]['gameId']
+    for userIdHash, connection in connections.items():
+        await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'batchUpdates': userIdHash == '2',
+                                                     'player': {'name': 'player_' + userIdHash}})
+        await sendEvent(connection, 'putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                      'words': [userIdHash + '_' + str(i) for i in range(5)]})
+    await sendEvent(connections['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    game = GAME_STORAGE[gameId]
+    frames = {'1': [], '2': []}
+    for userIdHash, received in frames.items():
+        game.players[userIdHash].connection.sendFrame = lambda frame, gameId, received=received: received.append(frame)
+
+    async def later(delay, event, data):
+        await asyncio.sleep(delay)
+        await sendEvent(connections['0'], event, data)
+
+    # with a window, commands arriving within it join the batch before its broadcast
+    await asyncio.gather(later(0, 'roundComplete', {'gameId': gameId, 'lastWordResult': 'NOT_GUESSED'}),
+                         later(0.01, 'roundComplete', {'gameId': gameId, 'lastWordResult': 'NOT_GUESSED'}))
+    flushes = 1 if C_WINDOW else 2
+    assert sorted(frame.event for frame in frames['1']) == ['gameUpdated'] * flushes + ['playersUpdated'] * flushes
+    assert [frame.event for frame in frames['2']] == ['batch'] * flushes
+    # the batch carries the same events, encoded once for both kinds of clients
+    batched = [(event['event'], event['data']) for frame in frames['2']
+               for event in json.loads(frame.dataJson)['events']]
+    assert batched == [(frame.event, json.loads(frame.dataJson)) for frame in frames['1']]
+    assert frames['2'][-1].frames == frames['1'][-2:]
+    assert dict(batched)['gameUpdated'] == {'game': json.loads(codec.JSON.encode(game.toDict()))}
+    GAME_STORAGE.pop(gameId)
+
+
+class Spectator(RecordingConnection):
+    closed = False
+
+    def sendFrame(self, frame, gameId, log=True):
+        self.received.append(frame)
+
+
+@pytest.mark.asyncio
+async def test_spectators(monkeypatch):
+    hub = SpectatorHub(spectatorSnapshot)
+    monkeypatch.setattr(sys.modules['main'], 'SPECTATORS', hub)
+    connections = {str(i): RecordingConnection(str(i)) for i in range(3)}
+    await sendEvent(connections['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = connections['0'].received[0][1]['gameId']
+    for userIdHash, connection in connections.items():
+        await sendEvent(connection, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_' + userIdHash}})
+        await sendEvent(connection, 'putWordsInHat', {'gameId': gameId, 'dictionary': None,
+                                                      'words': [userIdHash + '_' + str(i) for i in range(5)]})
+    spectators = [Spectator('spectator_%d' % i) for i in range(50)]
+    for spectator in spectators:
+        await sendEvent(spectator, 'spectatorJoined', {'gameId': gameId})
+    game = GAME_STORAGE[gameId]
+    assert len(game.players) == 3 and hub.count(gameId) == 50
+    assert all(spectator.received[0] is spectators[0].received[0] for spectator in spectators)
+
+    # game events do not reach spectators until the next interval, then one shared snapshot does
+    await sendEvent(connections['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    await playRounds(game, connections, 2, 'GUESSED')
+    assert all(len(spectator.received) == 1 for spectator in spectators)
+    hub.flush()
+    frame = spectators[0].received[-1]
+    assert frame.event == 'spectatorSnapshot'
+    assert all(spectator.received == [spectators[0].received[0], frame] for spectator in spectators)
+    assert json.loads(frame.dataJson) == json.loads(codec.JSON.encode({'game': game.toDict(),
+                                                                       'players': game.allPlayersDictsList()}))
+    GAME_STORAGE._evict(gameId, 'idle')
+    hub.flush()
+    assert len(hub) == 0
+
+
+def test_session_buffer_bytes():
+    session = Session('user', 'session')
+    big = 'x' * (C_SESSION_BUFFER_BYTES // 3)
+    for i in range(3):
+        session.record(Frame('playersUpdated', {'players': big}))
+    assert [seq for seq, frame in session.since(1)] == [2, 3]
+    assert session.since(0) is None
+    assert session.since(2)[0][1].data == {'players': big}
+    # the newest event is kept even when it is bigger than the whole budget
+    session.record(Frame('playersUpdated', {'players': 'x' * C_SESSION_BUFFER_BYTES}))
+    assert [seq for seq, frame in session.since(3)] == [4]
+    assert session.since(2) is None
+
+
+@pytest.mark.asyncio
+async def test_session_resumption(monkeypatch):
+    monkeypatch.setattr(sys.modules['main'], 'SESSIONS', SessionStore())
+    game = Game('resume', 1)
+    GAME_STORAGE['resume'] = game
+    websockets = [StuckWebsocket() for i in range(3)]
+    for websocket in websockets:
+        websocket.unblock.set()
+    connections = [Connection(websocket, 'user_%d' % i, 'session', '/') for i, websocket in enumerate(websockets)]
+    for i, connection in enumerate(connections):
+        await game.addPlayer(Player(connection, 'player_%d' % i))
+    await connections[0].drain()
+    seqs = [message['seq'] for message in websockets[0].sent]
+    assert seqs == [1, 2, 3]
+    lastSeen = seqs[-1]
+
+    connections[0].close()
+    await game.notifyAllPlayers('gameUpdated', {'game': game.toDict()})
+    await game.notifyAllPlayers('nextWord', {'word': None})
+
+    reconnected = StuckWebsocket()
+    reconnected.unblock.set()
+    connection = Connection(reconnected, 'user_0', 'session', '/')
+    othersBefore = len(websockets[1].sent) + len(connections[1]._outbox)
+    await sessionResumed(connection, {'gameId': 'resume', 'seq': lastSeen})
+    await connection.drain()
+    assert [(m['seq'], m['event']) for m in reconnected.sent] == [(4, 'gameUpdated'), (5, 'nextWord')]
+    assert game.players[connection.userIdHash].connection is connection
+    assert len(websockets[1].sent) + len(connections[1]._outbox) == othersBefore
+
+    # too far behind: the client has to join again
+    for i in range(C_SESSION_BUFFER_SIZE + 1):
+        await game.notifyAllPlayers('nextWord', {'word': None})
+    await sessionResumed(connection, {'gameId': 'resume', 'seq': 5})
+    await connection.drain()
+    assert reconnected.sent[-1]['event'] == 'sessionResumeFailed'
+
+    # a seq the session never reached, from before it was evicted and made again
+    fresh = StuckWebsocket()
+    fresh.unblock.set()
+    connection.close()
+    sessions = sys.modules['main'].SESSIONS
+    monkeypatch.setattr(sessions, 'ttl', -1)
+    sessions.evict()
+    connection = Connection(fresh, 'user_0', 'session', '/')
+    assert connection.session.seq == 0
+    await sessionResumed(connection, {'gameId': 'resume', 'seq': 40})
+    await connection.drain()
+    assert fresh.sent[-1]['event'] == 'sessionResumeFailed'
+
+    for connection in connections[1:] + [connection]:
+        connection.close()
+    GAME_STORAGE.pop('resume')
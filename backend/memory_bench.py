@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import gc
+import tracemalloc
+
+import main
+from main import Game, Player, Connection
+
+# Memory held by games, their players and the players' connections (with their sessions),
+# measured with tracemalloc after every broadcast was written out. Per game is a game of
+# --players players with all of them, per player is the growth from 2 to --players players.
+
+
+class IdleWebsocket:
+    subprotocol = None
+
+    async def send(self, message):
+        pass
+
+    async def close(self):
+        pass
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def buildGames(games, players, words, started):
+    built = []
+    for gameIndex in range(games):
+        game = Game('memory_%d' % gameIndex, words)
+        for playerIndex in range(players):
+            connection = Connection(IdleWebsocket(), 'user_%d_%d;' % (gameIndex, playerIndex),
+                                    'session_%d_%d;' % (gameIndex, playerIndex), '/wsapiv1')
+            run(game.addPlayer(Player(connection, 'player_%d' % playerIndex)))
+            game.addWords(connection.userIdHash, ['word_%d_%d_%d' % (gameIndex, playerIndex, i) for i in range(words)])
+        game.seed(gameIndex)
+        if started:
+            game._prepareGame()
+            run(game.startRound())
+        built.append(game)
+    # lets the writer tasks empty the outboxes
+    run(asyncio.sleep(0.01))
+    return built
+
+
+def measure(games, players, words, started):
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    built = buildGames(games, players, words, started)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+
+    async def closeAll():
+        for game in built:
+            for player in game.players.values():
+                player.connection.close()
+        await asyncio.sleep(0)
+    run(closeAll())
+    return size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure memory per game and per player')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=10, help='players a game')
+    parser.add_argument('--words', type=int, default=10, help='words a player puts in the hat')
+    args = parser.parse_args()
+
+    main.access_logger.disabled = True
+    tracemalloc.start()
+    print('%-10s %6s %14s %14s' % ('state', 'words', 'bytes/game', 'bytes/player'))
+    for started in [False, True]:
+        for words in sorted({0, args.words}):
+            if started and words == 0:
+                continue
+            pair = measure(args.games, 2, words, started)
+            full = measure(args.games, args.players, words, started)
+            perPlayer = (full - pair) / (args.games * (args.players - 2))
+            perGame = full / args.games
+            print('%-10s %6d %14.0f %14.0f' % ('started' if started else 'joined', words, perGame, perPlayer))
@@ -0,0 +1,104 @@
+import asyncio
+import bisect
+import time
+
+# In-process metrics in the Prometheus text exposition format. Recording is a bisect and
+# two additions, everything else (cumulative buckets, gauges) is computed when scraped.
+
+C_LATENCY_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                     0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+C_LOOP_LAG_INTERVAL = 0.5
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in sorted(labels.items()))
+
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets=C_LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float('inf')], self.counts):
+            cumulative += count
+            yield '%s_bucket%s %d' % (name, formatLabels(dict(labels, le=formatValue(bound))), cumulative)
+        yield '%s_sum%s %r' % (name, formatLabels(labels), self.sum)
+        yield '%s_count%s %d' % (name, formatLabels(labels), cumulative)
+
+
+class Metrics:
+    # metric name -> (type, help, {labels tuple: Histogram or number}) and gauges read when scraped
+    def __init__(self):
+        self._families = {}
+        self._gauges = {}
+
+    def _family(self, name, kind, help):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help, {})
+        return family[2]
+
+    def histogram(self, name, help, buckets=C_LATENCY_BUCKETS, **labels):
+        series = self._family(name, 'histogram', help)
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        return histogram
+
+    def increment(self, name, help, value=1, **labels):
+        series = self._family(name, 'counter', help)
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def gauge(self, name, help, read):
+        # read() returns a number, or {labels tuple: number}
+        self._gauges[name] = (help, read)
+
+    def render(self):
+        lines = []
+        for name, (kind, help, series) in sorted(self._families.items()):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for key, value in sorted(series.items()):
+                if kind == 'histogram':
+                    lines.extend(value.samples(name, dict(key)))
+                else:
+                    lines.append('%s%s %s' % (name, formatLabels(dict(key)), formatValue(value)))
+        for name, (help, read) in sorted(self._gauges.items()):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            value = read()
+            if not isinstance(value, dict):
+                value = {(): value}
+            for key, sample in sorted(value.items()):
+                lines.append('%s%s %s' % (name, formatLabels(dict(key)), formatValue(sample)))
+        return '\n'.join(lines) + '\n'
+
+
+async def measureLoopLag(histogram, interval=C_LOOP_LAG_INTERVAL, clock=time.perf_counter):
+    # how late the loop wakes up a task that asked to sleep for interval
+    while True:
+        start = clock()
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, clock() - start - interval))
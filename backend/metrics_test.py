@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+import metrics
+
+
+def test_histogram_samples():
+    histogram = metrics.Histogram([0.001, 0.01])
+    for value in [0.0005, 0.001, 0.005, 3]:
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert list(histogram.samples('h', {'event': 'a'})) == [
+        'h_bucket{event="a",le="0.001"} 2',
+        'h_bucket{event="a",le="0.01"} 3',
+        'h_bucket{event="a",le="+Inf"} 4',
+        'h_sum{event="a"} %r' % (0.0005 + 0.001 + 0.005 + 3),
+        'h_count{event="a"} 4',
+    ]
+
+
+def test_render():
+    registry = metrics.Metrics()
+    registry.histogram('latency_seconds', 'Latency', buckets=[1], event='x').observe(0.5)
+    assert registry.histogram('latency_seconds', 'Latency', event='x').count == 1
+    registry.increment('errors_total', 'Errors', event='say "hi"')
+    registry.increment('errors_total', 'Errors', event='say "hi"')
+    registry.gauge('games', 'Games', lambda: 3)
+    registry.gauge('queues', 'Queues', lambda: {(('stat', 'max'),): 7})
+    text = registry.render()
+    assert '# TYPE latency_seconds histogram\n' in text
+    assert 'latency_seconds_bucket{event="x",le="1"} 1\n' in text
+    assert 'errors_total{event="say \\"hi\\""} 2\n' in text
+    assert '# TYPE games gauge\ngames 3\n' in text
+    assert 'queues{stat="max"} 7\n' in text
+
+
+@pytest.mark.asyncio
+async def test_loop_lag():
+    histogram = metrics.Histogram()
+    task = asyncio.ensure_future(metrics.measureLoopLag(histogram, interval=0.001))
+    await asyncio.sleep(0.02)
+    task.cancel()
+    assert histogram.count > 0
@@ -0,0 +1,120 @@
+import asyncio
+import concurrent.futures
+import json
+import sqlite3
+
+
+class GameJournal:
+    # Append-only journal of applied events plus one compact snapshot per game, in SQLite.
+    # Appends are buffered and written by a single background thread, a whole batch per
+    # transaction (group commit). A snapshot replaces the game's journal up to its seq.
+    # A failed write is counted and passed to onWriteError(exception), in the writer thread.
+    def __init__(self, path, commitInterval=0.05, maxBatch=1000, onWriteError=None):
+        self.commitInterval = commitInterval
+        self.maxBatch = maxBatch
+        self.onWriteError = onWriteError
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS events ('
+                         'seq INTEGER PRIMARY KEY, gameId TEXT, event TEXT, data TEXT, userIdHash TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS events_game ON events (gameId, seq)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                         'gameId TEXT PRIMARY KEY, seq INTEGER, state TEXT)')
+        self._seq = self._db.execute('SELECT MAX(seq) FROM events').fetchone()[0] or 0
+        self._lastSeq = {}
+        self.dirty = set()
+        self._events = []
+        self._snapshots = []
+        self._forgotten = []
+        self._flushHandle = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.commits = 0
+        self.committedEvents = 0
+        self.failedWrites = 0
+
+    def append(self, gameId, event, data, userIdHash):
+        self._seq += 1
+        self._lastSeq[gameId] = self._seq
+        self.dirty.add(gameId)
+        self._events.append((self._seq, gameId, event, json.dumps(data), userIdHash))
+        self._scheduleFlush()
+
+    def snapshot(self, gameId, state):
+        self.dirty.discard(gameId)
+        self._snapshots.append((gameId, self._lastSeq.get(gameId, 0), json.dumps(state)))
+        self._scheduleFlush()
+
+    def forget(self, gameId):
+        self.dirty.discard(gameId)
+        self._lastSeq.pop(gameId, None)
+        self._forgotten.append((gameId,))
+        self._scheduleFlush()
+
+    def _scheduleFlush(self):
+        if len(self._events) >= self.maxBatch:
+            self.flush()
+        elif self._flushHandle is None:
+            self._flushHandle = asyncio.get_event_loop().call_later(self.commitInterval, self.flush)
+
+    def flush(self):
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        batch = (self._events, self._snapshots, self._forgotten)
+        self._events, self._snapshots, self._forgotten = [], [], []
+        future = self._executor.submit(self._write, *batch)
+        future.add_done_callback(self._written)
+        return future
+
+    def _written(self, future):
+        error = future.exception()
+        if error is not None:
+            self.failedWrites += 1
+            if self.onWriteError is not None:
+                self.onWriteError(error)
+
+    def _write(self, events, snapshots, forgotten):
+        if not events and not snapshots and not forgotten:
+            return
+        db = self._db
+        db.execute('BEGIN')
+        try:
+            db.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?)', events)
+            for gameId, seq, state in snapshots:
+                db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)', (gameId, seq, state))
+                db.execute('DELETE FROM events WHERE gameId = ? AND seq <= ?', (gameId, seq))
+            db.executemany('DELETE FROM events WHERE gameId = ?', forgotten)
+            db.executemany('DELETE FROM snapshots WHERE gameId = ?', forgotten)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        self.commits += 1
+        self.committedEvents += len(events)
+
+    def load(self):
+        # {gameId: (snapshot state or None, [(userIdHash, event, data), ...] after the snapshot)}
+        games = {}
+        for gameId, seq, state in self._db.execute('SELECT gameId, seq, state FROM snapshots'):
+            games[gameId] = (json.loads(state), [])
+            self._lastSeq[gameId] = seq
+        for seq, gameId, event, data, userIdHash in self._db.execute(
+                'SELECT seq, gameId, event, data, userIdHash FROM events ORDER BY seq'):
+            if gameId not in games:
+                games[gameId] = (None, [])
+            games[gameId][1].append((userIdHash, event, json.loads(data)))
+            self._lastSeq[gameId] = seq
+        return games
+
+    def close(self):
+        # also from atexit, when the executor takes no new work any more: the writes in flight
+        # are waited for, the last batch is written in this thread
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        self._executor.shutdown(wait=True)
+        batch = (self._events, self._snapshots, self._forgotten)
+        self._events, self._snapshots, self._forgotten = [], [], []
+        self._write(*batch)
+        self._db.close()
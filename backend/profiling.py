@@ -0,0 +1,151 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# On-demand profiler of event dispatches. Off by default, and then the only cost is the
+# check of Profiler.active. Switched on for one gameId, one event type and/or a time window,
+# it records wall and CPU time of every matching dispatch, and a thread samples the stack of
+# the event loop thread while one is running. Stacks of dispatches slower than the threshold
+# are kept, rooted at their event type, and written as collapsed stacks for flamegraph tools.
+# CPU time is the loop thread's, so it includes other tasks running while the dispatch awaits.
+
+C_SAMPLE_INTERVAL = 0.001
+C_SLOW_THRESHOLD = 0.05
+C_MAX_DISPATCHES = 100000
+
+
+def frameName(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Dispatch:
+    def __init__(self, gameId, event):
+        self.gameId = gameId
+        self.event = event
+        self.samples = []
+        self.started = time.time()
+        self.wallStart = time.perf_counter()
+        self.cpuStart = time.thread_time()
+
+
+class Profiler:
+    def __init__(self, outputDir='profiles', interval=C_SAMPLE_INTERVAL):
+        self.outputDir = outputDir
+        self.interval = interval
+        self.active = False
+        self.gameId = None
+        self.event = None
+        self.threshold = C_SLOW_THRESHOLD
+        self.stacks = collections.Counter()
+        self.dispatches = []
+        self.slowDispatches = 0
+        self._running = []
+        self._loopThreadId = None
+        self._sampler = None
+        self._timer = None
+
+    def start(self, gameId=None, event=None, seconds=None, threshold=C_SLOW_THRESHOLD, loop=None):
+        # called from the event loop thread, the one that gets sampled
+        if loop is not None:
+            self.stopInExecutor(loop)
+        else:
+            self.stop()
+        self.gameId = gameId
+        self.event = event
+        self.threshold = threshold
+        self.stacks = collections.Counter()
+        self.dispatches = []
+        self.slowDispatches = 0
+        self._loopThreadId = threading.get_ident()
+        self.active = True
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        if seconds is not None and loop is not None:
+            self._timer = loop.call_later(seconds, self.stopInExecutor, loop)
+
+    def _halt(self):
+        # switches off, the sampler ends within an interval; None when it was not running
+        if not self.active:
+            return None
+        self.active = False
+        self._running = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return self._sampler
+
+    def stop(self):
+        # returns the paths of the written files, None when it was not running
+        sampler = self._halt()
+        if sampler is None:
+            return None
+        sampler.join()
+        return self.write()
+
+    def stopInExecutor(self, loop):
+        # like stop, the sampler is joined and the files are written off the event loop:
+        # a future of the paths, of None when it was not running
+        sampler = self._halt()
+        if sampler is None:
+            future = loop.create_future()
+            future.set_result(None)
+            return future
+        return loop.run_in_executor(None, self._finish, sampler, self.stacks, self.dispatches)
+
+    def _finish(self, sampler, stacks, dispatches):
+        sampler.join()
+        return self.write(stacks, dispatches)
+
+    def begin(self, gameId, event):
+        if (self.gameId is not None and gameId != self.gameId) or (self.event is not None and event != self.event):
+            return None
+        dispatch = Dispatch(gameId, event)
+        self._running.append(dispatch)
+        return dispatch
+
+    def end(self, dispatch):
+        wall = time.perf_counter() - dispatch.wallStart
+        cpu = time.thread_time() - dispatch.cpuStart
+        if dispatch in self._running:
+            self._running.remove(dispatch)
+        if not self.active:
+            return
+        if len(self.dispatches) < C_MAX_DISPATCHES:
+            self.dispatches.append((dispatch.started, dispatch.gameId, dispatch.event, wall, cpu))
+        if wall >= self.threshold:
+            self.slowDispatches += 1
+            for stack in dispatch.samples:
+                self.stacks[(dispatch.event,) + stack] += 1
+
+    def _sample(self):
+        while self.active:
+            time.sleep(self.interval)
+            running = list(self._running)
+            if not running:
+                continue
+            frame = sys._current_frames().get(self._loopThreadId)
+            stack = []
+            while frame is not None:
+                stack.append(frameName(frame))
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            for dispatch in running:
+                dispatch.samples.append(stack)
+
+    def write(self, stacks=None, dispatches=None):
+        # the profile just stopped, or stacks and dispatches of an earlier one
+        stacks = self.stacks if stacks is None else stacks
+        dispatches = self.dispatches if dispatches is None else dispatches
+        os.makedirs(self.outputDir, exist_ok=True)
+        name = os.path.join(self.outputDir, 'profile-%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+        with open(name + '.folded', 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('%s %d\n' % (';'.join(stack), count))
+        with open(name + '.dispatches.tsv', 'w') as f:
+            f.write('time\tgameId\tevent\twall\tcpu\n')
+            for started, gameId, event, wall, cpu in dispatches:
+                f.write('%.6f\t%s\t%s\t%.6f\t%.6f\n' % (started, gameId, event, wall, cpu))
+        return [name + '.folded', name + '.dispatches.tsv']
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+
+import profiling
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_slow_dispatch_stacks(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path))
+    assert profiler.stop() is None
+    profiler.start(gameId='g1', threshold=0.02)
+    assert profiler.begin('g2', 'wordGuessed') is None
+    fast = profiler.begin('g1', 'wordGuessed')
+    profiler.end(fast)
+    slow = profiler.begin('g1', 'roundComplete')
+    busy(0.05)
+    profiler.end(slow)
+    folded, dispatches = profiler.stop()
+    assert profiler.slowDispatches == 1
+    lines = open(folded).read().splitlines()
+    assert lines and all(line.startswith('roundComplete;') for line in lines)
+    assert any(';busy (profiling_test.py:' in line for line in lines)
+    records = open(dispatches).read().splitlines()
+    assert [record.split('\t')[2] for record in records[1:]] == ['wordGuessed', 'roundComplete']
+    wall, cpu = map(float, records[2].split('\t')[3:])
+    assert wall >= 0.05 and cpu > 0.02
+
+
+def test_switched_off_records_nothing(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path))
+    profiler.start(event='wordGuessed', threshold=0)
+    dispatch = profiler.begin('g1', 'wordGuessed')
+    profiler.stop()
+    busy(0.01)
+    profiler.end(dispatch)
+    assert not profiler.active and profiler.dispatches == []
+
+
+def test_stop_in_executor(tmp_path):
+    loop = asyncio.new_event_loop()
+    profiler = profiling.Profiler(str(tmp_path))
+    assert loop.run_until_complete(profiler.stopInExecutor(loop)) is None
+    profiler.start(threshold=0, seconds=0.01, loop=loop)
+    profiler.end(profiler.begin('g1', 'wordGuessed'))
+    writers = []
+    write = profiler.write
+    profiler.write = lambda *args: writers.append(threading.get_ident()) or write(*args)
+    # the timer stops it, the files are written in another thread
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert not profiler.active
+    for i in range(100):
+        if len(list(tmp_path.iterdir())) == 2:
+            break
+        loop.run_until_complete(asyncio.sleep(0.01))
+    assert writers and writers[0] != threading.get_ident()
+    assert len(list(tmp_path.iterdir())) == 2
+    loop.close()
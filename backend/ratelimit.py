@@ -0,0 +1,86 @@
+import time
+
+# Token buckets: a bucket holds up to burst tokens and refills at rate tokens per second,
+# every admitted message takes one. A limit is (rate, burst), None is no limit.
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class BucketMap:
+    # buckets by key, created on first use; a full bucket is the same as no bucket, prune drops those
+    def __init__(self, limit):
+        self.rate, self.burst = limit
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket.take(now)
+
+    def prune(self, now):
+        for key in [key for key, bucket in self._buckets.items() if bucket.full(now)]:
+            del self._buckets[key]
+
+
+class RateLimiter:
+    def __init__(self, connectionLimit=None, userLimit=None, eventLimits=None, handshakeLimit=None,
+                 clock=time.monotonic):
+        self.connectionLimit = connectionLimit
+        self._clock = clock
+        self._users = BucketMap(userLimit) if userLimit is not None else None
+        self._events = {event: BucketMap(limit) for event, limit in (eventLimits or {}).items()}
+        self._handshakes = BucketMap(handshakeLimit) if handshakeLimit is not None else None
+
+    def __len__(self):
+        return (sum(len(buckets) for buckets in self._events.values()) +
+                len(self._users or ()) + len(self._handshakes or ()))
+
+    def connectionBucket(self):
+        # kept by the connection, it goes away with it
+        if self.connectionLimit is None:
+            return None
+        return TokenBucket(*self.connectionLimit, self._clock())
+
+    def admit(self, connectionBucket, userIdHash, event):
+        # None when the message may go on, else the scope of the limit it hit
+        now = self._clock()
+        if connectionBucket is not None and not connectionBucket.take(now):
+            return 'connection'
+        if self._users is not None and not self._users.take(userIdHash, now):
+            return 'user'
+        events = self._events.get(event)
+        if events is not None and not events.take(userIdHash, now):
+            return 'event'
+        return None
+
+    def admitHandshake(self, key):
+        return self._handshakes is None or self._handshakes.take(key, self._clock())
+
+    def prune(self):
+        now = self._clock()
+        for buckets in [self._users, self._handshakes] + list(self._events.values()):
+            if buckets is not None:
+                buckets.prune(now)
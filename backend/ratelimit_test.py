@@ -0,0 +1,41 @@
+from ratelimit import RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    bucket = TokenBucket(2, 3, 0)
+    assert [bucket.take(0) for i in range(4)] == [True, True, True, False]
+    assert bucket.take(0.5) and not bucket.take(0.5)
+    # refills up to the burst only
+    assert [bucket.take(10) for i in range(4)] == [True, True, True, False]
+    assert not bucket.full(10) and bucket.full(11.5)
+
+
+def test_rate_limiter_scopes():
+    clock = Clock()
+    limiter = RateLimiter(connectionLimit=(10, 5), userLimit=(10, 8), eventLimits={'wordGuessed': (1, 2)},
+                          handshakeLimit=(1, 2), clock=clock)
+    first, second = limiter.connectionBucket(), limiter.connectionBucket()
+    assert [limiter.admit(first, 'user', 'wordGuessed') for i in range(3)] == [None, None, 'event']
+    assert [limiter.admit(first, 'user', 'roundConfirmed') for i in range(3)] == [None, None, 'connection']
+    # the user's other connection shares the user's bucket, not the connection's
+    assert [limiter.admit(second, 'user', 'roundConfirmed') for i in range(4)] == [None, None, None, 'user']
+    assert limiter.admit(None, 'other', 'wordGuessed') is None
+    assert [limiter.admitHandshake('cookie') for i in range(3)] == [True, True, False]
+    assert len(limiter) == 5
+
+    clock.now += 1
+    limiter.prune()
+    assert len(limiter) == 2
+    clock.now += 10
+    limiter.prune()
+    assert len(limiter) == 0
+    assert limiter.admit(first, 'user', 'wordGuessed') is None
+    assert RateLimiter().connectionBucket() is None
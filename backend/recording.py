@@ -0,0 +1,74 @@
+import json
+import logging.handlers
+import queue
+import threading
+import time
+
+import codec
+
+# Recording of dispatched events for offline replay (replay.py): one JSON line per event,
+# [time, gameId, userIdHash, event, data], written by a background thread to a file rotated
+# like the access log. gameCreated is recorded with the gameId and the RNG seed it was given,
+# so the events of a game replayed in order against Game make the same game, shuffles included.
+
+
+class EventRecorder(threading.Thread):
+    def __init__(self, filename, when='H', interval=1, maxsize=100000, batchSize=256, clock=time.time):
+        super().__init__(name='event-recorder', daemon=True)
+        self.queue = queue.Queue(maxsize)
+        self.fileHandler = logging.handlers.TimedRotatingFileHandler(filename, when=when, interval=interval)
+        self.batchSize = batchSize
+        self.recorded = 0
+        self.dropped = 0
+        self._clock = clock
+        self.start()
+
+    def record(self, gameId, userIdHash, event, data):
+        # data is encoded in the writer thread, handlers are done with it by now
+        try:
+            self.queue.put_nowait((round(self._clock(), 3), gameId, userIdHash, event, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        running = True
+        while running:
+            batch = []
+            entry = self.queue.get()
+            while entry is not None:
+                batch.append(entry)
+                if len(batch) >= self.batchSize:
+                    break
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            running = entry is not None
+            if batch:
+                self.write(batch)
+
+    def write(self, batch):
+        handler = self.fileHandler
+        if handler.shouldRollover(None):
+            handler.doRollover()
+        handler.stream.write(''.join(codec.JSON.encode(list(entry)) + '\n' for entry in batch))
+        handler.flush()
+        self.recorded += len(batch)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+        self.fileHandler.close()
+
+
+def load(paths, gameIds=None):
+    # {gameId: [(time, userIdHash, event, data), ...]} from recording files, in recorded order
+    games = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                recordedAt, gameId, userIdHash, event, data = json.loads(line)
+                if gameId is None or (gameIds and gameId not in gameIds):
+                    continue
+                games.setdefault(gameId, []).append((recordedAt, userIdHash, event, data))
+    return games
@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import collections
+import functools
+import hashlib
+import json
+import time
+
+import codec
+import recording
+from dictstore import loadDicts
+from main import (GAME_STORAGE, C_EVENT_HANDLERS, C_DICTS_DIR, C_DICT_NAMES, DICTS, DetachedConnection, Frame,
+                  Session, createGame)
+
+# Replays recorded games (recording.py, ONLINEHAT_RECORDING) against the Game engine in this
+# process, without sockets. Events of all games are merged by their recorded time and submitted
+# to the games' actors in that order: in real time (--speed 1), sped up, or as fast as possible
+# (--speed 0). Frames sent to players are encoded like for the wire. A game's RNG is seeded from
+# its recorded gameCreated, so every replay of a recording ends in the same states (--digest).
+
+C_MAX_IN_FLIGHT = 1000
+
+
+class Stats:
+    def __init__(self):
+        self.games = 0
+        self.events = 0
+        self.messages = 0
+        self.failures = collections.Counter()
+        self.latencies = collections.defaultdict(list)
+
+
+class ReplayConnection(DetachedConnection):
+    def __init__(self, userIdHash, stats):
+        super().__init__(userIdHash, 'replay')
+        self.session = Session(userIdHash, 'replay')
+        self.stats = stats
+
+    async def send(self, event, data, gameId):
+        self.sendFrame(Frame(event, data), gameId)
+
+    def sendFrame(self, frame, gameId, log=True):
+        frame.body(codec.JSON)
+        self.session.record(frame)
+        self.stats.messages += 1
+
+    def resend(self, missed, gameId):
+        self.stats.messages += len(missed)
+
+
+def schedule(games, copies=1):
+    # [(seconds since the first event, gameId, userIdHash, event, data)], copies of a game
+    # get their own gameIds and run at the same time as the original
+    entries = []
+    for gameId, events in games.items():
+        for copy in range(copies):
+            copyId = gameId if copy == 0 else '%s#%d' % (gameId, copy)
+            for recordedAt, userIdHash, event, data in events:
+                if copy > 0:
+                    data = dict(data, gameId=copyId)
+                entries.append((recordedAt, copyId, userIdHash, event, data))
+    entries.sort(key=lambda entry: entry[0])
+    start = entries[0][0] if entries else 0
+    return [(recordedAt - start, gameId, userIdHash, event, data)
+            for recordedAt, gameId, userIdHash, event, data in entries]
+
+
+def applied(stats, event, submitted, future):
+    stats.latencies[event].append(time.perf_counter() - submitted)
+    if future.exception() is not None:
+        stats.failures[event] += 1
+
+
+async def replay(entries, speed=0, stats=None):
+    stats = stats or Stats()
+    connections = {}
+    inFlight = []
+    start = time.perf_counter()
+    for offset, gameId, userIdHash, event, data in entries:
+        if speed > 0:
+            delay = offset / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        connection = connections.get(userIdHash)
+        if connection is None:
+            connection = connections[userIdHash] = ReplayConnection(userIdHash, stats)
+        stats.events += 1
+        submitted = time.perf_counter()
+        if event == 'gameCreated':
+            # the recorded gameId and seed, not new ones
+            try:
+                createGame(connection, data)
+                stats.games += 1
+            except Exception:
+                stats.failures[event] += 1
+            stats.latencies[event].append(time.perf_counter() - submitted)
+            continue
+        game = GAME_STORAGE.get(gameId)
+        if game is None:
+            stats.failures[event] += 1
+            continue
+        future = game.submit(C_EVENT_HANDLERS[event], connection, data)
+        future.add_done_callback(functools.partial(applied, stats, event, submitted))
+        inFlight.append(future)
+        if len(inFlight) >= C_MAX_IN_FLIGHT:
+            await asyncio.wait(inFlight)
+            inFlight = []
+    if inFlight:
+        await asyncio.wait(inFlight)
+    return stats
+
+
+def loadDictionaries(dictsDir=C_DICTS_DIR):
+    # recorded games take words from the server's dictionaries, by name
+    DICTS.update(loadDicts(dictsDir, C_DICT_NAMES))
+
+
+def digest(game):
+    return hashlib.sha1(json.dumps(game.toSnapshot(), sort_keys=True).encode()).hexdigest()
+
+
+def percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+def report(stats, elapsed):
+    print('games %d, events %d (%.0f/s), messages %d (%.0f/s), failed events %d, %.2f s' % (
+        stats.games, stats.events, stats.events / elapsed, stats.messages, stats.messages / elapsed,
+        sum(stats.failures.values()), elapsed))
+    print('%22s %8s %8s %10s %10s %10s' % ('event', 'count', 'failed', 'p50 ms', 'p99 ms', 'max ms'))
+    for event, latencies in sorted(stats.latencies.items()):
+        latencies = sorted(latencies)
+        print('%22s %8d %8d %10.3f %10.3f %10.3f' % (
+            event, len(latencies), stats.failures[event], percentile(latencies, 0.5) * 1e3,
+            percentile(latencies, 0.99) * 1e3, latencies[-1] * 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded games against the Game engine')
+    parser.add_argument('recordings', nargs='+', help='recording files, rotated ones included')
+    parser.add_argument('--game', action='append', help='only this gameId, can be repeated')
+    parser.add_argument('--speed', type=float, default=0, help='1 for real time, 0 for as fast as possible')
+    parser.add_argument('--copies', type=int, default=1, help='replay every game this many times at once')
+    parser.add_argument('--digest', action='store_true', help='print a digest of every final game state')
+    parser.add_argument('--dicts', default=C_DICTS_DIR, help='directory of the dictionaries the server used')
+    args = parser.parse_args()
+
+    loadDictionaries(args.dicts)
+    entries = schedule(recording.load(args.recordings, args.game), args.copies)
+    start = time.perf_counter()
+    stats = asyncio.get_event_loop().run_until_complete(replay(entries, args.speed))
+    report(stats, time.perf_counter() - start)
+    if args.digest:
+        for game in sorted(GAME_STORAGE.values(), key=lambda game: game.gameId):
+            print('%s %s' % (game.gameId, digest(game)))
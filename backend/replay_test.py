@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+import recording
+import replay
+from main import GAME_STORAGE, DICTS, DetachedConnection, consumer
+from main_test import playRounds, sendEvent
+
+
+class Client(DetachedConnection):
+    def __init__(self, userIdHash):
+        super().__init__(userIdHash, 'session')
+        self.received = []
+
+    async def send(self, event, data, gameId):
+        self.received.append((event, data))
+
+
+async def recordGame(monkeypatch, path, dictionary=None):
+    recorder = recording.EventRecorder(path)
+    monkeypatch.setattr(sys.modules['main'], 'RECORDER', recorder)
+    clients = {str(i): Client(str(i)) for i in range(4)}
+    await sendEvent(clients['0'], 'gameCreated', {'game': {'wordsPerPlayer': 5}, 'player': {'name': 'owner'}})
+    gameId = clients['0'].received[0][1]['gameId']
+    for userIdHash, client in clients.items():
+        await sendEvent(client, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_' + userIdHash}})
+        words = None if dictionary else [userIdHash + '_' + str(i) for i in range(5)]
+        await sendEvent(client, 'putWordsInHat', {'gameId': gameId, 'dictionary': dictionary, 'words': words})
+    await sendEvent(clients['0'], 'gameStarted', {'gameId': gameId, 'secondsPerRound': 30, 'gameMode': 'CIRCLE'})
+    game = GAME_STORAGE[gameId]
+    await playRounds(game, clients, 3, 'GUESSED')
+    # an event failing in its handler is recorded, and fails the same way when replayed
+    await sendEvent(clients['1'], 'replayPreviousRound', {'gameId': gameId, 'roundNumber': game.roundNumber + 1})
+    await playRounds(game, clients, 2, 'NOT_GUESSED')
+    recorder.stop()
+    return gameId, replay.digest(GAME_STORAGE.pop(gameId))
+
+
+@pytest.mark.asyncio
+async def test_replay_reproduces_recorded_game(monkeypatch, tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    gameId, expected = await recordGame(monkeypatch, path)
+    games = recording.load([path])
+    assert list(games) == [gameId]
+    assert games[gameId][0][2] == 'gameCreated' and 'seed' in games[gameId][0][3]
+
+    entries = replay.schedule(games, copies=3)
+    stats = await replay.replay(entries)
+    assert stats.games == 3 and stats.events == 3 * len(games[gameId])
+    assert dict(stats.failures) == {'replayPreviousRound': 3}
+    assert stats.messages > 0
+    assert replay.digest(GAME_STORAGE[gameId]) == expected
+    original = dict(GAME_STORAGE[gameId].toSnapshot(), gameId=None)
+    for copyId in [gameId + '#1', gameId + '#2']:
+        assert dict(GAME_STORAGE[copyId].toSnapshot(), gameId=None) == original
+    for copyId in [gameId, gameId + '#1', gameId + '#2']:
+        GAME_STORAGE.pop(copyId)
+
+
+@pytest.mark.asyncio
+async def test_replay_dictionary_game(monkeypatch, tmp_path):
+    dictsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dicts')
+    for name in list(DICTS):
+        monkeypatch.delitem(DICTS, name)
+    replay.loadDictionaries(dictsDir)
+    path = str(tmp_path / 'events.jsonl')
+    gameId, expected = await recordGame(monkeypatch, path, 'simple')
+    # replayed in a process that starts without dictionaries
+    DICTS.clear()
+    replay.loadDictionaries(dictsDir)
+    stats = await replay.replay(replay.schedule(recording.load([path])))
+    assert stats.failures['putWordsInHat'] == 0
+    assert replay.digest(GAME_STORAGE.pop(gameId)) == expected
+    DICTS.clear()
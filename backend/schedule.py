@@ -0,0 +1,49 @@
+import collections
+
+Round = collections.namedtuple('Round', ['roundNumber', 'explainPlayerIndex', 'guessPlayerIndex',
+                                         'circleNumber', 'epochNumber', 'pairIndex', 'explainInPairPlayerIndex'])
+
+
+class RoundSchedule:
+    # Who explains to whom in any round, straight from the round number.
+    # CIRCLE: the explainer goes round the circle, the guesser sits g places after the
+    #   explainer, g = 1, 2, .., n-1 moves on every circle; an epoch is n-1 circles.
+    # RANDOM_PAIRS, ASSIGNED_PAIRS: pairs take turns, players of a pair swap roles every
+    #   circle; an epoch is two circles.
+    # Negative round numbers extend the schedule backwards, the way replaying rounds does.
+    # base is the Round a CIRCLE game was in when its number of players changed: the schedule
+    # goes on from there, the explainer moving to the next index and the guesser keeping its
+    # distance until the circle ends, with circle and epoch numbers counted on from the base's.
+    def __init__(self, gameMode, numPlayers, pairs=None, base=None):
+        if gameMode not in ('CIRCLE', 'RANDOM_PAIRS', 'ASSIGNED_PAIRS'):
+            raise ValueError('Unknown mode: ', gameMode)
+        self.gameMode = gameMode
+        self.numPlayers = numPlayers
+        self.pairs = pairs
+        self._roundShift = self._circleShift = self._epochShift = 0
+        if base is not None and gameMode == 'CIRCLE' and numPlayers > 1:
+            base = Round(*base)
+            n = numPlayers
+            # the circle of the plain schedule whose guessers are as far from the explainers
+            distance = (base.guessPlayerIndex - base.explainPlayerIndex) % n or 1
+            self._roundShift = (distance - 1) * n + base.explainPlayerIndex % n - base.roundNumber
+            self._circleShift = base.circleNumber - (distance - 1)
+            self._epochShift = base.epochNumber
+
+    def __getitem__(self, roundNumber):
+        if self.gameMode == 'CIRCLE':
+            n = self.numPlayers
+            circleNumber, explainPlayerIndex = divmod(roundNumber + self._roundShift, n)
+            if n == 1:
+                return Round(roundNumber, 0, 1, circleNumber, circleNumber + 1, None, None)
+            guessPlayerIndex = (1 + circleNumber % (n - 1) + explainPlayerIndex) % n
+            return Round(roundNumber, explainPlayerIndex, guessPlayerIndex, circleNumber + self._circleShift,
+                         circleNumber // (n - 1) + self._epochShift, None, None)
+        circleNumber, pairIndex = divmod(roundNumber, len(self.pairs))
+        explainInPair = circleNumber % 2
+        pair = self.pairs[pairIndex]
+        return Round(roundNumber, pair[explainInPair], pair[1 - explainInPair],
+                     circleNumber, circleNumber // 2, pairIndex, explainInPair)
+
+    def upcoming(self, roundNumber, count):
+        return [self[number] for number in range(roundNumber + 1, roundNumber + 1 + count)]
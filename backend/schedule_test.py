@@ -0,0 +1,125 @@
+import pytest
+
+from schedule import RoundSchedule
+
+
+class SteppingGame:
+    # the round stepping Game.startRound and Game.replayPreviousRound did before RoundSchedule
+    def __init__(self, gameMode, numPlayers, pairs=None):
+        self.gameMode = gameMode
+        self.n = numPlayers
+        self.pairs = pairs
+        self.explain = self.guess = self.round = self.pairIndex = None
+        self.circle = self.epoch = None
+        self.explainInPair = 0
+
+    def forward(self):
+        if self.gameMode == 'CIRCLE':
+            if self.explain is None:
+                self.explain = self.guess = self.round = self.circle = -1
+                self.epoch = 0
+            self.round += 1
+            self.explain = (self.explain + 1) % self.n
+            if self.explain == 0:
+                self.circle += 1
+                self.guess = (self.guess + 2) % self.n
+                if self.guess == 0:
+                    self.guess += 1
+                    self.epoch += 1
+            else:
+                self.guess = (self.guess + 1) % self.n
+        else:
+            if self.round is None:
+                self.round = self.pairIndex = -1
+                self.circle = self.epoch = 0
+            self.round += 1
+            self.pairIndex += 1
+            if self.pairIndex >= len(self.pairs):
+                self.pairIndex = 0
+                if self.circle % 2 == 1:
+                    self.epoch += 1
+                self.circle += 1
+                self.explainInPair = 1 - self.explainInPair
+            self.explain, self.guess = self.pairs[self.pairIndex][self.explainInPair], \
+                self.pairs[self.pairIndex][1 - self.explainInPair]
+
+    def back(self):
+        if self.gameMode == 'CIRCLE':
+            self.round -= 1
+            self.explain = (self.explain - 1) % self.n
+            if self.explain == self.n - 1:
+                self.circle -= 1
+                self.guess = (self.guess - 2) % self.n
+                if self.guess == self.n - 1:
+                    self.guess -= 1
+                    self.epoch -= 1
+            else:
+                self.guess = (self.guess - 1) % self.n
+        else:
+            self.round -= 1
+            self.pairIndex -= 1
+            if self.pairIndex < 0:
+                self.pairIndex = len(self.pairs) - 1
+                self.circle -= 1
+                if self.circle % 2 == 1:
+                    self.epoch -= 1
+                self.explainInPair = 1 - self.explainInPair
+            self.explain, self.guess = self.pairs[self.pairIndex][self.explainInPair], \
+                self.pairs[self.pairIndex][1 - self.explainInPair]
+
+    def state(self):
+        return (self.round, self.explain, self.guess, self.circle, self.epoch)
+
+
+def scheduledState(scheduled):
+    return (scheduled.roundNumber, scheduled.explainPlayerIndex, scheduled.guessPlayerIndex,
+            scheduled.circleNumber, scheduled.epochNumber)
+
+
+@pytest.mark.parametrize('numPlayers', range(1, 11))
+@pytest.mark.parametrize('gameMode', ['CIRCLE', 'RANDOM_PAIRS'])
+def test_schedule_matches_stepping(gameMode, numPlayers):
+    pairs = None
+    if gameMode != 'CIRCLE':
+        if numPlayers % 2 == 1:
+            return
+        pairs = [(i, i + 1) for i in range(0, numPlayers, 2)]
+    schedule = RoundSchedule(gameMode, numPlayers, pairs)
+    stepping = SteppingGame(gameMode, numPlayers, pairs)
+    for roundNumber in range(500):
+        stepping.forward()
+        assert scheduledState(schedule[roundNumber]) == stepping.state()
+    if numPlayers == 1:
+        # a single player guesses from index 1 going forward, stepping back has no sane answer
+        return
+    for roundNumber in range(499, -3, -1):
+        assert scheduledState(schedule[roundNumber]) == stepping.state()
+        stepping.back()
+
+
+@pytest.mark.parametrize('numPlayers', range(3, 9))
+def test_schedule_continues_with_fewer_players(numPlayers):
+    schedule = RoundSchedule('CIRCLE', numPlayers)
+    for baseRound in range(3 * numPlayers * numPlayers):
+        stepping = SteppingGame('CIRCLE', numPlayers)
+        for roundNumber in range(baseRound + 1):
+            stepping.forward()
+        stepping.n -= 1
+        if stepping.explain % stepping.n == stepping.guess % stepping.n:
+            # stepping on would make the explainer guess too, the schedule moves the guesser on
+            continue
+        continued = RoundSchedule('CIRCLE', numPlayers - 1, base=schedule[baseRound])
+        for roundNumber in range(baseRound + 1, baseRound + 100):
+            stepping.forward()
+            assert scheduledState(continued[roundNumber]) == stepping.state()
+
+
+def test_upcoming():
+    schedule = RoundSchedule('CIRCLE', 4)
+    assert [(r.explainPlayerIndex, r.guessPlayerIndex) for r in schedule.upcoming(2, 3)] == [(3, 0), (0, 2), (1, 3)]
+    assert schedule.upcoming(10 ** 9, 1)[0] == schedule[10 ** 9 + 1]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        RoundSchedule('SOLO', 3)
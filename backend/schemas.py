@@ -0,0 +1,91 @@
+# Declarative schemas of inbound event data, compiled once into nested validator closures.
+# A spec is one of:
+#   str, int, float, bool   a value of that type (float takes ints too, int and float take no bools)
+#   None                    null
+#   object                  any value
+#   (spec, spec, ...)       any of the specs
+#   {'a', 'b'} (a set)      one of these values
+#   [spec]                  a list of values matching spec
+#   {'key': spec, 'optional?': spec, ...: object}
+#                           an object; keys ending with '?' may be missing, without a ... key
+#                           other keys are refused (objects that are passed on as **kwargs)
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def typeName(value):
+    return 'null' if value is None else type(value).__name__
+
+
+def compileSpec(spec, path='data'):
+    if spec is object:
+        return lambda value: None
+    if spec is None:
+        spec = type(None)
+    if isinstance(spec, type):
+        types = (int, float) if spec is float else (spec,)
+
+        def checkType(value):
+            if type(value) not in types:
+                raise SchemaError('%s: expected %s, got %s' % (path, spec.__name__, typeName(value)))
+        return checkType
+    if isinstance(spec, (set, frozenset)):
+        allowed = frozenset(spec)
+
+        def checkValue(value):
+            if type(value) not in (str, int) or value not in allowed:
+                raise SchemaError('%s: expected one of %s, got %r' % (path, sorted(allowed), value))
+        return checkValue
+    if isinstance(spec, tuple):
+        alternatives = [compileSpec(alternative, path) for alternative in spec]
+
+        def checkAny(value):
+            for check in alternatives:
+                try:
+                    check(value)
+                    return
+                except SchemaError:
+                    pass
+            raise SchemaError('%s: unexpected %s' % (path, typeName(value)))
+        return checkAny
+    if isinstance(spec, list):
+        checkItem = compileSpec(spec[0], path + '[]')
+
+        def checkList(value):
+            if type(value) is not list:
+                raise SchemaError('%s: expected list, got %s' % (path, typeName(value)))
+            for item in value:
+                checkItem(item)
+        return checkList
+    if isinstance(spec, dict):
+        required = []
+        checks = {}
+        for key, item in spec.items():
+            if key is Ellipsis:
+                continue
+            name = key[:-1] if key.endswith('?') else key
+            checks[name] = compileSpec(item, path + '.' + name)
+            if not key.endswith('?'):
+                required.append(name)
+        closed = Ellipsis not in spec
+
+        def checkObject(value):
+            if type(value) is not dict:
+                raise SchemaError('%s: expected object, got %s' % (path, typeName(value)))
+            for key in required:
+                if key not in value:
+                    raise SchemaError('%s: missing %s' % (path, key))
+            for key, item in value.items():
+                check = checks.get(key)
+                if check is not None:
+                    check(item)
+                elif closed:
+                    raise SchemaError('%s: unexpected key %s' % (path, key))
+        return checkObject
+    raise TypeError('Bad schema spec: %r' % (spec,))
+
+
+def compileSchemas(schemas):
+    return {event: compileSpec(spec) for event, spec in schemas.items()}
@@ -0,0 +1,40 @@
+import pytest
+
+from schemas import SchemaError, compileSchemas, compileSpec
+
+
+def test_compiled_spec():
+    check = compileSpec({'gameId': str, 'count?': int, 'ratio': (float, None), 'mode': {'A', 'B'},
+                         'pairs': [[str]], 'player': {'name': str}, ...: object})
+    check({'gameId': 'g', 'ratio': 1, 'mode': 'A', 'pairs': [['a', 'b']], 'player': {'name': 'n'}, 'extra': [1]})
+    check({'gameId': 'g', 'count': 2, 'ratio': None, 'mode': 'B', 'pairs': [], 'player': {'name': 'n'}})
+    bad = [
+        ({'ratio': 1, 'mode': 'A', 'pairs': [], 'player': {'name': 'n'}}, 'data: missing gameId'),
+        ({'gameId': 1, 'ratio': 1, 'mode': 'A', 'pairs': [], 'player': {'name': 'n'}},
+         'data.gameId: expected str, got int'),
+        ({'gameId': 'g', 'count': True, 'ratio': 1, 'mode': 'A', 'pairs': [], 'player': {'name': 'n'}},
+         'data.count: expected int, got bool'),
+        ({'gameId': 'g', 'ratio': 'x', 'mode': 'A', 'pairs': [], 'player': {'name': 'n'}},
+         'data.ratio: unexpected str'),
+        ({'gameId': 'g', 'ratio': 1, 'mode': ['A'], 'pairs': [], 'player': {'name': 'n'}},
+         "data.mode: expected one of ['A', 'B'], got ['A']"),
+        ({'gameId': 'g', 'ratio': 1, 'mode': 'A', 'pairs': [['a', 2]], 'player': {'name': 'n'}},
+         'data.pairs[][]: expected str, got int'),
+        ({'gameId': 'g', 'ratio': 1, 'mode': 'A', 'pairs': [], 'player': {'name': 'n', 'owner': True}},
+         'data.player: unexpected key owner'),
+        ([], 'data: expected object, got list'),
+    ]
+    for value, error in bad:
+        with pytest.raises(SchemaError) as info:
+            check(value)
+        assert str(info.value) == error
+
+
+def test_compile_schemas():
+    validators = compileSchemas({'wordGuessed': {'gameId': str}, 'anything': object})
+    validators['wordGuessed']({'gameId': 'g'})
+    validators['anything'](None)
+    with pytest.raises(SchemaError):
+        validators['wordGuessed']({'gameId': None})
+    with pytest.raises(TypeError):
+        compileSpec(1)
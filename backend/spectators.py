@@ -0,0 +1,81 @@
+import asyncio
+
+# Spectators watch a game without being its players: they are not in Game.players, so the
+# broadcasts of game events never loop over them. A game event only marks the game dirty,
+# and once per interval one snapshot frame of every dirty game is built, encoded once and
+# queued for all of its spectators. Spectators joining in between get the cached frame.
+
+C_SPECTATOR_INTERVAL = 1.0
+
+
+class SpectatorHub:
+    def __init__(self, snapshot, interval=C_SPECTATOR_INTERVAL):
+        # snapshot(gameId) returns the frame for the game's spectators, None when the game is gone
+        self.snapshot = snapshot
+        self.interval = interval
+        self._spectators = {}
+        self._frames = {}
+        self._dirty = set()
+
+    def __len__(self):
+        return sum(len(connections) for connections in self._spectators.values())
+
+    def count(self, gameId):
+        return len(self._spectators.get(gameId, ()))
+
+    def add(self, gameId, connection):
+        if connection.closed:
+            return
+        self._spectators.setdefault(gameId, set()).add(connection)
+        frame = self._current(gameId)
+        if frame is not None:
+            connection.sendFrame(frame, gameId, log=False)
+
+    def remove(self, gameId, connection):
+        connections = self._spectators.get(gameId)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            self._forget(gameId)
+
+    def touch(self, gameId):
+        if gameId in self._spectators:
+            self._dirty.add(gameId)
+            self._frames.pop(gameId, None)
+
+    def _current(self, gameId):
+        frame = self._frames.get(gameId)
+        if frame is None:
+            frame = self.snapshot(gameId)
+            if frame is not None:
+                self._frames[gameId] = frame
+        return frame
+
+    def _forget(self, gameId):
+        self._spectators.pop(gameId, None)
+        self._frames.pop(gameId, None)
+        self._dirty.discard(gameId)
+
+    def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        for gameId in dirty:
+            if gameId not in self._spectators:
+                continue
+            frame = self._current(gameId)
+            if frame is None:
+                self._forget(gameId)
+                continue
+            connections = self._spectators[gameId]
+            for connection in list(connections):
+                if connection.closed:
+                    connections.discard(connection)
+                else:
+                    connection.sendFrame(frame, gameId, log=False)
+            if not connections:
+                self._forget(gameId)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
@@ -0,0 +1,49 @@
+from spectators import SpectatorHub
+
+
+class Watcher:
+    def __init__(self):
+        self.closed = False
+        self.received = []
+
+    def sendFrame(self, frame, gameId, log=True):
+        self.received.append(frame)
+
+
+def test_snapshots_are_shared_and_throttled():
+    built = []
+
+    def snapshot(gameId):
+        if gameId == 'gone':
+            return None
+        built.append(gameId)
+        return (gameId, len(built))
+
+    hub = SpectatorHub(snapshot)
+    watchers = [Watcher() for i in range(100)]
+    for watcher in watchers:
+        hub.add('game', watcher)
+    # joiners get the cached frame, it is built once
+    assert built == ['game'] and len(hub) == 100
+    assert all(watcher.received == [('game', 1)] for watcher in watchers)
+
+    # any number of changes in an interval: one new frame for everybody
+    for i in range(10):
+        hub.touch('game')
+    hub.touch('unwatched')
+    hub.flush()
+    hub.flush()
+    assert built == ['game', 'game']
+    assert all(watcher.received == [('game', 1), ('game', 2)] for watcher in watchers)
+
+    watchers[0].closed = True
+    hub.remove('game', watchers[1])
+    hub.touch('game')
+    hub.flush()
+    assert hub.count('game') == 98 and watchers[1].received[-1] == ('game', 2)
+
+    # spectators of a game that is gone are forgotten
+    hub.add('gone', watchers[2])
+    hub.touch('gone')
+    hub.flush()
+    assert hub.count('gone') == 0
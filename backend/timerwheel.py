@@ -0,0 +1,58 @@
+import asyncio
+import math
+import time
+
+
+class TimerWheel:
+    # Hashed timing wheel: one task ticks every `tick` seconds for all timers. A timer sits in
+    # the slot of the tick it is due on, timers a whole lap or more away wait there for
+    # their lap. Scheduling and cancelling are O(1), a tick only looks at one slot.
+    def __init__(self, tick=1.0, slots=512, clock=time.monotonic):
+        self.tick = tick
+        self._clock = clock
+        self._slots = [{} for i in range(slots)]
+        self._slotOf = {}
+        self._lastTick = self._tickOf(clock())
+
+    def __len__(self):
+        return len(self._slotOf)
+
+    def __contains__(self, key):
+        return key in self._slotOf
+
+    def _tickOf(self, moment):
+        return math.floor(moment / self.tick)
+
+    def schedule(self, key, delay, callback):
+        # replaces the timer of the same key
+        self.cancel(key)
+        deadline = self._clock() + delay
+        slot = max(math.ceil(deadline / self.tick), self._lastTick + 1) % len(self._slots)
+        self._slots[slot][key] = (deadline, callback)
+        self._slotOf[key] = slot
+
+    def cancel(self, key):
+        slot = self._slotOf.pop(key, None)
+        if slot is not None:
+            self._slots[slot].pop(key)
+
+    def advance(self):
+        # fires the callbacks of every timer due by now
+        now = self._clock()
+        currentTick = self._tickOf(now)
+        ticks = range(self._lastTick + 1, currentTick + 1)
+        if len(ticks) > len(self._slots):
+            ticks = range(currentTick - len(self._slots) + 1, currentTick + 1)
+        self._lastTick = currentTick
+        for tickNumber in ticks:
+            timers = self._slots[tickNumber % len(self._slots)]
+            due = [key for key, (deadline, callback) in timers.items() if deadline <= now]
+            for key in due:
+                deadline, callback = timers.pop(key)
+                del self._slotOf[key]
+                callback()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick - self._clock() % self.tick)
+            self.advance()
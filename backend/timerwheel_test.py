@@ -0,0 +1,63 @@
+import time
+
+from timerwheel import TimerWheel
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fire_cancel_replace():
+    clock = Clock()
+    wheel = TimerWheel(tick=1, slots=8, clock=clock)
+    fired = []
+    wheel.schedule('a', 2.5, lambda: fired.append('a'))
+    wheel.schedule('b', 3, lambda: fired.append('b'))
+    wheel.schedule('c', 1, lambda: fired.append('c'))
+    wheel.cancel('c')
+    wheel.schedule('b', 20, lambda: fired.append('b late'))
+    assert len(wheel) == 2 and 'b' in wheel
+    clock.now += 2
+    wheel.advance()
+    assert fired == []
+    clock.now += 1
+    wheel.advance()
+    assert fired == ['a']
+    # 'b' shares its slot with ticks of earlier laps
+    for i in range(17):
+        clock.now += 1
+        wheel.advance()
+    assert fired == ['a', 'b late']
+    assert len(wheel) == 0
+
+
+def test_stalled_loop_fires_everything_due():
+    clock = Clock()
+    wheel = TimerWheel(tick=1, slots=4, clock=clock)
+    fired = []
+    for i in range(10):
+        wheel.schedule(i, i, lambda i=i: fired.append(i))
+    clock.now += 100
+    wheel.advance()
+    assert sorted(fired) == list(range(10))
+
+
+def test_many_games():
+    clock = Clock()
+    wheel = TimerWheel(tick=0.5, clock=clock)
+    fired = []
+    for gameIndex in range(100000):
+        wheel.schedule(gameIndex, 30 + gameIndex % 90, lambda: fired.append(None))
+    start = time.perf_counter()
+    for i in range(20):
+        clock.now += 0.5
+        wheel.advance()
+    idleTicks = time.perf_counter() - start
+    assert fired == [] and idleTicks < 0.05
+    clock.now += 200
+    wheel.advance()
+    assert len(fired) == 100000 and len(wheel) == 0
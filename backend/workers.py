@@ -0,0 +1,183 @@
+import argparse
+import array
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import socket
+import tempfile
+import urllib.parse
+import zlib
+
+# Multi-process mode: a thin front process accepts TCP connections, peeks at the
+# HTTP upgrade request without consuming it, and hands the socket itself over a
+# Unix socket to the worker owning the game (SCM_RIGHTS). The front never touches
+# WebSocket frames, every worker runs the usual asyncio server on its own core.
+
+C_MAX_REQUEST_HEAD = 16384
+C_REQUEST_HEAD_TIMEOUT = 10
+
+
+def workerOf(gameId, workers):
+    return zlib.crc32(gameId.encode()) % workers
+
+
+def parseQuery(requestHead):
+    requestLine = requestHead.decode('latin-1').split('\r\n', 1)[0].split(' ')
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(requestLine[1]).query) if len(requestLine) > 1 else {}
+
+
+def parseRoutingKeys(requestHead):
+    # (gameId, userId) from the query string or the cookies of the upgrade request
+    lines = requestHead.decode('latin-1').split('\r\n')
+    gameId = parseQuery(requestHead).get('gameId', [None])[0]
+    userId = None
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name.strip().lower() != 'cookie':
+            continue
+        for cookie in value.split(';'):
+            cookieName, _, cookieValue = cookie.strip().partition('=')
+            if cookieName == 'gameId' and gameId is None:
+                gameId = cookieValue
+            elif cookieName == 'userId':
+                userId = cookieValue
+    return gameId or None, userId or None
+
+
+def sendSocket(channel, sock):
+    channel.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [sock.fileno()]))])
+
+
+def receiveSockets(channel):
+    fds = array.array('i')
+    data, ancdata, flags, address = channel.recvmsg(64, socket.CMSG_LEN(64 * fds.itemsize))
+    if not data:
+        raise ConnectionError('front process is gone')
+    for level, kind, cmsgData in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsgData[:len(cmsgData) - (len(cmsgData) % fds.itemsize)])
+    return [socket.socket(fileno=fd) for fd in fds]
+
+
+async def peekRequestHead(loop, sock):
+    readable = asyncio.Event()
+    loop.add_reader(sock.fileno(), readable.set)
+    try:
+        while True:
+            await readable.wait()
+            readable.clear()
+            head = sock.recv(C_MAX_REQUEST_HEAD, socket.MSG_PEEK)
+            if not head:
+                raise ConnectionError('closed before the request')
+            if b'\r\n\r\n' in head or len(head) >= C_MAX_REQUEST_HEAD:
+                return head.split(b'\r\n\r\n', 1)[0]
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+class Front:
+    def __init__(self, channels):
+        self.channels = channels
+        self.roundRobin = itertools.cycle(range(len(channels)))
+        self.routed = [0] * len(channels)
+
+    def chooseWorker(self, requestHead):
+        # every worker has its own metrics: /metrics?worker=N
+        worker = parseQuery(requestHead).get('worker', [''])[0]
+        if worker.isdigit() and int(worker) < len(self.channels):
+            return int(worker)
+        gameId, userId = parseRoutingKeys(requestHead)
+        if gameId is not None:
+            return workerOf(gameId, len(self.channels))
+        if userId is not None:
+            return workerOf(userId, len(self.channels))
+        return next(self.roundRobin)
+
+    async def route(self, loop, sock):
+        try:
+            head = await asyncio.wait_for(peekRequestHead(loop, sock), C_REQUEST_HEAD_TIMEOUT)
+            worker = self.chooseWorker(head)
+            sendSocket(self.channels[worker], sock)
+            self.routed[worker] += 1
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+        finally:
+            sock.close()
+
+    async def serve(self, host, port):
+        loop = asyncio.get_event_loop()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(1024)
+        listener.setblocking(False)
+        while True:
+            sock, address = await loop.sock_accept(listener)
+            sock.setblocking(False)
+            asyncio.ensure_future(self.route(loop, sock))
+
+
+def runWorker(index, workers, channel, journalPath):
+    # imported after fork: main starts the access log thread on import
+    import main
+    import websockets
+
+    main.C_WORKERS = workers
+    main.C_WORKER_INDEX = index
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    main.prepareServer(journalPath)
+
+    # A regular websockets server on a private Unix socket nobody connects to: the sockets
+    # handed over by the front process get protocols made like its own, registered with it.
+    privatePath = os.path.join(tempfile.mkdtemp(), 'worker.sock')
+    options = {'subprotocols': main.codec.SUBPROTOCOLS}
+    wsServer = loop.run_until_complete(
+        websockets.unix_serve(main.server, privatePath, create_protocol=main.ServerProtocol, **options))
+    factory = functools.partial(main.ServerProtocol, main.server, wsServer, **options)
+
+    def accept():
+        try:
+            socks = receiveSockets(channel)
+        except ConnectionError:
+            loop.stop()
+            return
+        for sock in socks:
+            sock.setblocking(False)
+            asyncio.ensure_future(loop.connect_accepted_socket(factory, sock))
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), accept)
+    loop.run_forever()
+
+
+def runServer(host, port, workers, journalPattern):
+    context = multiprocessing.get_context('fork')
+    channels = []
+    processes = []
+    for index in range(workers):
+        frontEnd, workerEnd = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        process = context.Process(target=runWorker, args=(index, workers, workerEnd, journalPattern % index),
+                                  daemon=True)
+        process.start()
+        workerEnd.close()
+        channels.append(frontEnd)
+        processes.append(process)
+    try:
+        asyncio.get_event_loop().run_until_complete(Front(channels).serve(host, port))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the game server as several worker processes')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--journal', default='games.%d.sqlite3',
+                        help='journal path pattern, %%d is the worker index')
+    args = parser.parse_args()
+    runServer(args.host, args.port, args.workers, args.journal)
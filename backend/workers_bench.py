@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+import websockets
+
+
+def randomId():
+    return '%016x' % random.getrandbits(64)
+
+
+async def connect(uri, gameId=None):
+    cookie = 'userId=bench_%s; sessionId=bench_%s;' % (randomId(), randomId())
+    if gameId is not None:
+        cookie = 'gameId=%s; ' % gameId + cookie
+    return await websockets.connect(uri, extra_headers={'Cookie': cookie})
+
+
+async def send(websocket, event, data):
+    await websocket.send(json.dumps({'event': event, 'data': data}))
+
+
+async def receive(websocket, event):
+    while True:
+        message = json.loads(await websocket.recv())
+        if message['event'] == event:
+            return message['data']
+
+
+async def playGame(uri, numPlayers, deadline, counts):
+    owner = await connect(uri)
+    await send(owner, 'gameCreated', {'game': {'wordsPerPlayer': 10}, 'player': {'name': 'owner'}})
+    gameId = (await receive(owner, 'gameCreated'))['gameId']
+    players = [owner] + [await connect(uri, gameId) for i in range(numPlayers - 1)]
+    for index, websocket in enumerate(players):
+        await send(websocket, 'playerJoined', {'gameId': gameId, 'player': {'name': 'player_%d' % index}})
+        await receive(websocket, 'gameUpdated')
+
+    async def updateLoop(websocket):
+        while time.monotonic() < deadline:
+            await send(websocket, 'playerUpdated', {'gameId': gameId, 'player': {'observer': False}})
+            await receive(websocket, 'playersUpdated')
+            counts[0] += 1
+
+    await asyncio.gather(*[updateLoop(websocket) for websocket in players])
+    for websocket in players:
+        await websocket.close()
+
+
+def runClient(uri, numGames, numPlayers, duration, results):
+    async def run():
+        counts = [0]
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*[playGame(uri, numPlayers, deadline, counts) for i in range(numGames)])
+        return counts[0]
+    results.put(asyncio.new_event_loop().run_until_complete(run()))
+
+
+def measure(workers, args):
+    server = subprocess.Popen([sys.executable, 'workers.py', '--port', str(args.port), '--workers', str(workers),
+                               '--journal', os.path.join(args.tmp, 'bench.%d.sqlite3')])
+    try:
+        time.sleep(args.startup)
+        results = multiprocessing.Queue()
+        uri = 'ws://localhost:%d/wsapiv1' % args.port
+        clients = [multiprocessing.Process(target=runClient,
+                                           args=(uri, args.games, args.players, args.duration, results))
+                   for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        events = sum(results.get() for client in clients)
+        for client in clients:
+            client.join()
+        return events / args.duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Handled events per second by number of worker processes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=os.cpu_count(), help='load generating processes')
+    parser.add_argument('--games', type=int, default=20, help='games per client process')
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--startup', type=float, default=2)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--tmp', default='/tmp')
+    args = parser.parse_args()
+    baseline = None
+    print('%8s %12s %8s' % ('workers', 'events/s', 'speedup'))
+    for workers in args.workers:
+        throughput = measure(workers, args)
+        baseline = baseline or throughput
+        print('%8d %12.0f %8.2f' % (workers, throughput, throughput / baseline))
@@ -0,0 +1,38 @@
+import socket
+
+import main
+from workers import Front, parseRoutingKeys, receiveSockets, sendSocket, workerOf
+
+
+def test_routing_keys():
+    head = (b'GET /wsapiv1 HTTP/1.1\r\nHost: onlinehat.xyz\r\n'
+            b'Cookie: gameId=abc; userId=u1; sessionId=s1;\r\n')
+    assert parseRoutingKeys(head) == ('abc', 'u1')
+    head = b'GET /wsapiv1?gameId=fromQuery HTTP/1.1\r\ncookie: gameId=abc\r\n'
+    assert parseRoutingKeys(head) == ('fromQuery', None)
+    assert parseRoutingKeys(b'GET / HTTP/1.1\r\nHost: x\r\n') == (None, None)
+
+
+def test_metrics_choose_worker():
+    front = Front([None] * 4)
+    assert front.chooseWorker(b'GET /metrics?worker=2 HTTP/1.1\r\nCookie: gameId=abc\r\n') == 2
+    assert front.chooseWorker(b'GET /metrics?worker=9 HTTP/1.1\r\nCookie: gameId=abc\r\n') == workerOf('abc', 4)
+
+
+def test_new_game_ids_stay_on_worker(monkeypatch):
+    monkeypatch.setattr(main, 'C_WORKERS', 4)
+    monkeypatch.setattr(main, 'C_WORKER_INDEX', 3)
+    for i in range(20):
+        assert workerOf(main.newGameId(), 4) == 3
+
+
+def test_socket_handoff():
+    front, worker = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    client, accepted = socket.socketpair()
+    client.sendall(b'GET / HTTP/1.1\r\n\r\n')
+    sendSocket(front, accepted)
+    accepted.close()
+    handed, = receiveSockets(worker)
+    assert handed.recv(100) == b'GET / HTTP/1.1\r\n\r\n'
+    for sock in [front, worker, client, handed]:
+        sock.close()
@@ -181,6 +181,8 @@ class Game extends React.Component<IProps, IState> {
 
         this.eventHandlers.set('nextWord', this.nextWordHandler);
         this.eventHandlers.set('playerRemoved', this.props.playerRemoved);
+        this.eventHandlers.set('batch', this.batchHandler);
+        this.eventHandlers.set('eventRejected', this.eventRejectedHandler);
 
         this.ws = new WebSocket('wss://example.com/devnull');
         this.reconnectDelay = 10;
@@ -279,7 +281,8 @@ class Game extends React.Component<IProps, IState> {
         };
         this.sendEvent('playerJoined',
                        {'player': creator,
-                        'gameId': this.state.gameId});
+                        'gameId': this.state.gameId,
+                        'batchUpdates': true});
     }
 
     private reconnect() {
@@ -316,6 +319,15 @@ class Game extends React.Component<IProps, IState> {
         this.eventHandlers.get(event)(data['data']);
     }
 
+    private batchHandler = (data: any) => {
+        data['events'].forEach(
+            (item : any) => this.eventHandlers.get(item['event'])(item['data']));
+    }
+
+    private eventRejectedHandler = (data: any) => {
+        console.log('event rejected', data['event'], data['reason'], data['error']);
+    }
+
     private userIdHashHandler = (data: any) => {
         let myUserIdHash = data['userIdHash'];
         this.setState((prevState) => {